@@ -1,28 +1,71 @@
+from datetime import datetime
+from itertools import groupby, islice
+import json
 import logging
+import multiprocessing
+import os
+import sqlite3
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
 
 
 from .. import config
 from ..insta_crawler import exceptions as exc
+from ..insta_crawler import pipeline, scheduler, snapshots, work_queue
+from ..insta_crawler.authentication import HttpAuth, InstaAuth
+from ..insta_crawler.feeds import FeedCrawler, ShortcodeIndex
+from ..insta_crawler.graph import GraphCrawler
 from ..insta_crawler.insta import InstaCrawler
+from ..insta_crawler.insights import compute_insights, load_exports, PostsTable
+from ..insta_crawler.logs import setup_logging
+from ..insta_crawler.media import MediaPolicy
+from ..insta_crawler.models import Post, Storie
+from ..insta_crawler.monitor import PostsMonitor
+from ..insta_crawler.planner import CONTENT_TYPES, CrawlPlanner
+from ..insta_crawler.proxies import ProxyPool
+from ..insta_crawler.rate_limit import RateLimiter
+from ..insta_crawler.resilience import ResilientClient
+from ..insta_crawler.search import KINDS, SearchIndex
+from ..insta_crawler.service import CrawlerService
+from ..insta_crawler.stories_watcher import StoriesWatcher
+from ..insta_crawler.thumbnails import Thumbnailer
 from ..insta_crawler.utils import (download_all, download_file,
                                    export_as_csv, export_as_json,
+                                   print_crawl_plan_table, print_insights_table,
                                    print_single_post_info_table,
-                                   print_user_info_table)
+                                   print_user_info_table, use_cdn_proxies)
 
 import click
 
-logging.basicConfig(filename="cli_isntagram.log",
-                    format="%(asctime)s: %(name)s: %(levelname)s: %(funcName)s: %(lineno)s: %(message)s",
-                    level=logging.INFO)
+THUMBNAILS_INDEX = "thumbnails.sqlite"
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
 
 
 @click.group()
-def get_insta():
+@click.option("--log-level", default="INFO", show_default=True, envvar="LOG_LEVEL",
+              type=click.Choice(LOG_LEVELS, case_sensitive=False),
+              help="DEBUG adds a line per request. Also read from LOG_LEVEL.")
+@click.option("--log-file", default="cli_isntagram.log", show_default=True,
+              help="File the log goes to.")
+@click.option("--log-format", default="json", show_default=True, type=click.Choice(["json", "text"]),
+              help="JSON lines with the fields of the records, or plain text.")
+@click.option("--log-sample", multiple=True, metavar="CATEGORY=RATE",
+              help="Keep only this share of a category of lines, e.g. request=0.1. Can be repeated.")
+@click.pass_context
+def get_insta(ctx: click.Context, log_level: str, log_file: str, log_format: str, log_sample: Tuple[str, ...]) -> None:
     """
     Used to collect information and data from Instagram profile.
 
     """
 
+    try:
+        sample = {category: float(rate) for category, rate in (item.split("=", 1) for item in log_sample)}
+    except ValueError:
+        raise click.BadParameter("use CATEGORY=RATE, e.g. request=0.1", param_hint="--log-sample")
+    listener = setup_logging(path=log_file, level=getattr(logging, log_level.upper()),
+                             json_format=log_format == "json", sample=sample)
+    # the last records are written when the command ends
+    ctx.call_on_close(listener.stop)
+
     click.echo("\nStarting...")
     click.echo("OK, I am collecting some information...")
     click.echo("-" * 80)
@@ -30,104 +73,95 @@ def get_insta():
 
 
 @get_insta.command("cookie-user", short_help="cookie user info")
-@click.option("-C", "--cookie", required=True,
-              help="Cookie-string from your browser (ig_did and sessionid should be enough).")
-def cookie_user(cookie: str):
+def cookie_user() -> None:
     """
-    Gives an information about cookie-user.
+    Gives an information about the user logged in with LOGIN2.
 
     \b
     EXAMPLE:
-    python get_insta.py cookie-user \\
-    --cookie="ig_did=XXXXXXXX-YYYY-CCCC-AAAA-ZZZZZZZZZZZZ; sessionid=1111111111111111111111111;"
+    python get_insta.py cookie-user
     """
 
-    inst = InstaCrawler(cookie=cookie)
+    inst = _make_crawler()
     try:
         cookie_user = inst.get_cookie_user()
     except exc.BlockedByInstagramError as e:
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
         click.echo(e)
     else:
         click.echo("There it is:")
-        print_user_info_table(user_info=cookie_user)
+        print_user_info_table(user_info=dict(cookie_user))
 
 
 @get_insta.command("user-info", short_help="user info by URL")
 @click.option("-u", "--username", required=True,
               help="Username of the user you are interested in.")
-@click.option("-C", "--cookie", required=True,
-              help="Cookie-string from your browser (ig_did and sessionid should be enough).")
-def user_info(cookie: str, username: str):
+def user_info(username: str) -> None:
     """
     Gives information about the user by link to his profile.
 
     \b
     EXAMPLE:
     python get_insta.py user-info \\
-    --username="username" \\
-    --cookie="ig_did=XXXXXXXX-YYYY-CCCC-AAAA-ZZZZZZZZZZZZ; sessionid=1111111111111111111111111;"
+    --username="username"
     """
 
     user_url = "https://www.instagram.com/{username}/"
 
-    inst = InstaCrawler(cookie=cookie)
+    inst = _make_crawler()
 
     try:
         user_info = inst.get_user_info(url=user_url.format(username=username))
     except exc.BlockedByInstagramError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.NotFoundError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     else:
         click.echo("There it is:")
-        print_user_info_table(user_info=user_info)
+        print_user_info_table(user_info=dict(user_info))
 
 
 @get_insta.command("post", short_help="post info by URL")
 @click.option("-u", "--url", required=True, help="post URL")
-@click.option("-C", "--cookie", required=True,
-              help="Cookie-string from your browser (ig_did and sessionid should be enough).")
-def post(cookie: str, url: str):
+def post(url: str) -> None:
     """
     Gives information about the post by link to it.
 
     \b
     EXAMPLE:
     python get_insta.py post \\
-    --url="https://www.instagram.com/(p OR tv)/shortcode/" \\
-    --cookie="ig_did=XXXXXXXX-YYYY-CCCC-AAAA-ZZZZZZZZZZZZ; sessionid=1111111111111111111111111;"
+    --url="https://www.instagram.com/(p OR tv)/shortcode/"
     """
 
-    inst = InstaCrawler(cookie=cookie)
+    inst = _make_crawler()
 
     try:
         links = inst.get_single_post(url=url)
     except exc.BlockedByInstagramError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.NotFoundError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.PrivateProfileError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     else:
         click.echo("There it is:")
-        print_single_post_info_table(post_info=links)
+        print_single_post_info_table(post_info=dict(links))
 
         if click.confirm("\nWould you like to download the post content?",
                          abort=True):
-            for index, link in enumerate(links["post_content"]):
-                name = (f"{links['owner_username']}_{links['shortcode']}_{index + 1}"
+            for index, link in enumerate(links.post_content):
+                name = (f"{links.owner_username}_{links.shortcode}_{index + 1}"
                         f"{'.mp4' if '.mp4' in link else '.png'}")
 
                 download_file(url=link, content_type="posts",
-                              username=links["owner_username"], name=name)
-                logging.info(
-                    f'Downloded file: {link}, owner: {links["owner_username"]}, name: {name}')
+                              username=links.owner_username, name=name)
+                logging.info("Downloaded file: %s, owner: %s, name: %s", link, links.owner_username, name,
+                             extra={"category": "download", "user": links.owner_username, "file": name})
         click.echo("\nAll done")
 
 
@@ -138,9 +172,16 @@ def post(cookie: str, url: str):
                   case_sensitive=False))
 @click.option("-u", "--username", required=True,
               help="Username of the user you are interested in.")
-@click.option("-C", "--cookie", required=True,
-              help="Cookie-string from your browser ('ig_did' and 'sessionid' should be enough).")
-def category(cookie: str, username: str, content_type: str):
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]),
+              help="Only posts and igtvs taken at this date or later.")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]),
+              help="Only posts and igtvs taken at this date or earlier.")
+@click.option("--limit", type=int,
+              help="At most this many posts and igtvs, the newest first.")
+@click.option("--thumbnails", is_flag=True,
+              help="Make thumbnails of the media while it downloads.")
+def category(username: str, content_type: str, since: Optional[datetime],
+             until: Optional[datetime], limit: Optional[int], thumbnails: bool) -> None:
     """
     Collects all content and information about posts
     or highlights or stories or igtvs or all together
@@ -151,38 +192,39 @@ def category(cookie: str, username: str, content_type: str):
     python get_insta.py category \\
     --content-type="(posts OR stories OR highlights OR igtv OR all)" \\
     --username="username" \\
-    --cookie="ig_did=XXXXXXXX-YYYY-CCCC-AAAA-ZZZZZZZZZZZZ; sessionid=1111111111111111111111111;"
+    --since="2021-01-01" --limit=500 --thumbnails
     """
 
     user_url = f"https://www.instagram.com/{username}"
-    insta = InstaCrawler(cookie=cookie)
+    insta = _make_crawler()
+    bounds = {"since": _timestamp(since), "until": _timestamp(until), "limit": limit}
 
-    data = {}
+    data: Dict[str, List] = {}
     try:
         if content_type == "posts":
-            data[content_type] = insta.get_posts(url=user_url)
+            data[content_type] = insta.get_posts(url=user_url, **bounds)
         elif content_type == "stories":
             data[content_type] = insta.get_stories(url=user_url)
         elif content_type == "reels":
             data[content_type] = insta.get_highlights(url=user_url)
         elif content_type == "igtv":
-            data[content_type] = insta.get_all_igtv(url=user_url)
+            data[content_type] = insta.get_all_igtv(url=user_url, **bounds)
         elif content_type == "all":
             data = {
-                "posts": insta.get_posts(url=user_url),
+                "posts": insta.get_posts(url=user_url, **bounds),
                 "stories": insta.get_stories(url=user_url),
                 "highlights": insta.get_highlights(url=user_url),
-                "igtv": insta.get_all_igtv(url=user_url),
+                "igtv": insta.get_all_igtv(url=user_url, **bounds),
             }
     except exc.BlockedByInstagramError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.NotFoundError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.PrivateProfileError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     else:
         if sum([len(value) for value in data.values()]) == 0:
             click.echo("It looks like there is nothing to download.")
@@ -193,64 +235,84 @@ def category(cookie: str, username: str, content_type: str):
             if click.confirm("Would you like to save the page content as JSON?"):
                 export_as_json(data=data, username=username,
                                content_type="content")
-                logging.info(
-                    f'Exporting as JSON. Username: {username}, content-type: {"content"}')
+                logging.info("Exporting as JSON. Username: %s, content-type: %s", username, "content",
+                             extra={"category": "export", "format": "json", "user": username,
+                                    "content_type": "content"})
             click.echo("-" * 80)
 
             if click.confirm("Would you like to save the page content as CSV?"):
                 export_as_csv(data=data,
                               headers_row=config.category_headers_row,
                               username=username, content_type="content")
-                logging.info(
-                    f'Exporting as CSV. Username: {username}, content-type: {"content"}')
+                logging.info("Exporting as CSV. Username: %s, content-type: %s", username, "content",
+                             extra={"category": "export", "format": "csv", "user": username,
+                                    "content_type": "content"})
             click.echo("-" * 80)
 
             if click.confirm("Would you like to download the page content?",
                              abort=True):
-                for ct, value in data.items():
-                    if value:
-                        click.echo(f'Downloading {ct}...')
-                        download_all(posts=value,
-                                     content_type=ct,
-                                     username=username)
-                        logging.info(f'Downloading {ct}. Username: {username}')
-                        click.echo("-" * 80)
-                    else:
-                        continue
+                _download_content(data=data, username=username, insta=insta, thumbnails=thumbnails)
 
         click.echo("All done!")
 
 
+def _download_content(data: Dict, username: str, insta: InstaCrawler, thumbnails: bool) -> None:
+    # other processes make the thumbnails during the downloads
+    thumbnailer = Thumbnailer(index_path=THUMBNAILS_INDEX) if thumbnails else None
+    try:
+        for ct, value in data.items():
+            if value:
+                click.echo(f'Downloading {ct}...')
+                download_all(posts=value,
+                             content_type=ct,
+                             username=username,
+                             refresh=insta.refresh_media_links,
+                             on_file=thumbnailer.submit if thumbnailer else None)
+                logging.info("Downloading %s. Username: %s", ct, username,
+                             extra={"category": "download", "content_type": ct, "user": username})
+                click.echo("-" * 80)
+    finally:
+        if thumbnailer is not None:
+            click.echo("Finishing thumbnails...")
+            _echo_thumbnail_counts(thumbnailer.close())
+
+
+def _echo_thumbnail_counts(counts: Dict[str, int]) -> None:
+    click.echo(f"Thumbnails made: {counts['made']}, unchanged: {counts['skipped']}, failed: {counts['failed']}")
+    logging.info("Thumbnails: %s", counts, extra={"category": "thumbnails", **counts})
+
+
 @get_insta.command("followers", short_help="user followers")
 @click.option("-u", "--username", required=True,
               help="Username of the user you are interested in.")
-@click.option("-C", "--cookie", required=True,
-              help="Cookie-string from your browser (ig_did and sessionid should be enough).")
-def followers(cookie: str, username: str):
+@click.option("--limit", type=int,
+              help="At most this many followers.")
+def followers(username: str, limit: Optional[int]) -> None:
     """
     Collects all information about user followers.
 
     \b
     EXAMPLE:
     python get_insta.py followers \\
-    --username="username" \\
-    --cookie="ig_did=XXXXXXXX-YYYY-CCCC-AAAA-ZZZZZZZZZZZZ; sessionid=1111111111111111111111111;"
+    --username="username"
     """
 
     user_url = f"https://www.instagram.com/{username}"
 
-    insta = InstaCrawler(cookie=cookie)
+    insta = _make_crawler()
     try:
-        followers = insta.get_followers(url=user_url)
+        followers = insta.get_followers(url=user_url,
+                                        fields=config.followers_headers_row,
+                                        limit=limit)
     except exc.BlockedByInstagramError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.NotFoundError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.PrivateProfileError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     else:
         click.echo("All data has been collected")
         click.echo("-" * 80)
@@ -258,8 +320,9 @@ def followers(cookie: str, username: str):
                 "Would you like to download info about the pages that follow the user as JSON?"):
             export_as_json(data=followers, username=username,
                            content_type="followers")
-            logging.info(
-                f'Exporting as JSON. Username: {username}, content-type: {"content"}')
+            logging.info("Exporting as JSON. Username: %s, content-type: %s", username, "followers",
+                         extra={"category": "export", "format": "json", "user": username,
+                                "content_type": "followers"})
         click.echo("-" * 80)
 
         if click.confirm(
@@ -267,8 +330,9 @@ def followers(cookie: str, username: str):
             export_as_csv(data=followers, username=username,
                           content_type="followers",
                           headers_row=config.followers_headers_row)
-            logging.info(
-                f'Exporting as CSV. Username: {username}, content-type: {"content"}')
+            logging.info("Exporting as CSV. Username: %s, content-type: %s", username, "followers",
+                         extra={"category": "export", "format": "csv", "user": username,
+                                "content_type": "followers"})
 
         click.echo("-" * 80)
         click.echo("All done!")
@@ -277,9 +341,9 @@ def followers(cookie: str, username: str):
 @get_insta.command("followed-by-user", short_help="profiles followed by user")
 @click.option("-u", "--username", required=True,
               help="Username of the user you are interested in.")
-@click.option("-C", "--cookie", required=True,
-              help="Cookie-string from your browser (ig_did and sessionid should be enough).")
-def followed_by_user(cookie: str, username: str):
+@click.option("--limit", type=int,
+              help="At most this many profiles.")
+def followed_by_user(username: str, limit: Optional[int]) -> None:
     """
     Collects all information about users followed
     by requested profile owner.
@@ -287,24 +351,25 @@ def followed_by_user(cookie: str, username: str):
     \b
     EXAMPLE:
     python get_insta.py followed-by-user \\
-    --username="username" \\
-    --cookie="ig_did=XXXXXXXX-YYYY-CCCC-AAAA-ZZZZZZZZZZZZ; sessionid=1111111111111111111111111;"
+    --username="username"
     """
 
     user_url = f"https://www.instagram.com/{username}"
 
-    insta = InstaCrawler(cookie=cookie)
+    insta = _make_crawler()
     try:
-        user_follow = insta.get_followed_by_user(url=user_url)
+        user_follow = insta.get_followed_by_user(url=user_url,
+                                                 fields=config.followers_headers_row,
+                                                 limit=limit)
     except exc.BlockedByInstagramError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.NotFoundError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     except exc.PrivateProfileError as e:
         click.echo(e)
-        logging.error(f'Error: {repr(e)}')
+        logging.error("Error: %r", e)
     else:
         click.echo("All data has been collected")
         click.echo("-" * 80)
@@ -313,8 +378,9 @@ def followed_by_user(cookie: str, username: str):
                 "Would you like to download info about the pages followed by user as JSON?"):
             export_as_json(data=user_follow, username=username,
                            content_type="followed_by")
-            logging.info(
-                f'Exporting as JSON. Username: {username}, content-type: {"content"}')
+            logging.info("Exporting as JSON. Username: %s, content-type: %s", username, "followed_by",
+                         extra={"category": "export", "format": "json", "user": username,
+                                "content_type": "followed_by"})
         click.echo("-" * 80)
 
         if click.confirm(
@@ -322,8 +388,898 @@ def followed_by_user(cookie: str, username: str):
             export_as_csv(data=user_follow, username=username,
                           content_type="followed_by",
                           headers_row=config.followers_headers_row)
-            logging.info(
-                f'Exporting as CSV. Username: {username}, content-type: {"content"}')
+            logging.info("Exporting as CSV. Username: %s, content-type: %s", username, "followed_by",
+                         extra={"category": "export", "format": "csv", "user": username,
+                                "content_type": "followed_by"})
 
         click.echo("-" * 80)
         click.echo("All done!")
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[int]:
+    return int(value.timestamp()) if value is not None else None
+
+
+def _make_crawler(rate: Optional[float] = None,
+                  media_policy: Optional[MediaPolicy] = None) -> InstaCrawler:
+    if not config.login or not config.password:
+        raise click.UsageError("Set LOGIN2 and PASSWORD2 in the .env file.")
+
+    return InstaCrawler(login=config.login,
+                        password=config.password,
+                        authenticator=HttpAuth if config.auth_method == "http" else InstaAuth,
+                        rate_limiter=RateLimiter(rate=rate) if rate else None,
+                        media_policy=media_policy,
+                        http=_make_http_client())
+
+
+def _make_http_client() -> ResilientClient:
+    """
+    Spreads the requests over the proxies of PROXIES_FILE and the
+    media downloads over the ones of CDN_PROXIES_FILE, if set.
+    Profile lookups are hedged after HEDGE_AFTER seconds.
+    """
+    api_pool = None
+    if config.proxies_file:
+        api_pool = ProxyPool.from_file(config.proxies_file, max_concurrency=config.proxy_concurrency)
+    if config.cdn_proxies_file:
+        use_cdn_proxies(ProxyPool.from_file(config.cdn_proxies_file, max_concurrency=config.proxy_concurrency))
+
+    session = f"crawler-{os.getpid()}" if config.proxy_mode == "session" else None
+    return ResilientClient(hedge_after=config.hedge_after, proxy_pool=api_pool, proxy_session=session)
+
+
+@get_insta.command("queue-push", short_help="split a crawl into queue tasks")
+@click.option("-q", "--queue", "queue_path", required=True,
+              help="Path to the queue file (can be on shared storage).")
+@click.option("-k", "--kind", "kinds", multiple=True, default=["user_info"],
+              type=click.Choice(work_queue.TASK_KINDS, case_sensitive=False),
+              help="What to collect for every profile. Can be repeated.")
+@click.option("-f", "--usernames-file", type=click.File("r", encoding="utf-8"),
+              help="File with one username per line.")
+@click.option("--followers-of",
+              help="Username whose followers become the tasks.")
+@click.option("--download", is_flag=True, default=False,
+              help="Download the collected content as well.")
+def queue_push(queue_path: str, kinds: tuple, usernames_file: Optional[TextIO],
+               followers_of: Optional[str], download: bool) -> None:
+    """
+    Splits a crawl into tasks of a shared queue. Tasks are
+    processed by "queue-work" on any number of machines.
+
+    \b
+    EXAMPLE:
+    python get_insta.py queue-push \\
+    --queue="/mnt/shared/crawl.sqlite" \\
+    --kind="user_info" --kind="posts" \\
+    --followers-of="username"
+    """
+
+    queue = work_queue.SQLiteQueue(path=queue_path)
+    try:
+        if followers_of:
+            count = work_queue.enqueue_followers(
+                insta=_make_crawler(), queue=queue,
+                url=f"https://www.instagram.com/{followers_of}/",
+                kinds=kinds, download=download)
+        elif usernames_file:
+            usernames = [line.strip() for line in usernames_file if line.strip()]
+            count = work_queue.enqueue_profiles(queue=queue, usernames=usernames,
+                                                kinds=kinds, download=download)
+        else:
+            raise click.UsageError("Use --usernames-file or --followers-of.")
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.NotFoundError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.PrivateProfileError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    else:
+        click.echo(f"Tasks added: {count}")
+        click.echo(f"Queue: {queue.stats()}")
+
+
+def _run_queue_worker(queue_path: str, results_path: str,
+                      lease: float, idle_timeout: float) -> None:
+    worker = work_queue.Worker(insta=_make_crawler(),
+                               queue=work_queue.SQLiteQueue(path=queue_path),
+                               sink=work_queue.SQLiteResultSink(path=results_path),
+                               lease_seconds=lease)
+    worker.run(idle_timeout=idle_timeout)
+
+
+@get_insta.command("queue-work", short_help="process tasks of a shared queue")
+@click.option("-q", "--queue", "queue_path", required=True,
+              help="Path to the queue file.")
+@click.option("-r", "--results", "results_path", required=True,
+              help="Path to the results file (can be on shared storage).")
+@click.option("-p", "--processes", default=1, show_default=True,
+              help="Number of worker processes on this machine.")
+@click.option("--lease", default=300, show_default=True,
+              help="Seconds before an unacknowledged task is retried.")
+@click.option("--idle-timeout", default=0, show_default=True,
+              help="Seconds to wait for new tasks before exiting.")
+def queue_work(queue_path: str, results_path: str, processes: int, lease: float, idle_timeout: float) -> None:
+    """
+    Leases tasks from a shared queue, collects the data and
+    stores the results. Each process logs in on its own.
+
+    \b
+    EXAMPLE:
+    python get_insta.py queue-work \\
+    --queue="/mnt/shared/crawl.sqlite" \\
+    --results="/mnt/shared/results.sqlite" \\
+    --processes=4
+    """
+
+    workers = [
+        multiprocessing.Process(target=_run_queue_worker,
+                                args=(queue_path, results_path, lease, idle_timeout))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    click.echo(f"Queue: {work_queue.SQLiteQueue(path=queue_path).stats()}")
+    click.echo("All done!")
+
+
+@get_insta.command("jobs", short_help="run prioritised jobs from a file")
+@click.option("-f", "--jobs-file", required=True, type=click.File("r", encoding="utf-8"),
+              help=('JSON list of jobs: {"content_type": ..., "username": ..., '
+                    '"priority": optional, "deadline": optional unix time}.'))
+@click.option("-o", "--output", required=True, type=click.File("w", encoding="utf-8"),
+              help="JSON file for the results.")
+@click.option("--rate", default=0.5, show_default=True,
+              help="Requests per second shared by all the jobs.")
+@click.option("-w", "--workers", default=2, show_default=True,
+              help="Number of jobs running at the same time.")
+def jobs(jobs_file: TextIO, output: TextIO, rate: float, workers: int) -> None:
+    """
+    Runs jobs by priority and deadline under one rate budget.
+    Stories and new posts go before posts history and followers.
+
+    \b
+    EXAMPLE:
+    python get_insta.py jobs \\
+    --jobs-file="jobs.json" \\
+    --output="results.json"
+    """
+
+    job_scheduler = scheduler.JobScheduler(insta=_make_crawler(rate=rate), workers=workers)
+    for item in json.load(jobs_file):
+        job_scheduler.submit(content_type=item["content_type"],
+                             url=f"https://www.instagram.com/{item['username']}/",
+                             priority=item.get("priority"),
+                             deadline=item.get("deadline"))
+
+    job_scheduler.start()
+    job_scheduler.join()
+    job_scheduler.stop()
+
+    results = [
+        {
+            "content_type": job.content_type,
+            "url": job.url,
+            "status": job.status,
+            "error": job.error,
+            "result": job.result,
+        }
+        for job in job_scheduler.jobs.values()
+    ]
+    json.dump(results, output, ensure_ascii=False, indent=4, default=dict)
+    logging.info("Jobs done: %s", len(results), extra={"category": "jobs", "jobs": len(results)})
+
+    click.echo("All done!")
+
+
+def _handle_new_stories(stories: List[Storie], output: Optional[TextIO], download: bool,
+                        insta: InstaCrawler) -> None:
+    click.echo(f"New stories: {len(stories)}")
+    if output is not None:
+        for storie in stories:
+            output.write(json.dumps(dict(storie), ensure_ascii=False) + "\n")
+        output.flush()
+
+    if download:
+        stories = sorted(stories, key=lambda storie: storie.owner_username)
+        for username, user_stories in groupby(stories, key=lambda storie: storie.owner_username):
+            download_all(posts=list(user_stories), content_type="stories", username=username,
+                         refresh=insta.refresh_media_links)
+            logging.info("Downloading stories. Username: %s", username,
+                         extra={"category": "download", "content_type": "stories", "user": username})
+
+
+@get_insta.command("watch-stories", short_help="watch stories of many users")
+@click.option("-f", "--usernames-file", required=True, type=click.File("r", encoding="utf-8"),
+              help="File with one username per line.")
+@click.option("-s", "--state", "state_path", default="stories_watcher.json", show_default=True,
+              help="File with cached user ids and seen stories.")
+@click.option("-i", "--interval", default=600, show_default=True,
+              help="Seconds between polls.")
+@click.option("-o", "--output", type=click.File("a", encoding="utf-8"),
+              help="JSON lines file new stories are appended to.")
+@click.option("--download/--no-download", default=True, show_default=True,
+              help="Download new stories.")
+@click.option("--cycles", type=int,
+              help="Number of polls. Runs until interrupted when omitted.")
+@click.option("--max-dimension", type=int,
+              help="Largest width or height of the downloaded images.")
+@click.option("--prefer-image", is_flag=True, default=False,
+              help="Download cover images instead of videos.")
+@click.option("--thumbnails-only", is_flag=True, default=False,
+              help="Download only the smallest images.")
+def watch_stories(usernames_file: TextIO, state_path: str, interval: float,
+                  output: Optional[TextIO], download: bool, cycles: Optional[int],
+                  max_dimension: Optional[int], prefer_image: bool, thumbnails_only: bool) -> None:
+    """
+    Polls active stories of a watchlist and downloads or exports
+    only the new ones. Many users are checked with one request.
+
+    \b
+    EXAMPLE:
+    python get_insta.py watch-stories \\
+    --usernames-file="watchlist.txt" \\
+    --interval=600 --max-dimension=1080
+    """
+
+    usernames = [line.strip() for line in usernames_file if line.strip()]
+    media_policy = MediaPolicy(max_dimension=max_dimension, prefer_image=prefer_image,
+                               thumbnails_only=thumbnails_only)
+    watcher = StoriesWatcher(insta=_make_crawler(media_policy=media_policy),
+                             usernames=usernames, state_path=state_path)
+
+    def on_new(stories: List[Storie]) -> None:
+        _handle_new_stories(stories=stories, output=output, download=download, insta=watcher.insta)
+
+    try:
+        watcher.watch(on_new=on_new, interval=interval, cycles=cycles)
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except KeyboardInterrupt:
+        click.echo("Stopped")
+
+    click.echo("All done!")
+
+
+def _handle_new_posts(posts: List[Post], output: Optional[TextIO], download: bool,
+                      insta: InstaCrawler) -> None:
+    click.echo(f"New posts: {len(posts)}")
+    if output is not None:
+        for post in posts:
+            output.write(json.dumps(dict(post), ensure_ascii=False) + "\n")
+        output.flush()
+
+    if download:
+        posts = sorted(posts, key=lambda post: post.owner_username)
+        for username, user_posts in groupby(posts, key=lambda post: post.owner_username):
+            download_all(posts=list(user_posts), content_type="posts", username=username,
+                         refresh=insta.refresh_media_links)
+            logging.info("Downloading posts. Username: %s", username,
+                         extra={"category": "download", "content_type": "posts", "user": username})
+
+
+@get_insta.command("monitor", short_help="watch new posts of many users")
+@click.option("-f", "--usernames-file", required=True, type=click.File("r", encoding="utf-8"),
+              help="File with one username per line.")
+@click.option("-s", "--state", "state_path", default="posts_monitor.json", show_default=True,
+              help="File with posting times and poll times.")
+@click.option("-b", "--budget", default=600.0, show_default=True,
+              help="Profile requests per hour for the whole watchlist.")
+@click.option("--min-interval", default=300.0, show_default=True,
+              help="Shortest seconds between polls of a profile.")
+@click.option("--max-interval", default=7 * 24 * 60 * 60.0, show_default=True,
+              help="Longest seconds between polls of a profile.")
+@click.option("-o", "--output", type=click.File("a", encoding="utf-8"),
+              help="JSON lines file new posts are appended to.")
+@click.option("--download/--no-download", default=True, show_default=True,
+              help="Download new posts.")
+@click.option("--cycles", type=int,
+              help="Number of polls. Runs until interrupted when omitted.")
+def monitor(usernames_file: TextIO, state_path: str, budget: float, min_interval: float,
+            max_interval: float, output: Optional[TextIO], download: bool, cycles: Optional[int]) -> None:
+    """
+    Polls the newest posts of a watchlist. Every profile is polled
+    as often as it posts, within the request budget.
+
+    \b
+    EXAMPLE:
+    python get_insta.py monitor \\
+    --usernames-file="watchlist.txt" \\
+    --budget=600
+    """
+
+    usernames = [line.strip() for line in usernames_file if line.strip()]
+    posts_monitor = PostsMonitor(insta=_make_crawler(), usernames=usernames, state_path=state_path,
+                                 budget=budget, min_interval=min_interval, max_interval=max_interval)
+
+    def on_new(posts: List[Post]) -> None:
+        _handle_new_posts(posts=posts, output=output, download=download, insta=posts_monitor.insta)
+
+    try:
+        posts_monitor.watch(on_new=on_new, cycles=cycles)
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except KeyboardInterrupt:
+        click.echo("Stopped")
+
+    click.echo("All done!")
+
+
+@get_insta.command("snapshot", short_help="save a compact followers snapshot")
+@click.option("-u", "--username", required=True,
+              help="Username of the user you are interested in.")
+@click.option("-r", "--relation", default="followers", show_default=True,
+              type=click.Choice(snapshots.RELATIONS, case_sensitive=False))
+@click.option("-o", "--output",
+              help="Snapshot file. Default: downloads/<username>/snapshots/<relation>_<time>.igsn")
+def snapshot(username: str, relation: str, output: Optional[str]) -> None:
+    """
+    Saves user ids of the followers (or followed profiles) as
+    a compact snapshot. The profiles are not hydrated.
+
+    \b
+    EXAMPLE:
+    python get_insta.py snapshot \\
+    --username="username" \\
+    --relation="followers"
+    """
+
+    user_url = f"https://www.instagram.com/{username}/"
+    insta = _make_crawler()
+    try:
+        if relation == "followers":
+            result = insta.get_followers(url=user_url, hydrate=False)
+        else:
+            result = insta.get_followed_by_user(url=user_url, hydrate=False)
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.NotFoundError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.PrivateProfileError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    else:
+        user_snapshot = snapshots.make_snapshot(result=result, owner=username, relation=relation)
+        path = snapshots.save_snapshot(user_snapshot, path=output or snapshots.snapshot_path(user_snapshot))
+        logging.info("Snapshot saved. Username: %s, relation: %s, path: %s", username, relation, path,
+                     extra={"category": "snapshot", "user": username, "relation": relation, "path": path})
+        click.echo(f"Saved {len(user_snapshot)} ids to {path}")
+
+
+@get_insta.command("snapshot-diff", short_help="new and lost followers")
+@click.argument("old_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new_path", type=click.Path(exists=True, dir_okay=False))
+def snapshot_diff(old_path: str, new_path: str) -> None:
+    """
+    Shows new and lost followers between two snapshots.
+
+    \b
+    EXAMPLE:
+    python get_insta.py snapshot-diff old.igsn new.igsn
+    """
+
+    old, new = snapshots.load_snapshot(old_path), snapshots.load_snapshot(new_path)
+    added, lost = snapshots.diff(old, new)
+
+    names = {**old.username_by_id(), **new.username_by_id()}
+    click.echo(f"New ({len(added)}):")
+    for user_id in added:
+        click.echo(f"  {names.get(user_id, user_id)}")
+    click.echo(f"Lost ({len(lost)}):")
+    for user_id in lost:
+        click.echo(f"  {names.get(user_id, user_id)}")
+
+
+@get_insta.command("snapshot-overlap", short_help="common followers of accounts")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def snapshot_overlap(paths: Tuple[str, ...]) -> None:
+    """
+    Shows the profiles present in all the given snapshots,
+    e.g. the common followers of several accounts.
+
+    \b
+    EXAMPLE:
+    python get_insta.py snapshot-overlap a.igsn b.igsn c.igsn
+    """
+
+    loaded = [snapshots.load_snapshot(path) for path in paths]
+    common = snapshots.overlap(loaded)
+
+    names = {}
+    for item in loaded:
+        names.update(item.username_by_id())
+    click.echo(f"Common ({len(common)}):")
+    for user_id in common:
+        click.echo(f"  {names.get(user_id, user_id)}")
+
+
+@get_insta.command("graph-crawl", short_help="crawl the follow graph")
+@click.option("-s", "--seed", "seeds", multiple=True, required=True,
+              help="Username to start from. Can be repeated.")
+@click.option("-o", "--output-dir", default="graph", show_default=True,
+              help="Directory for the CSR files, nodes.tsv and the visited set.")
+@click.option("-r", "--relation", "relations", multiple=True,
+              default=["followers", "followed_by_user"],
+              type=click.Choice(["followers", "followed_by_user"], case_sensitive=False),
+              help="Which edges to follow. Can be repeated.")
+@click.option("-d", "--depth", default=1, show_default=True,
+              help="How many hops from the seeds are expanded.")
+@click.option("--max-requests", default=1000, show_default=True,
+              help="Request budget of the whole crawl.")
+@click.option("--max-pages-per-node", type=int,
+              help="Page limit (50 profiles each) per expanded profile.")
+@click.option("--capacity", default=1_000_000, show_default=True,
+              help="Expected number of nodes, sizes the Bloom filter.")
+@click.option("--resume", is_flag=True,
+              help="Go on with the crawl of the output directory, the seeds are not used.")
+@click.option("--overwrite", is_flag=True,
+              help="Remove the crawl of the output directory and start again.")
+def graph_crawl(seeds: Tuple[str, ...], output_dir: str, relations: Tuple[str, ...], depth: int,
+                max_requests: int, max_pages_per_node: Optional[int], capacity: int,
+                resume: bool, overwrite: bool) -> None:
+    """
+    Crawls the follow graph breadth-first from seed profiles
+    and writes the edges as CSR files.
+
+    \b
+    EXAMPLE:
+    python get_insta.py graph-crawl \\
+    --seed="username" \\
+    --depth=2 \\
+    --max-requests=5000
+    """
+
+    if resume and overwrite:
+        raise click.UsageError("Use --resume or --overwrite, not both.")
+
+    crawler = GraphCrawler(insta=_make_crawler(), output_dir=output_dir, relations=relations,
+                           max_depth=depth, max_requests=max_requests,
+                           max_pages_per_node=max_pages_per_node, capacity=capacity,
+                           resume=resume, overwrite=overwrite)
+    try:
+        stats = crawler.crawl(seeds=seeds)
+    except FileExistsError as e:
+        raise click.UsageError(str(e))
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    else:
+        logging.info("Graph crawl: %s", stats, extra={"category": "graph", **stats})
+        click.echo(f"Expanded: {stats['expanded']}, nodes: {stats['nodes']}, "
+                   f"edges: {stats['edges']}, requests: {stats['requests']}")
+        for relation, path in stats["files"].items():
+            click.echo(f"{relation}: {path}")
+        click.echo("All done!")
+
+
+@get_insta.command("pipeline", short_help="collect, export and download at once")
+@click.option("-u", "--username", required=True,
+              help="Username of the user you are interested in.")
+@click.option("-ct", "--content-type", "content_types", multiple=True,
+              default=list(pipeline.CONTENT_TYPES),
+              type=click.Choice(pipeline.CONTENT_TYPES, case_sensitive=False),
+              help="What to collect. Can be repeated. Everything by default.")
+@click.option("--json", "json_lines", is_flag=True, default=False,
+              help="Save the items to downloads/<username>/<username>_data.jsonl.")
+@click.option("--csv", "csv_files", is_flag=True, default=False,
+              help="Save the items to downloads/<username>/<username>_<content_type>.csv.")
+@click.option("--sqlite", "sqlite_path",
+              help="Save the items to this SQLite file.")
+@click.option("--search-index", "search_path",
+              help="Add the captions and titles to this full-text search index.")
+@click.option("--download/--no-download", default=True, show_default=True,
+              help="Download the media.")
+@click.option("--queue-size", default=100, show_default=True,
+              help="Capacity of the queues between the stages.")
+@click.option("--download-workers", default=4, show_default=True,
+              help="Number of parallel downloads.")
+@click.option("--max-dimension", type=int,
+              help="Largest width or height of the downloaded images.")
+@click.option("--prefer-image", is_flag=True, default=False,
+              help="Download cover images instead of videos.")
+@click.option("--thumbnails-only", is_flag=True, default=False,
+              help="Download only the smallest images.")
+def run_pipeline(username: str, content_types: Tuple[str, ...], json_lines: bool, csv_files: bool,
+                 sqlite_path: Optional[str], search_path: Optional[str], download: bool, queue_size: int,
+                 download_workers: int, max_dimension: Optional[int], prefer_image: bool,
+                 thumbnails_only: bool) -> None:
+    """
+    Collects the page content while exporting and downloading it,
+    without any questions. Pagination, parsing, export and
+    downloads run at the same time.
+
+    \b
+    EXAMPLE:
+    python get_insta.py pipeline \\
+    --username="username" \\
+    --content-type="posts" --content-type="stories" \\
+    --json --csv --download-workers=8
+    """
+
+    media_policy = MediaPolicy(max_dimension=max_dimension, prefer_image=prefer_image,
+                               thumbnails_only=thumbnails_only)
+    content_pipeline = pipeline.Pipeline(
+        insta=_make_crawler(media_policy=media_policy), username=username, content_types=content_types,
+        sinks=pipeline.default_sinks(username=username, json_lines=json_lines,
+                                     csv_files=csv_files, sqlite_path=sqlite_path,
+                                     search_path=search_path),
+        download=download, queue_size=queue_size, download_workers=download_workers)
+    try:
+        stats = content_pipeline.run()
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.NotFoundError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.PrivateProfileError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    else:
+        click.echo(f"Collected: {stats['parsed']}, stored: {stats['stored']}, "
+                   f"downloaded: {stats['downloaded']}, failed downloads: {stats['download_errors']}")
+        click.echo("All done!")
+
+
+def _engagement_sink(owner: str, json_lines: bool) -> pipeline.Sink:
+    directory = os.path.join(os.getcwd(), "downloads", owner)
+    if json_lines:
+        return pipeline.JSONLinesSink(path=os.path.join(directory, f"{owner}_engagement.jsonl"))
+
+    return pipeline.CSVSink(directory=directory, username=owner)
+
+
+def _write_engagement(batches: List[Tuple[str, Iterator]], sink: pipeline.Sink) -> None:
+    for content_type, batch in batches:
+        for shortcode, records in batch:
+            for record in records:
+                sink.write(content_type, record)
+            click.echo(f"{shortcode}: {len(records)} {content_type}")
+            logging.info("%s of %s: %s", content_type, shortcode, len(records),
+                         extra={"category": "engagement", "content_type": content_type,
+                                "shortcode": shortcode, "count": len(records)})
+
+
+@get_insta.command("comments", short_help="comments and likers of posts")
+@click.option("-u", "--username",
+              help="Take the latest posts of this user.")
+@click.option("-s", "--shortcode", "shortcodes", multiple=True,
+              help="Shortcode of a post. Can be repeated.")
+@click.option("--last", default=50, show_default=True,
+              help="Number of the latest posts of the user.")
+@click.option("--replies/--no-replies", default=True, show_default=True,
+              help="Collect the replies to the comments.")
+@click.option("--likers", is_flag=True, default=False,
+              help="Collect the likers too.")
+@click.option("--json", "json_lines", is_flag=True, default=False,
+              help="Save the records as json lines instead of csv.")
+@click.option("-w", "--workers", default=4, show_default=True,
+              help="Number of posts collected at the same time.")
+@click.option("--rate", default=0.5, show_default=True,
+              help="Requests per second shared by the workers.")
+def comments(username: Optional[str], shortcodes: Tuple[str, ...], last: int, replies: bool,
+             likers: bool, json_lines: bool, workers: int, rate: float) -> None:
+    """
+    Collects the comments (and the likers) of many posts at the
+    same time and saves them to downloads/<username>/.
+
+    \b
+    EXAMPLE:
+    python get_insta.py comments \\
+    --username="username" \\
+    --last=500 --likers --workers=8
+    """
+
+    if not username and not shortcodes:
+        raise click.UsageError("Give a username or at least one shortcode.")
+
+    insta = _make_crawler(rate=rate)
+    sink = _engagement_sink(owner=username or "posts", json_lines=json_lines)
+    try:
+        codes = list(shortcodes)
+        if username:
+            posts = insta.iter_posts(url=f"{insta.BASE_URL}{username}/")
+            codes += [post.shortcode for post in islice(posts, last)]
+
+        batches: List[Tuple[str, Iterator]] = [
+            ("comments", insta.iter_comments_batch(codes, replies=replies, workers=workers)),
+        ]
+        if likers:
+            batches.append(("likers", insta.iter_likers_batch(codes, workers=workers)))
+        _write_engagement(batches=batches, sink=sink)
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.NotFoundError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    except exc.PrivateProfileError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    else:
+        click.echo("All done!")
+    finally:
+        sink.close()
+
+
+@get_insta.command("feeds", short_help="posts of hashtags and locations")
+@click.option("-t", "--hashtag", "hashtags", multiple=True,
+              help="Tag without #. Can be repeated.")
+@click.option("-l", "--location", "locations", multiple=True,
+              help="Location id. Can be repeated.")
+@click.option("-i", "--index", "index_path", default="feeds.sqlite", show_default=True,
+              help="Shortcode index shared by all the feeds and crawls.")
+@click.option("-o", "--output", type=click.File("a", encoding="utf-8"),
+              help="JSON lines file new posts are appended to.")
+@click.option("--max-pages", type=int,
+              help="Page limit per feed. The whole feed when omitted.")
+@click.option("--download/--no-download", default=True, show_default=True,
+              help="Download the media of new posts.")
+def feeds(hashtags: Tuple[str, ...], locations: Tuple[str, ...], index_path: str,
+          output: Optional[TextIO], max_pages: Optional[int], download: bool) -> None:
+    """
+    Collects the recent posts of hashtags and locations. A post met
+    in several feeds is requested and downloaded only once.
+
+    \b
+    EXAMPLE:
+    python get_insta.py feeds \\
+    --hashtag="cats" --hashtag="dogs" \\
+    --location="213385402" \\
+    --max-pages=10
+    """
+
+    if not hashtags and not locations:
+        raise click.UsageError("Give at least one hashtag or location.")
+
+    crawler = FeedCrawler(insta=_make_crawler(), index=ShortcodeIndex(path=index_path),
+                          download=download, max_pages=max_pages)
+    try:
+        for post in crawler.crawl(hashtags=hashtags, locations=locations):
+            if output is not None:
+                output.write(json.dumps(dict(post), ensure_ascii=False) + "\n")
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+
+    for source, stats in crawler.stats.items():
+        click.echo(f"{source}: {stats.seen} seen, {stats.new} new, {stats.failed} failed")
+    click.echo("All done!")
+
+
+@get_insta.command("plan", short_help="estimate the cost of a crawl")
+@click.option("-u", "--username", "usernames", multiple=True,
+              help="Username to plan. Can be repeated.")
+@click.option("-f", "--usernames-file", type=click.File("r", encoding="utf-8"),
+              help="File with one username per line.")
+@click.option("-ct", "--content-type", "content_types", multiple=True, default=["posts"], show_default=True,
+              type=click.Choice(CONTENT_TYPES, case_sensitive=False),
+              help="Content to plan. Can be repeated.")
+@click.option("--rate", default=0.5, show_default=True,
+              help="Requests per second the crawl will be limited to.")
+@click.option("-w", "--workers", default=1, show_default=True,
+              help="Requests the crawl will send at the same time.")
+@click.option("--latency", default=1.0, show_default=True,
+              help="Seconds one request takes.")
+@click.option("--hydrate/--no-hydrate", default=True, show_default=True,
+              help="Followers and followed profiles will be requested one by one.")
+def plan(usernames: Tuple[str, ...], usernames_file: Optional[TextIO], content_types: Tuple[str, ...],
+         rate: float, workers: int, latency: float, hydrate: bool) -> None:
+    """
+    Estimates requests, media size and time of a crawl with one
+    profile request per user, before the crawl is started.
+
+    \b
+    EXAMPLE:
+    python get_insta.py plan \\
+    --username="username" --username="other" \\
+    --content-type="posts" --content-type="followers" \\
+    --rate=0.5
+    """
+
+    all_usernames = list(usernames)
+    if usernames_file is not None:
+        all_usernames += [line.strip() for line in usernames_file if line.strip()]
+    if not all_usernames:
+        raise click.UsageError("Give at least one username.")
+
+    planner = CrawlPlanner(insta=_make_crawler(), rate=rate, workers=workers, latency=latency, hydrate=hydrate)
+    try:
+        costs = planner.plan(usernames=all_usernames, content_types=content_types)
+    except exc.BlockedByInstagramError as e:
+        click.echo(e)
+        logging.error("Error: %r", e)
+    else:
+        print_crawl_plan_table(costs=costs, total=planner.total(costs))
+
+
+@get_insta.command("search-import", short_help="add exports to the search index")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("-i", "--index", "index_path", default="search.sqlite", show_default=True,
+              help="Full-text search index.")
+def search_import(paths: Tuple[str, ...], index_path: str) -> None:
+    """
+    Adds <username>_data.json exports and pipeline json lines files
+    to the full-text search index.
+
+    \b
+    EXAMPLE:
+    python get_insta.py search-import downloads/*/*_data.json
+    """
+
+    index = SearchIndex(path=index_path)
+    for path in paths:
+        try:
+            click.echo(f"{path}: {index.import_file(path)} items")
+        except (ValueError, KeyError) as e:
+            click.echo(f"{path}: skipped, {repr(e)}")
+            logging.error("Error: %r", e)
+
+    click.echo(", ".join(f"{kind}: {count}" for kind, count in index.stats().items()))
+
+
+@get_insta.command("search", short_help="search captions and bios")
+@click.argument("query", default="")
+@click.option("-i", "--index", "index_path", default="search.sqlite", show_default=True,
+              help="Full-text search index.")
+@click.option("-k", "--kind", type=click.Choice(KINDS, case_sensitive=False),
+              help="Only posts, igtvs or users.")
+@click.option("-t", "--hashtag", "hashtags", multiple=True,
+              help="Hashtag the item must have, without #. Can be repeated.")
+@click.option("-m", "--mention", "mentions", multiple=True,
+              help="Username the item must mention. Can be repeated.")
+@click.option("-u", "--username", help="Only items of this user.")
+@click.option("-n", "--limit", default=20, show_default=True,
+              help="Number of results.")
+def search(query: str, index_path: str, kind: Optional[str], hashtags: Tuple[str, ...],
+           mentions: Tuple[str, ...], username: Optional[str], limit: int) -> None:
+    """
+    Searches the indexed captions, igtv titles, bios and full names,
+    the best matches first. The query uses the SQLite FTS5 syntax.
+
+    \b
+    EXAMPLE:
+    python get_insta.py search "sunset OR beach" \\
+    --hashtag="travel" --kind="posts"
+    """
+
+    index = SearchIndex(path=index_path)
+    try:
+        hits = index.search(query=query, kind=kind, hashtags=hashtags, mentions=mentions,
+                            owner_username=username, limit=limit)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    except sqlite3.OperationalError as e:
+        raise click.UsageError(f"Bad query: {e}")
+
+    for hit in hits:
+        link = f"https://www.instagram.com/{hit.key}/" if hit.kind == "users" \
+            else f"https://www.instagram.com/p/{hit.key}/"
+        click.echo(f"{hit.rank:6.2f}  {hit.kind:<5}  {hit.owner_username:<30}  {link}")
+        click.echo(f"        {hit.snippet}")
+    click.echo(f"Found: {len(hits)}")
+
+
+def _fetch_followers(usernames: List[str]) -> Dict[str, int]:
+    insta = _make_crawler()
+    followers = {}
+    for username in usernames:
+        try:
+            user = insta.get_user_info(url=f"{insta.BASE_URL}{username}/", fields=["followed_by"], target="insights")
+        except exc.NotFoundError as e:
+            logging.error("Error: %r", e)
+            continue
+        followers[username] = user.followed_by
+    return followers
+
+
+@get_insta.command("insights", short_help="engagement of collected posts")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--fetch-followers", is_flag=True, default=False,
+              help="Request the followers counts the exports do not have.")
+@click.option("-w", "--window", default=10, show_default=True,
+              help="Posts in the rolling mean.")
+@click.option("-t", "--threshold", default=3.5, show_default=True,
+              help="Robust z-score from which a post is an outlier.")
+@click.option("-o", "--output", type=click.File("w", encoding="utf-8"),
+              help="JSON file with the metrics, rolling means and outliers of every profile.")
+def insights(paths: Tuple[str, ...], fetch_followers: bool, window: int, threshold: float,
+             output: Optional[TextIO]) -> None:
+    """
+    Engagement rate, posting cadence, rolling means and outlier
+    posts of the profiles in <username>_data.json exports and
+    pipeline json lines files, all profiles at once.
+
+    \b
+    EXAMPLE:
+    python get_insta.py insights downloads/*/*_data.json \\
+    --fetch-followers --output="insights.json"
+    """
+
+    records, followers = load_exports(paths)
+    if fetch_followers:
+        missing = sorted({record["owner_username"] for record in records} - set(followers))
+        try:
+            followers.update(_fetch_followers(missing))
+        except exc.BlockedByInstagramError as e:
+            click.echo(e)
+            logging.error("Error: %r", e)
+
+    table = PostsTable.from_records(records, followers=followers)
+    summary = compute_insights(table, window=window, threshold=threshold).summary()
+    print_insights_table(summary)
+    if output is not None:
+        json.dump(summary, output, ensure_ascii=False, indent=4)
+
+
+@get_insta.command("serve", short_help="HTTP job API around one crawler")
+@click.option("-h", "--host", default="127.0.0.1", show_default=True,
+              help="Address to listen on.")
+@click.option("-p", "--port", default=8765, show_default=True,
+              help="Port to listen on.")
+@click.option("--token", envvar="SERVE_TOKEN",
+              help="Require the header 'Authorization: Bearer <token>'. Also read from SERVE_TOKEN.")
+@click.option("--rate", default=0.5, show_default=True,
+              help="Requests per second shared by all the jobs.")
+@click.option("-w", "--workers", default=4, show_default=True,
+              help="Number of jobs running at the same time.")
+def serve(host: str, port: int, token: Optional[str], rate: float, workers: int) -> None:
+    """
+    Keeps one logged in crawler with its cache and rate limit, and
+    runs the jobs submitted over a local HTTP/JSON API.
+
+    \b
+    EXAMPLE:
+    python get_insta.py serve --port=8765 --rate=0.5
+    curl -X POST localhost:8765/jobs \\
+    -d '{"content_type": "posts", "username": "username", \\
+    "download": true}'
+    curl localhost:8765/jobs/1/stream
+    """
+
+    service = CrawlerService(scheduler=scheduler.JobScheduler(insta=_make_crawler(rate=rate), workers=workers),
+                             host=host, port=port, token=token)
+    click.echo(f"Listening on http://{service.address[0]}:{service.address[1]}")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        click.echo("Stopped")
+
+
+@get_insta.command("thumbnails", short_help="thumbnails of downloaded media")
+@click.option("-d", "--directory", default="downloads", show_default=True,
+              type=click.Path(exists=True, file_okay=False),
+              help="Folder of the downloaded media.")
+@click.option("-o", "--output-dir", default="thumbnails", show_default=True,
+              help="Folder the thumbnails go to, the same layout as the downloads.")
+@click.option("-i", "--index", "index_path", default=THUMBNAILS_INDEX, show_default=True,
+              help="SQLite file of the made thumbnails.")
+@click.option("-s", "--size", default=320, show_default=True,
+              help="Side of the square thumbnails, in pixels.")
+@click.option("-w", "--workers", type=int,
+              help="Number of processes, all the cores when omitted.")
+def thumbnails(directory: str, output_dir: str, index_path: str, size: int, workers: Optional[int]) -> None:
+    """
+    Makes thumbnails of all the downloaded images and videos, on all
+    the cores. Files not changed since their thumbnail was made are
+    skipped. Videos need ffmpeg.
+
+    \b
+    EXAMPLE:
+    python get_insta.py thumbnails --directory="downloads" --size=320
+    """
+
+    with Thumbnailer(index_path=index_path, root=directory, output_dir=output_dir, size=size,
+                     workers=workers) as thumbnailer:
+        click.echo(f"Files queued: {thumbnailer.scan()}")
+    _echo_thumbnail_counts(thumbnailer.counts)
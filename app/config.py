@@ -8,6 +8,20 @@ load_dotenv(dotenv_path=os.path.join(basedir, "..", ".env"))
 
 login = os.environ.get("LOGIN2")
 password = os.environ.get("PASSWORD2")
+# "browser" logs in through a headless chrome, "http" with plain
+# requests and needs no chrome
+auth_method = os.environ.get("AUTH_METHOD", "browser")
+
+# files with one proxy url per line, the api and the media
+# downloads can use different proxies
+proxies_file = os.environ.get("PROXIES_FILE")
+cdn_proxies_file = os.environ.get("CDN_PROXIES_FILE")
+proxy_concurrency = int(os.environ.get("PROXY_CONCURRENCY", 2))
+# "session" keeps one proxy per crawler, "request" spreads requests
+proxy_mode = os.environ.get("PROXY_MODE", "session")
+# seconds before a late profile lookup is sent again, hedging is off
+# when unset
+hedge_after = float(os.environ["HEDGE_AFTER"]) if os.environ.get("HEDGE_AFTER") else None
 
 category_headers_row = {
     "posts": list(Post.__fields__.keys()),
@@ -1,4 +1,11 @@
-from .exceptions import (PrivateProfileError, BlockedByInstagramError, NoCookieError, NotFoundError)
+import logging
+
+from .exceptions import (AuthExpiredError, PrivateProfileError, BlockedByInstagramError,
+                         IncompleteDownloadError, NoCookieError, NotFoundError)
 from .insta import InstaCrawler
+from .logs import setup_logging
 from .utils import (export_as_csv, export_as_json, download_all, download_file,
                     print_single_post_info_table, print_user_info_table, how_sleep)
+
+# the application decides where the records go, see setup_logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
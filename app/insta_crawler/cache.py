@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, Optional
+
+from .models import User
+
+# fields always parsed by InstaCrawler.forming_user_data
+REQUIRED_FIELDS = frozenset({"is_private", "followed_by_viewer"})
+
+
+@dataclass
+class _Entry:
+    user: User
+    fields: Optional[FrozenSet[str]]
+    expires_at: float
+
+
+@dataclass
+class _Call:
+    done: threading.Event = field(default_factory=threading.Event)
+    user: Optional[User] = None
+    fields: Optional[FrozenSet[str]] = None
+    error: Optional[BaseException] = None
+
+
+class UserCache:
+    """
+    In-process LRU cache of users with a time to live, keyed by
+    username and user id.
+
+    Concurrent requests for the same user are coalesced: only the
+    first caller loads the user, the others wait for its result.
+
+    :param maxsize: how many users are kept.
+    :param ttl: seconds a user stays valid.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._ids: Dict[int, str] = {}
+        self._inflight: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def get(self, username: Optional[str] = None, user_id: Optional[int] = None,
+            fields: Optional[Iterable[str]] = None) -> Optional[User]:
+        """
+        Gives a cached user that has all the requested fields.
+
+        :param fields: None means all the fields.
+        """
+        with self._lock:
+            if username is None and user_id is not None:
+                username = self._ids.get(int(user_id))
+            if username is None:
+                return None
+
+            return self._lookup(username.lower(), self._normalize(fields))
+
+    def put(self, user: User, fields: Optional[Iterable[str]] = None) -> None:
+        """
+        :param fields: fields the user was built with, None if all.
+        """
+        with self._lock:
+            self._store(user.username.lower(), user, self._normalize(fields))
+
+    def get_or_load(self, username: str, loader: Callable[[], User],
+                    fields: Optional[Iterable[str]] = None) -> User:
+        """
+        Gives the cached user or loads it with loader. Callers
+        asking for the same username at the same time share one
+        loader call.
+
+        :param username: profile username.
+        :param loader: requests the user with the given fields.
+        :param fields: None means all the fields.
+        """
+        key = username.lower()
+        wanted = self._normalize(fields)
+
+        while True:
+            with self._lock:
+                user = self._lookup(key, wanted)
+                if user is not None:
+                    return user
+
+                call = self._inflight.get(key)
+                leader = call is None
+                if call is None:
+                    call = _Call(fields=wanted)
+                    self._inflight[key] = call
+
+            if leader:
+                return self._load(key, call, loader)
+
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.user is not None and self._covers(call.fields, wanted):
+                return call.user
+            # the shared call was made with fewer fields, try again
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(username.lower(), None)
+            if entry is not None:
+                self._forget_id(entry.user)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._ids.clear()
+
+    def _load(self, key: str, call: _Call, loader: Callable[[], User]) -> User:
+        try:
+            user = loader()
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            call.user = user
+            with self._lock:
+                self._store(key, user, call.fields)
+            return user
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def _lookup(self, key: str, fields: Optional[FrozenSet[str]]) -> Optional[User]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic() or not self._covers(entry.fields, fields):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.user
+
+    def _store(self, key: str, user: User, fields: Optional[FrozenSet[str]]) -> None:
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+
+        current = self._entries.get(key)
+        if current is not None and not self._covers(fields, current.fields) \
+                and current.expires_at >= time.monotonic():
+            # do not replace a full user with a projection of it
+            return
+
+        self._entries[key] = _Entry(user=user, fields=fields, expires_at=time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        user_id = self._user_id(user)
+        if user_id is not None:
+            self._ids[user_id] = key
+
+        while len(self._entries) > self.maxsize:
+            _, entry = self._entries.popitem(last=False)
+            self._forget_id(entry.user)
+
+    def _covers(self, available: Optional[FrozenSet[str]], wanted: Optional[FrozenSet[str]]) -> bool:
+        if available is None:
+            return True
+        if wanted is None:
+            return False
+        return wanted <= available
+
+    def _normalize(self, fields: Optional[Iterable[str]]) -> Optional[FrozenSet[str]]:
+        if fields is None:
+            return None
+        return frozenset(fields) | REQUIRED_FIELDS
+
+    def _user_id(self, user: User) -> Optional[int]:
+        user_id = getattr(user, "user_id", None)
+        return int(user_id) if user_id is not None else None
+
+    def _forget_id(self, user: User) -> None:
+        user_id = self._user_id(user)
+        if user_id is not None:
+            self._ids.pop(user_id, None)
@@ -20,6 +20,15 @@ class BlockedByInstagramError(Exception):
         super().__init__(self.message)
 
 
+class AuthExpiredError(BlockedByInstagramError):
+    def __init__(
+        self,
+        message: str = ("Instagram asks to log in again.\n"
+                        "The session of the cookie user is expired or challenged."),
+    ) -> None:
+        super().__init__(message)
+
+
 class NoCookieError(Exception):
     def __init__(
         self,
@@ -36,3 +45,21 @@ class NotFoundError(Exception):
     ):
         self.message = message
         super().__init__(self.message)
+
+
+class IncompleteDownloadError(Exception):
+    def __init__(
+        self,
+        message: str = "The downloaded file is shorter than the server said.",
+    ) -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class LoginError(Exception):
+    def __init__(
+        self,
+        message: str = "Instagram refused the login.",
+    ) -> None:
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,181 @@
+from dataclasses import dataclass
+import logging
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .exceptions import NotFoundError, PrivateProfileError
+from .models import Post
+from .storage import SQLiteStorage
+from .utils import download_all
+
+logger = logging.getLogger(__name__)
+
+
+class ShortcodeIndex(SQLiteStorage):
+    """
+    Posts already met by any feed, shared by all the feeds and by
+    crawls running at the same time. A post is hydrated and
+    downloaded only by the crawl that claims it first.
+
+    :param path: SQLite file of the index.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS posts (
+            shortcode TEXT PRIMARY KEY,
+            claimed_at REAL NOT NULL,
+            downloaded INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS post_sources (
+            shortcode TEXT NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (shortcode, source)
+        );
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path=path, schema=self.schema)
+
+    def claim(self, shortcode: str, source: str, reclaim_after: Optional[float] = None) -> bool:
+        """
+        Records that the feed contains the post and claims it, when
+        no crawl has done it before.
+
+        :param source: feed name, e.g. "hashtag:cats".
+        :param reclaim_after: seconds after which a claim whose post
+        is not downloaded yet can be taken again, e.g. after a failed
+        download or a crawl killed before it was done. None never
+        takes a claim again.
+
+        :return: True when the post is claimed by this call.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT OR IGNORE INTO post_sources VALUES (?, ?)", (shortcode, source))
+                cursor = conn.execute("INSERT OR IGNORE INTO posts (shortcode, claimed_at) VALUES (?, ?)",
+                                      (shortcode, now))
+                if not cursor.rowcount and reclaim_after is not None:
+                    cursor = conn.execute("UPDATE posts SET claimed_at = ? "
+                                          "WHERE shortcode = ? AND downloaded = 0 AND claimed_at < ?",
+                                          (now, shortcode, now - reclaim_after))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return bool(cursor.rowcount)
+
+    def release(self, shortcode: str) -> None:
+        """
+        Forgets a claimed post that could not be hydrated, so a later
+        crawl tries it again.
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM posts WHERE shortcode = ?", (shortcode,))
+
+    def mark_downloaded(self, shortcode: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE posts SET downloaded = 1 WHERE shortcode = ?", (shortcode,))
+
+    def sources(self, shortcode: str) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT source FROM post_sources WHERE shortcode = ? ORDER BY source",
+                                (shortcode,)).fetchall()
+        return [source for (source,) in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            posts, downloaded = conn.execute("SELECT COUNT(*), COALESCE(SUM(downloaded), 0) FROM posts").fetchone()
+            links = conn.execute("SELECT COUNT(*) FROM post_sources").fetchone()[0]
+        return {"posts": posts, "downloaded": downloaded, "feed_links": links}
+
+
+@dataclass
+class FeedStats:
+    pages: int = 0
+    seen: int = 0
+    new: int = 0
+    failed: int = 0
+
+
+class FeedCrawler:
+    """
+    Crawls hashtag and location feeds. Every post is hydrated with
+    get_single_post (feed nodes lack the owner username) and its
+    media downloaded only once, however many feeds it is in.
+
+    :param insta: InstaCrawler instance.
+    :param index: shared shortcode index.
+    :param download: download the media of the new posts.
+    :param max_pages: page limit per feed, None for the whole feed.
+    :param reclaim_after: seconds after which the posts claimed but
+    not downloaded are tried again, when download is on.
+    """
+
+    def __init__(self, insta: Any, index: ShortcodeIndex, download: bool = True,
+                 max_pages: Optional[int] = None, reclaim_after: float = 3600) -> None:
+        self.insta = insta
+        self.index = index
+        self.download = download
+        self.max_pages = max_pages
+        self.reclaim_after = reclaim_after
+        self.stats: Dict[str, FeedStats] = {}
+
+    def crawl(self, hashtags: Iterable[str] = (),
+              locations: Iterable[Union[int, str]] = ()) -> Iterator[Post]:
+        """
+        Gives the posts no feed has given before, feed after feed.
+        """
+        feeds: List[Tuple[str, Union[int, str]]] = [("hashtag", tag) for tag in hashtags]
+        feeds += [("location", location) for location in locations]
+        for feed, name in feeds:
+            yield from self.crawl_feed(feed=feed, name=name)
+
+    def crawl_feed(self, feed: str, name: Union[int, str]) -> Iterator[Post]:
+        source = f"{feed}:{str(name).lstrip('#').lower()}"
+        stats = self.stats.setdefault(source, FeedStats())
+
+        for page in self.insta.iter_feed_pages(feed=feed, name=name):
+            stats.pages += 1
+            shortcodes = [edge["node"]["shortcode"] for edge in page["edges"]]
+            stats.seen += len(shortcodes)
+
+            for shortcode in dict.fromkeys(shortcodes):
+                # claimed one at a time, so a crawl stopped halfway
+                # leaves no claims it did not work on
+                if not self.index.claim(shortcode, source=source,
+                                        reclaim_after=self.reclaim_after if self.download else None):
+                    continue
+                post = self._hydrate(shortcode)
+                if post is None:
+                    stats.failed += 1
+                    continue
+                stats.new += 1
+                yield post
+
+            if stats.pages == self.max_pages:
+                break
+
+        logger.info("Feed %s: %s", source, stats)
+
+    def _hydrate(self, shortcode: str) -> Optional[Post]:
+        try:
+            post = self.insta.get_single_post(url=f"{self.insta.BASE_URL}p/{shortcode}/")
+        except (NotFoundError, PrivateProfileError, KeyError, TypeError) as e:
+            # deleted posts and posts of accounts gone private
+            logger.warning("Post %s skipped: %r", shortcode, e)
+            self.index.release(shortcode)
+            return None
+        except BaseException:
+            # blocked or interrupted, a later crawl claims it again
+            self.index.release(shortcode)
+            raise
+
+        if self.download:
+            failed = download_all(posts=[post], content_type="posts", username=post.owner_username,
+                                  refresh=self.insta.refresh_media_links, progress=False)
+            if not failed:
+                self.index.mark_downloaded(shortcode)
+        return post
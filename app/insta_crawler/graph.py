@@ -0,0 +1,426 @@
+from array import array
+from dataclasses import dataclass
+import hashlib
+import logging
+import math
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .exceptions import NotFoundError, PrivateProfileError
+
+logger = logging.getLogger(__name__)
+
+CSR_MAGIC = b"IGCS"
+CSR_VERSION = 1
+# magic, version, rows, targets, relation length
+CSR_HEADER = struct.Struct("<4sHQQH")
+# depth, ids of the level, ids of the next level
+FRONTIER_HEADER = struct.Struct("<QQQ")
+
+
+class BloomFilter:
+    """
+    Bit array answering "maybe seen" or "surely not seen" for
+    integer ids, using a few bits per id.
+
+    :param capacity: expected number of ids.
+    :param error_rate: wanted false positive rate at capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: int) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def _positions(self, item: int) -> Iterator[int]:
+        digest = hashlib.blake2b(item.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for number in range(self.hashes):
+            yield (first + number * second) % self.size
+
+
+class VisitedSet:
+    """
+    Set of user ids kept on disk, with a Bloom filter in front of
+    it, so most lookups of new ids never touch the disk.
+
+    :param path: SQLite file with the exact set.
+    :param capacity: expected number of ids.
+    """
+
+    def __init__(self, path: str, capacity: int = 1_000_000, error_rate: float = 0.01) -> None:
+        self.path = path
+        self.bloom = BloomFilter(capacity=capacity, error_rate=error_rate)
+        self.count = 0
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS visited (id INTEGER PRIMARY KEY)")
+        for (user_id,) in self._conn.execute("SELECT id FROM visited"):
+            self.bloom.add(user_id)
+            self.count += 1
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id not in self.bloom:
+            return False
+
+        row = self._conn.execute("SELECT 1 FROM visited WHERE id = ?", (user_id,)).fetchone()
+        return row is not None
+
+    def add_many(self, user_ids: Iterable[int]) -> List[int]:
+        """
+        Adds the ids.
+
+        :return: ids that were not in the set before.
+        """
+        new_ids = []
+        with self._conn:
+            for user_id in user_ids:
+                if user_id in self or user_id in new_ids:
+                    continue
+                self.bloom.add(user_id)
+                new_ids.append(user_id)
+            self._conn.executemany("INSERT OR IGNORE INTO visited VALUES (?)",
+                                   ((user_id,) for user_id in new_ids))
+
+        self.count += len(new_ids)
+        return new_ids
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class CSRWriter:
+    """
+    Writes adjacency lists in compressed sparse row form:
+    the row ids, the row offsets and the flat targets, all int64.
+    Targets are streamed to a temporary file, so only the rows
+    are kept in memory.
+
+    :param path: output file.
+    :param relation: what the rows mean, e.g. "followers".
+    :param resume: the rows of an existing file are kept and the
+    new ones are added after them.
+    """
+
+    def __init__(self, path: str, relation: str, resume: bool = False) -> None:
+        self.path = path
+        self.relation = relation
+        self.rows = array("q")
+        self.offsets = array("q", [0])
+
+        self._targets_path = f"{path}.targets.tmp"
+        self._targets = open(self._targets_path, "wb")
+        if resume and os.path.exists(path):
+            graph = load_csr(path)
+            if graph.relation != relation:
+                raise ValueError(f"{path} has the {graph.relation} relation, not {relation}")
+            self.rows, self.offsets = graph.rows, graph.offsets
+            _little_endian(graph.targets).tofile(self._targets)
+
+    def add_row(self, row_id: int, targets: Iterable[int]) -> None:
+        targets = _little_endian(array("q", targets))
+        targets.tofile(self._targets)
+        self.rows.append(row_id)
+        self.offsets.append(self.offsets[-1] + len(targets))
+
+    def close(self) -> str:
+        self._targets.close()
+        relation = self.relation.encode("utf-8")
+
+        with open(self.path, "wb") as file:
+            file.write(CSR_HEADER.pack(CSR_MAGIC, CSR_VERSION, len(self.rows), self.offsets[-1], len(relation)))
+            file.write(relation)
+            _little_endian(self.rows).tofile(file)
+            _little_endian(self.offsets).tofile(file)
+            with open(self._targets_path, "rb") as targets:
+                shutil.copyfileobj(targets, file, length=1024 * 1024)
+        os.remove(self._targets_path)
+
+        return self.path
+
+
+@dataclass
+class CSRGraph:
+    relation: str
+    rows: array
+    offsets: array
+    targets: array
+
+    def neighbors(self, index: int) -> array:
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def edges(self) -> Iterator[Tuple[int, int]]:
+        for index, row_id in enumerate(self.rows):
+            for target in self.neighbors(index):
+                yield row_id, target
+
+
+def load_csr(path: str) -> CSRGraph:
+    with open(path, "rb") as file:
+        magic, version, rows_count, targets_count, relation_len = CSR_HEADER.unpack(file.read(CSR_HEADER.size))
+        if magic != CSR_MAGIC or version != CSR_VERSION:
+            raise ValueError(f"{path} is not a CSR file")
+
+        relation = file.read(relation_len).decode("utf-8")
+        rows, offsets, targets = array("q"), array("q"), array("q")
+        rows.fromfile(file, rows_count)
+        offsets.fromfile(file, rows_count + 1)
+        targets.fromfile(file, targets_count)
+
+    return CSRGraph(relation=relation, rows=_little_endian(rows),
+                    offsets=_little_endian(offsets), targets=_little_endian(targets))
+
+
+def save_frontier(path: str, depth: int, level: array, next_level: array) -> None:
+    """
+    Writes the ids still to expand, so a crawl can be resumed.
+
+    :param depth: depth of the level.
+    :param level: ids of the level not expanded yet.
+    :param next_level: ids found for the next level so far.
+    """
+    with open(f"{path}.part", "wb") as file:
+        file.write(FRONTIER_HEADER.pack(depth, len(level), len(next_level)))
+        _little_endian(level).tofile(file)
+        _little_endian(next_level).tofile(file)
+    os.replace(f"{path}.part", path)
+
+
+def load_frontier(path: str) -> Tuple[int, array, array]:
+    """
+    :return: depth, level and next level written by save_frontier.
+    """
+    with open(path, "rb") as file:
+        depth, level_count, next_count = FRONTIER_HEADER.unpack(file.read(FRONTIER_HEADER.size))
+        level, next_level = array("q"), array("q")
+        level.fromfile(file, level_count)
+        next_level.fromfile(file, next_count)
+    return depth, _little_endian(level), _little_endian(next_level)
+
+
+class GraphCrawler:
+    """
+    Crawls the follow graph breadth-first from seed profiles.
+
+    Visited ids live in a VisitedSet and every BFS level in an
+    int64 array, so millions of nodes cost a few bytes each. The
+    edges of every relation go to a CSR file: one row per expanded
+    profile, with the ids of its followers (or followed profiles).
+    Private profiles that the cookie user does not follow are
+    not expanded.
+
+    The ids still to expand are written to frontier.bin when the
+    crawl stops, so a crawl cut by the budget or an error can go
+    on with resume=True. The seeds are only resolved by a new crawl.
+
+    :param insta: InstaCrawler instance.
+    :param output_dir: where the CSR files, the visited set and
+    the nodes.tsv (id and username of every node) are written.
+    :param relations: "followers" and/or "followed_by_user".
+    :param max_depth: how many hops from the seeds are expanded.
+    :param max_requests: request budget of the whole crawl.
+    :param max_pages_per_node: page limit per profile, so one huge
+    profile does not take the whole budget.
+    :param resume: go on with the crawl of the output_dir.
+    :param overwrite: start again, the files of an earlier crawl
+    in the output_dir are removed. Without resume or overwrite an
+    earlier crawl in the output_dir raises FileExistsError.
+    """
+    FILES = ("visited.sqlite", "nodes.tsv", "frontier.bin")
+
+    def __init__(self, insta: Any, output_dir: str,
+                 relations: Iterable[str] = ("followers", "followed_by_user"),
+                 max_depth: int = 1, max_requests: int = 1000,
+                 max_pages_per_node: Optional[int] = None,
+                 capacity: int = 1_000_000, resume: bool = False, overwrite: bool = False) -> None:
+        if resume and overwrite:
+            raise ValueError("resume and overwrite can not be used together")
+        self.insta = insta
+        self.output_dir = output_dir
+        self.relations = list(relations)
+        self.max_depth = max_depth
+        self.max_requests = max_requests
+        self.max_pages_per_node = max_pages_per_node
+        self.capacity = capacity
+        self.resume = resume
+        self.overwrite = overwrite
+        self.requests = 0
+
+    def crawl(self, seeds: Iterable[str]) -> Dict:
+        """
+        :param seeds: usernames to start from.
+
+        :return: crawl statistics and paths of the CSR files.
+        """
+        self._prepare_output_dir()
+
+        visited = VisitedSet(path=os.path.join(self.output_dir, "visited.sqlite"), capacity=self.capacity)
+        writers = {
+            relation: CSRWriter(path=os.path.join(self.output_dir, f"{relation}.csr"), relation=relation,
+                                resume=self.resume)
+            for relation in self.relations
+        }
+        frontier_path = os.path.join(self.output_dir, "frontier.bin")
+        depth, level, next_level = (load_frontier(frontier_path) if os.path.exists(frontier_path)
+                                    else (0, array("q"), array("q")))
+        position = 0
+        stats: Dict[str, Any] = {"expanded": 0, "nodes": 0, "edges": 0, "depth": depth, "budget_exhausted": False}
+
+        try:
+            with open(os.path.join(self.output_dir, "nodes.tsv"), "a", encoding="utf-8") as nodes:
+                if not visited.count:
+                    level = self._resolve_seeds(seeds, visited, nodes)
+                while level and depth < self.max_depth:
+                    for user_id in level:
+                        if not self._has_budget():
+                            stats["budget_exhausted"] = True
+                            break
+                        edges = self._expand_node(user_id, writers, visited, nodes, next_level)
+                        if edges is None:
+                            # the node stays in the frontier
+                            stats["budget_exhausted"] = True
+                            break
+                        stats["edges"] += edges
+                        stats["expanded"] += 1
+                        position += 1
+                    if position < len(level):
+                        break
+
+                    depth += 1
+                    level, next_level, position = next_level, array("q"), 0
+                    logger.info("Graph crawl depth %s: %s expanded, %s nodes, %s requests",
+                                depth, stats["expanded"], visited.count, self.requests)
+        finally:
+            # what was collected before an error is kept
+            save_frontier(frontier_path, depth, level[position:], next_level)
+            stats["depth"] = depth
+            stats["nodes"] = visited.count
+            stats["requests"] = self.requests
+            stats["files"] = {relation: writer.close() for relation, writer in writers.items()}
+            visited.close()
+
+        return stats
+
+    def _prepare_output_dir(self) -> None:
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        names = self.FILES + tuple(f"{relation}.csr" for relation in ("followers", "followed_by_user"))
+        found = [name for name in names if os.path.exists(os.path.join(self.output_dir, name))]
+        if not found or self.resume:
+            return
+        if not self.overwrite:
+            raise FileExistsError(f"{self.output_dir} has an earlier crawl ({', '.join(found)}), "
+                                  f"resume or overwrite it")
+        for name in found:
+            os.remove(os.path.join(self.output_dir, name))
+
+    def _expand_node(self, user_id: int, writers: Dict[str, CSRWriter], visited: VisitedSet,
+                     nodes: Any, next_level: array) -> Optional[int]:
+        """
+        :return: number of edges, None when the request budget ran
+        out before the node was expanded.
+        """
+        # the rows are written once all the relations are expanded,
+        # so a node cut by an error or the budget is expanded again
+        # on resume
+        rows = {}
+        for relation in writers:
+            targets = self._expand(user_id, relation, visited, nodes, next_level)
+            if targets is None:
+                return None
+            rows[relation] = targets
+        for relation, targets in rows.items():
+            writers[relation].add_row(user_id, targets)
+        return sum(len(targets) for targets in rows.values())
+
+    def _has_budget(self) -> bool:
+        return self.requests < self.max_requests
+
+    def _resolve_seeds(self, seeds: Iterable[str], visited: VisitedSet, nodes: Any) -> array:
+        level = array("q")
+        for username in seeds:
+            if not self._has_budget():
+                break
+            self.requests += 1
+            try:
+                user = self.insta.get_user_info(url=f"{self.insta.BASE_URL}{username}/",
+                                                fields=["user_id", "username"])
+            except (PrivateProfileError, NotFoundError) as e:
+                logger.warning("Seed %s skipped: %r", username, e)
+                continue
+
+            user_id = int(user.user_id)
+            if visited.add_many([user_id]):
+                nodes.write(f"{user_id}\t{username}\n")
+                level.append(user_id)
+
+        return level
+
+    def _expand(self, user_id: int, relation: str, visited: VisitedSet,
+                nodes: Any, next_level: array) -> Optional[array]:
+        """
+        :return: ids of the relation, None when the budget ran out
+        before the last page.
+        """
+        targets = array("q")
+        pages = 0
+        try:
+            for page in self.insta.iter_follow_pages(user_id=user_id, relation=relation):
+                self.requests += 1
+                pages += 1
+
+                targets.extend(_add_page(page, visited, nodes, next_level))
+                if pages == self.max_pages_per_node:
+                    break
+                if not self._has_budget():
+                    if page.get("page_info", {}).get("has_next_page"):
+                        return None
+                    break
+        except (KeyError, TypeError) as e:
+            # private profiles come back without "data"
+            self.requests += 1
+            logger.warning("User %s %s not expanded: %r", user_id, relation, e)
+
+        return targets
+
+
+def _add_page(page: Dict, visited: VisitedSet, nodes: Any, next_level: array) -> List[int]:
+    """
+    Writes the users of a page met for the first time.
+
+    :return: ids of all the users of the page.
+    """
+    found = {}
+    for edge in page["edges"]:
+        node = edge["node"]
+        found[int(node["id"])] = node
+
+    for new_id in visited.add_many(found):
+        node = found[new_id]
+        nodes.write(f"{new_id}\t{node['username']}\n")
+        if not node.get("is_private") or node.get("followed_by_viewer"):
+            next_level.append(new_id)
+
+    return list(found)
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder == "little":
+        return values
+
+    swapped = array("q", values)
+    swapped.byteswap()
+    return swapped
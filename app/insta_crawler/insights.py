@@ -0,0 +1,240 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .utils import read_export
+
+WEEK = 7 * 24 * 60 * 60
+# scales the median absolute deviation to a standard deviation
+MAD_SCALE = 1.4826
+
+
+@dataclass
+class PostsTable:
+    """
+    Posts and igtvs of many profiles as columns, sorted by profile
+    and by posting time.
+
+    :param profile: index of the owner in profiles, per post.
+    :param followers: followers of every profile, nan when unknown.
+    """
+    profiles: List[str]
+    followers: np.ndarray
+    profile: np.ndarray
+    shortcodes: np.ndarray
+    likes: np.ndarray
+    comments: np.ndarray
+    posted_at: np.ndarray
+    content_len: np.ndarray
+
+    @classmethod
+    def from_records(cls, records: Iterable[Any],
+                     followers: Optional[Dict[str, int]] = None) -> "PostsTable":
+        """
+        :param records: Post and IGTV models or their dicts.
+        :param followers: User.followed_by by username.
+        """
+        rows = [dict(record) for record in records]
+        profiles = sorted({row["owner_username"] for row in rows})
+        position = {username: number for number, username in enumerate(profiles)}
+        followers = followers or {}
+
+        profile = np.array([position[row["owner_username"]] for row in rows], dtype=np.int64)
+        posted_at = np.array([row["posted_at"] for row in rows], dtype=np.int64)
+        order = np.lexsort((posted_at, profile))
+
+        def column(name: str) -> np.ndarray:
+            return np.array([row.get(name) or 0 for row in rows], dtype=np.float64)[order]
+
+        return cls(
+            profiles=profiles,
+            followers=np.array([followers.get(username) or np.nan for username in profiles], dtype=np.float64),
+            profile=profile[order],
+            shortcodes=np.array([str(row["shortcode"]) for row in rows], dtype=object)[order],
+            likes=column("likes"),
+            comments=column("comments"),
+            posted_at=posted_at[order],
+            content_len=column("post_content_len"),
+        )
+
+    @classmethod
+    def from_exports(cls, paths: Iterable[str],
+                     followers: Optional[Dict[str, int]] = None) -> "PostsTable":
+        """
+        Reads the posts and igtvs of exports (see read_export).
+        Users met in the exports give their followers counts.
+        """
+        records, known = load_exports(paths)
+        return cls.from_records(records, followers={**known, **(followers or {})})
+
+
+@dataclass
+class Insights:
+    """
+    Metrics of every profile, in the order of PostsTable.profiles.
+
+    :param engagement: (likes + comments) / followers, per post.
+    :param rolling: rolling mean of the engagement over the last
+    window posts, per post. Likes and comments are used instead
+    when the followers are unknown.
+    :param outliers: posts far from the usual engagement of their
+    profile, by robust z-score.
+    """
+    table: PostsTable
+    engagement: np.ndarray
+    rolling: np.ndarray
+    zscore: np.ndarray
+    outliers: np.ndarray
+    posts: np.ndarray
+    engagement_rate: np.ndarray
+    likes_mean: np.ndarray
+    comments_mean: np.ndarray
+    content_mean: np.ndarray
+    posts_per_week: np.ndarray
+    median_gap_hours: np.ndarray
+
+    def profile(self, username: str) -> Dict[str, Any]:
+        """
+        Metrics of one profile, with its rolling series and outliers.
+        """
+        number = self.table.profiles.index(username)
+        rows = self.table.profile == number
+        return {
+            "username": username,
+            "followers": _number(self.table.followers[number]),
+            "posts": int(self.posts[number]),
+            "engagement_rate": _number(self.engagement_rate[number]),
+            "likes_mean": _number(self.likes_mean[number]),
+            "comments_mean": _number(self.comments_mean[number]),
+            "content_mean": _number(self.content_mean[number]),
+            "posts_per_week": _number(self.posts_per_week[number]),
+            "median_gap_hours": _number(self.median_gap_hours[number]),
+            "rolling": [_number(value) for value in self.rolling[rows]],
+            "outliers": list(self.table.shortcodes[rows & self.outliers]),
+        }
+
+    def summary(self) -> List[Dict[str, Any]]:
+        return [self.profile(username) for username in self.table.profiles]
+
+
+def compute_insights(table: PostsTable, window: int = 10, threshold: float = 3.5) -> Insights:
+    """
+    Computes the metrics of all the profiles at once, without a loop
+    over the profiles.
+
+    :param window: posts in the rolling mean.
+    :param threshold: robust z-score from which a post is an outlier.
+    """
+    groups = len(table.profiles)
+    profile = table.profile
+    posts = np.bincount(profile, minlength=groups)
+    starts = (np.cumsum(posts) - posts).astype(np.int64)
+
+    interactions = table.likes + table.comments
+    followers = table.followers[profile]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        engagement = np.where(followers > 0, interactions / followers, np.nan)
+        # without the followers count the interactions are ranked
+        measure = np.where(np.isnan(engagement), interactions, engagement)
+
+        rolling = _rolling_mean(measure, profile, starts, window)
+        zscore = _robust_zscore(measure, profile, starts, posts)
+
+        engagement_rate = _group_mean(np.nan_to_num(engagement), profile, posts)
+        engagement_rate[np.isnan(table.followers) | (table.followers <= 0)] = np.nan
+        posts_per_week, median_gap = _cadence(table.posted_at, profile, starts, posts)
+
+        return Insights(
+            table=table,
+            engagement=engagement,
+            rolling=rolling,
+            zscore=zscore,
+            outliers=np.abs(zscore) > threshold,
+            posts=posts,
+            engagement_rate=engagement_rate,
+            likes_mean=_group_mean(table.likes, profile, posts),
+            comments_mean=_group_mean(table.comments, profile, posts),
+            content_mean=_group_mean(table.content_len, profile, posts),
+            posts_per_week=posts_per_week,
+            median_gap_hours=median_gap / 3600,
+        )
+
+
+def load_exports(paths: Iterable[str]) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    :return: posts and igtvs of the exports, and followers counts of
+    the users in them.
+    """
+    records: List[Dict] = []
+    followers: Dict[str, int] = {}
+    for path in paths:
+        for content_type, items in read_export(path):
+            if content_type in ("posts", "igtv"):
+                records += items
+            for item in items:
+                if "followed_by" in item and "username" in item:
+                    followers[item["username"]] = item["followed_by"]
+    return records, followers
+
+
+def _group_mean(values: np.ndarray, profile: np.ndarray, posts: np.ndarray) -> np.ndarray:
+    sums = np.bincount(profile, weights=values, minlength=len(posts))
+    return sums / posts
+
+
+def _rolling_mean(values: np.ndarray, profile: np.ndarray, starts: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean of the last window values of the same profile, fewer at the
+    start of a profile.
+    """
+    cumsum = np.concatenate(([0.0], np.cumsum(np.nan_to_num(values))))
+    index = np.arange(len(values))
+    first = np.maximum(index - window + 1, starts[profile])
+    return (cumsum[index + 1] - cumsum[first]) / (index + 1 - first)
+
+
+def _group_median(values: np.ndarray, profile: np.ndarray, starts: np.ndarray,
+                  posts: np.ndarray) -> np.ndarray:
+    ordered = values[np.lexsort((values, profile))]
+    median = np.full(len(posts), np.nan)
+    present = posts > 0
+    low = ordered[starts[present] + (posts[present] - 1) // 2]
+    high = ordered[starts[present] + posts[present] // 2]
+    median[present] = (low + high) / 2
+    return median
+
+
+def _robust_zscore(values: np.ndarray, profile: np.ndarray, starts: np.ndarray,
+                   posts: np.ndarray) -> np.ndarray:
+    median = _group_median(values, profile, starts, posts)[profile]
+    deviation = np.abs(values - median)
+    mad = _group_median(deviation, profile, starts, posts)[profile] * MAD_SCALE
+    # a profile with mostly equal values has no spread to measure
+    return np.where(mad > 0, (values - median) / mad, 0.0)
+
+
+def _cadence(posted_at: np.ndarray, profile: np.ndarray, starts: np.ndarray,
+             posts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: posts per week and median seconds between posts.
+    """
+    gaps = np.diff(posted_at).astype(np.float64)
+    # the gap before the first post of a profile is not a gap
+    same = profile[1:] == profile[:-1]
+    gap_profile = profile[1:][same]
+    gaps = gaps[same]
+
+    # a profile without posts, or a table without rows, has no span
+    present = posts > 0
+    span = np.zeros(len(posts))
+    span[present] = posted_at[starts[present] + posts[present] - 1] - posted_at[starts[present]]
+    posts_per_week = np.where(span > 0, (posts - 1) / np.where(span > 0, span, 1) * WEEK, np.nan)
+
+    gap_counts = np.maximum(posts - 1, 0)
+    gap_starts = (np.cumsum(gap_counts) - gap_counts).astype(np.int64)
+    return posts_per_week, _group_median(gaps, gap_profile, gap_starts, gap_counts)
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 6)
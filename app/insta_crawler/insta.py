@@ -1,18 +1,35 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from itertools import islice
 from json.decoder import JSONDecodeError
 import logging
 from random import randint
+import re
+import threading
+import time
 from time import sleep
-from typing import Dict, List, Optional, Type, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
 
 from fake_useragent import UserAgent
 import requests
 
 from .authentication import Auth
-from .exceptions import (BlockedByInstagramError, NotFoundError,
-                         PrivateProfileError)
-from .models import Highlight, IGTV, Post, Storie, User
+from .cache import UserCache
+from .exceptions import (AuthExpiredError, BlockedByInstagramError,
+                         NotFoundError, PrivateProfileError)
+from .media import MediaPolicy
+from .models import Comment, Highlight, IGTV, Liker, Post, Storie, User
+from .rate_limit import RateLimiter
+from .resilience import endpoint_key, ResilientClient
 from .utils import how_sleep
 
+logger = logging.getLogger(__name__)
+
+PROFILE_URL_RE = re.compile(r"^https?://(?:www\.)?instagram\.com/([A-Za-z0-9._]+)/?$")
+NOT_PROFILE_PATHS = {"p", "tv", "reel", "stories", "explore", "accounts"}
+# json answers and redirects of a request without a valid session
+AUTH_LOST_MESSAGES = {"login_required", "checkpoint_required", "challenge_required"}
+AUTH_LOST_PATHS = ("accounts/login", "challenge/")
+
 
 class InstaCrawler:
     """
@@ -29,42 +46,105 @@ class InstaCrawler:
     followed_by_user_query_hash: str = "d04b0a864b4b54837c0d870b0e77e076"
     user_igtvs_query_hash: str = "bc78b344a68ed16dd5d7f264681c4c76"
     cookie_user_timeline_hash: str = "b1245d9d251dff47d91080fbdd6b274a"
+    comments_query_hash: str = "bc3296d1ce80a24b1b6e40b1e72903f5"
+    comment_replies_query_hash: str = "1ee91c32fc020d44158a3192eda98247"
+    likers_query_hash: str = "d5d763b1e2acf209d62d22d184488e57"
+    hashtag_query_hash: str = "9b498c08113f1e09617a1703c22b2f32"
+    location_query_hash: str = "36bd0f2bf5911908de389b8ceaa3be6d"
     x_ig_app_id: str = "936619743392459"
+    stories_batch_size: int = 20
+    reauth_attempts: int = 2
 
     cookie: Dict
-
-    def __init__(self, login: str, password: str, authenticator: Type[Auth]):
+    rate_limiter: Optional[RateLimiter]
+    user_cache: UserCache
+    media_policy: MediaPolicy
+    http: ResilientClient
+
+    def __init__(self, login: str, password: str, authenticator: Type[Auth],
+                 rate_limiter: Optional[RateLimiter] = None,
+                 user_cache: Optional[UserCache] = None,
+                 media_policy: Optional[MediaPolicy] = None,
+                 http: Optional[ResilientClient] = None):
         self.login = login
         self.password = password
+        self.authenticator = authenticator
+        self.auth_generation = 0
+        self._auth_lock = threading.Lock()
+        self.http = http or ResilientClient()
         self.cookie = self._auth_and_get_cookie(authenticator)
+        self.rate_limiter = rate_limiter
+        self.user_cache = user_cache if user_cache is not None else UserCache()
+        self.media_policy = media_policy or MediaPolicy()
 
-        logging.basicConfig(filename="insta_crawler.log",
-                            format="%(asctime)s: %(name)s: %(levelname)s: %(funcName)s: %(lineno)s: %(message)s",
-                            level=logging.INFO)
-        logging.info(f"Class initialised with cookie: '{self.cookie}'")
+        logger.info("Class initialised with cookies: %s", sorted(self.cookie))
 
     def _make_request(self, url: str,
-                      params: Dict[str, str],
+                      params: Dict[str, Any],
                       headers: Optional[Dict[str, Union[str, int]]] = None) -> Dict:
         """
         Makes a request to the given url with the parameters,
         headers and cookies.
 
+        Transient failures are retried by self.http, and profile
+        lookups may be hedged. When the session is lost in the
+        middle of a crawl, logs in again and repeats the same
+        request, so paginations go on from the same cursor.
+
         :param url: URL to send.
         :param params: URL parameters to append to the URL.
         :param headers: dictionary of headers to send.
         """
-        data = requests.get(url=url,
-                            params=params,
-                            cookies=self.cookie,
-                            headers=headers)
+        attempt = 0
+        while True:
+            generation = self.auth_generation
+            started = time.monotonic()
+            try:
+                data = self._request_json(url=url, params=params, headers=headers)
+                self._log_request(url, params, started)
+                return data
+            except AuthExpiredError as e:
+                attempt += 1
+                logger.warning("Session lost, attempt %s. Cause: %r", attempt, e)
+                if attempt > self.reauth_attempts:
+                    raise
+                self._refresh_auth(generation)
+
+    def _log_request(self, url: str, params: Dict[str, Any], started: float) -> None:
+        # the fields are only gathered when someone listens
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        latency = time.monotonic() - started
+        logger.debug("Request to %s took %.3fs", url, latency, extra={
+            "category": "request",
+            "endpoint": endpoint_key(url, params),
+            "user": self._username_from_url(url),
+            "cursor": params.get("after"),
+            "latency": round(latency, 3),
+        })
+
+    def _request_json(self, url: str,
+                      params: Dict[str, Any],
+                      headers: Optional[Dict[str, Union[str, int]]] = None) -> Dict:
+        hedge = self._username_from_url(url) is not None
+        data = self.http.get(url=url,
+                             params=params,
+                             cookies=self.cookie,
+                             headers=headers,
+                             before_send=self._wait_for_rate_limit,
+                             hedge=hedge)
+        self._check_auth(data)
         try:
             data_dict = data.json()
+            self._check_auth(data, data_dict)
             if len(data_dict) == 0:  # This part for the single_post function
                 # url should be without any parameters
                 original_url = data.url.split("?")[0]
-                data = requests.get(url=original_url,
-                                    cookies=self.cookie)
+                data = self.http.get(url=original_url,
+                                     cookies=self.cookie,
+                                     before_send=self._wait_for_rate_limit,
+                                     hedge=hedge)
+                self._check_auth(data)
                 # when the profile is private and the cookie user
                 # is not following the profile, the request url
                 # changes to the user profile url, but this is
@@ -72,18 +152,54 @@ class InstaCrawler:
                 # the original url and the redirected url are equal
                 if original_url == data.url:
                     # if they are equal but the response is empty
-                    logging.error("NotFoundError")
+                    logger.error("NotFoundError")
                     raise NotFoundError()
                 else:
                     raise PrivateProfileError()
         except JSONDecodeError as e:
-            logging.error(f"BlockedByInstagramError. Cause: {repr(e)}")
+            logger.error("BlockedByInstagramError. Cause: %r", e)
             raise BlockedByInstagramError()
         else:
             return data_dict
 
+    def _check_auth(self, response: requests.Response, data: Optional[Any] = None) -> None:
+        """
+        Raises AuthExpiredError when Instagram sends the request to
+        the login page or answers that a login is required.
+        """
+        lost = response.status_code == 401 or any(path in response.url for path in AUTH_LOST_PATHS)
+        if isinstance(data, dict):
+            lost = lost or data.get("message") in AUTH_LOST_MESSAGES or bool(data.get("require_login"))
+        if lost:
+            raise AuthExpiredError()
+
+    def _refresh_auth(self, generation: int) -> None:
+        """
+        Logs in again, once for all the threads that lost the
+        session with the same cookie.
+
+        :param generation: auth_generation the failed request
+        was sent with.
+        """
+        with self._auth_lock:
+            if generation != self.auth_generation:
+                # another thread has already logged in
+                return
+            logger.info("Logging in again")
+            self.cookie = self._auth_and_get_cookie(self.authenticator)
+            self.auth_generation += 1
+
+    def _wait_for_rate_limit(self) -> None:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
     def _auth_and_get_cookie(self, authenticator: Type[Auth]) -> Dict:
-        auth = authenticator(login=self.login, password=self.password)
+        # the login leaves from the proxy of the session, if any
+        proxy = self.http.session_proxy()
+        if proxy is not None:
+            auth = authenticator(login=self.login, password=self.password, proxy=proxy)
+        else:
+            auth = authenticator(login=self.login, password=self.password)
         cookies = auth.get_cookies()
 
         return cookies
@@ -103,58 +219,61 @@ class InstaCrawler:
             user_url = f"{self.BASE_URL}{cookie_user_username}/"
             cookie_user_info = self.get_user_info(url=user_url)
 
-            logging.info(msg=f"cookie user: {user_url}")
+            logger.info("cookie user: %s", user_url)
 
         return cookie_user_info
 
-    def get_user_info(self, url: str, **kwargs) -> User:
+    def get_user_info(self, url: str,
+                      fields: Optional[Iterable[str]] = None,
+                      **kwargs: Any) -> User:
         """
         Gives information about the user by link to his profile.
 
         :param url: link to a profile
         (https://www.instagram.com/username/).
+        :param fields: names of the User fields to fill in. The rest
+        of the profile (e.g. last_twelve_posts) is not parsed at all.
+        All fields are filled in when omitted.
         """
 
-        params = {"__a": "1"}
-        user_data = self._make_request(url, params)["graphql"]
-        user_data = user_data.get("user") or user_data.get("shortcode_media")["owner"]
+        if fields is not None:
+            fields = list(fields)
+
+        username = self._username_from_url(url)
+        if username is None:
+            user = self._request_user_info(url=url, fields=fields)
+        else:
+            user = self.user_cache.get_or_load(
+                username=username,
+                loader=lambda: self._request_user_info(url=url, fields=fields),
+                fields=fields,
+            )
 
-        logging.info(msg=f"user info requested: {url}")
-
-        if user_data.get("edge_owner_to_timeline_media"):
-            posts_count = user_data["edge_owner_to_timeline_media"]["count"]
-
-            last_twelve_posts = []
-            for post in user_data["edge_owner_to_timeline_media"]["edges"]:
-                post = post["node"]
-                last_twelve_posts.append(
-                    self.forming_post_data(post_data=post))
-
-        user = User(
-            bio=user_data.get("biography"),
-            external_url=user_data.get("external_url"),
-            followed_by=user_data["edge_followed_by"]["count"],
-            follow=user_data["edge_follow"]["count"],
-            full_name=user_data.get("full_name"),
-            highlight_reel_count=user_data.get("highlight_reel_count"),
-            user_id=user_data.get("id"),
-            is_busuness_account=user_data.get("is_business_account"),
-            business_category_name=user_data.get("business_category_name"),
-            category_name=user_data.get("category_name"),
-            is_private=user_data.get("is_private"),
-            username=user_data.get("username"),
-            igtv_count=user_data["edge_felix_video_timeline"]["count"],
-            posts_count=posts_count or 0,
-            last_twelve_posts=last_twelve_posts or [],
-            profile_pic_hd=user_data.get("profile_pic_url_hd"),
-            followed_by_viewer=user_data.get("followed_by_viewer"),
-            user_url=url,
-        )
         if self._can_parse_profile(user) and kwargs.get("target") is None:
             raise PrivateProfileError()
 
         return user
 
+    def _request_user_info(self, url: str,
+                           fields: Optional[Iterable[str]] = None) -> User:
+        params = {"__a": "1"}
+        user_data = self._make_request(url, params)["graphql"]
+        user_data = user_data.get("user") or user_data.get("shortcode_media")["owner"]
+
+        logger.info("user info requested: %s", url)
+
+        return self.forming_user_data(user_data=user_data, url=url, fields=fields)
+
+    def _username_from_url(self, url: str) -> Optional[str]:
+        """
+        Gives the username if the url is a link to a profile.
+        """
+        match = PROFILE_URL_RE.match(url)
+        if match is None or match.group(1) in NOT_PROFILE_PATHS:
+            return None
+
+        return match.group(1)
+
     def get_single_post(self, url: str) -> Post:
         """
         Gives information about the post by link to it.
@@ -162,7 +281,7 @@ class InstaCrawler:
         :param url: link to the post or igtv
         (https://www.instagram.com/[p OR tv]/shortcode/).
         """
-        logging.info(msg=f"single post: {url}")
+        logger.info("single post: %s", url)
 
         params = {"__a": "1"}
         post_data = self._make_request(
@@ -170,6 +289,50 @@ class InstaCrawler:
 
         return self.forming_post_data(post_data=post_data)
 
+    def refresh_media_links(self, items: List[Any], content_type: str) -> Dict[str, List[str]]:
+        """
+        Requests fresh media links of collected posts, igtvs, stories
+        or highlights, as the signed links expire. Stories and
+        highlights are requested in batches.
+
+        :param content_type: "posts", "igtv", "stories" or
+        "highlights".
+
+        :return: links by shortcode (highlight id for highlights).
+        Items that are gone are missing.
+        """
+        if content_type == "highlights":
+            reels = self.get_stories_batch(reel_ids=[f"highlight:{item.highlight_id}" for item in items])
+            return {
+                reel_id.split(":", 1)[-1]: [storie.post_content[0] for storie in stories]
+                for reel_id, stories in reels.items()
+            }
+        if content_type == "stories":
+            return self._refresh_stories_links(items)
+
+        links = {}
+        for item in items:
+            try:
+                links[str(item.shortcode)] = self.get_single_post(url=item.post_link).post_content
+            except (NotFoundError, PrivateProfileError, KeyError, TypeError) as e:
+                logger.warning("Links of %s not refreshed: %r", item.post_link, e)
+        return links
+
+    def _refresh_stories_links(self, stories: List[Storie]) -> Dict[str, List[str]]:
+        user_ids = []
+        for username in dict.fromkeys(storie.owner_username for storie in stories):
+            try:
+                user_ids.append(self.get_user_info(url=f"{self.BASE_URL}{username}/", fields=["user_id"]).user_id)
+            except (NotFoundError, PrivateProfileError) as e:
+                logger.warning("Stories of %s not refreshed: %r", username, e)
+
+        reels = self.get_stories_batch(reel_ids=user_ids)
+        return {
+            str(storie.shortcode): storie.post_content
+            for reel in reels.values()
+            for storie in reel
+        }
+
     def get_highlights(self, url: str) -> List[Highlight]:
         """
         Collects all content and information about highlights
@@ -196,11 +359,18 @@ class InstaCrawler:
             query_url,
             params=params,
         )["data"]["user"]
-        logging.info(f"User {url} highlights.")
+        logger.info("User %s highlights.", url)
+
+        highlights_content = self.get_stories_batch(
+            reel_ids=[
+                f'highlight:{hl["node"]["id"]}'
+                for hl in highlights_data["edge_highlight_reels"]["edges"]
+            ],
+        )
 
         highlights = []
         for hl in highlights_data["edge_highlight_reels"]["edges"]:
-            highlight_content = self.get_stories(reel_id=f'highlight:{hl["node"]["id"]}')
+            highlight_content = highlights_content.get(f'highlight:{hl["node"]["id"]}', [])
             post_content = [
                 post.post_content[0]
                 for post in highlight_content
@@ -217,135 +387,157 @@ class InstaCrawler:
                 ),
             )
 
-        logging.info(f"Highlights count: {len(highlights)}")
+        logger.info("Highlights count: %s", len(highlights))
         return highlights
 
-    def get_posts(self, url: str) -> List[Post]:
+    def get_posts(self, url: str, since: Optional[int] = None,
+                  until: Optional[int] = None, limit: Optional[int] = None) -> List[Post]:
         """
         Collects all content and information about regular posts
         on the user page.
 
         :param url: link to a profile
         (https://www.instagram.com/username/).
+        :param since: only posts taken at this timestamp or later.
+        :param until: only posts taken at this timestamp or earlier.
+        :param limit: at most this many posts, the newest first.
         """
 
-        query_url = f"{self.BASE_URL}{self.GRAPHQL_QUERY}"
-        posts = []
-        after = ""
+        posts = list(self.iter_posts(url=url, since=since, until=until, limit=limit))
+        logger.info("User %s posts. Count: %s", url, len(posts))
 
-        user_data = self.get_user_info(url=url)
+        return posts
 
-        while True:
-            params = {
-                "query_hash": self.all_posts_query_hash,
-                "id": user_data.user_id,
-                "first": 50,
-                "after": after if after else "",
-            }
+    def iter_posts(self, url: str, since: Optional[int] = None,
+                   until: Optional[int] = None, limit: Optional[int] = None) -> Iterator[Post]:
+        """
+        Same as get_posts, but gives the posts one by one
+        as the pages arrive.
 
-            sleep(randint(0, 2))
-            posts_data = self._make_request(
-                url=query_url,
-                params=params,
-            )["data"]["user"]["edge_owner_to_timeline_media"]
-
-            for post in posts_data["edges"]:
-                post = post["node"]
-                description = None
-                if post["edge_media_to_caption"]["edges"]:
-                    description = post["edge_media_to_caption"]["edges"][0]["node"]["text"]
-
-                if post.get("edge_sidecar_to_children"):
-                    post_links = post["edge_sidecar_to_children"]["edges"]
-                    post_content = [
-                        (
-                            post["node"].get("video_url")
-                            or
-                            post["node"].get("display_url")
-                        )
-                        for post in post_links
-                    ]
-                else:
-                    post_content = [
-                        (post.get("video_url") or post.get("display_url"))]
-
-                posts.append(
-                    Post(
-                        description=description,
-                        likes=post["edge_media_preview_like"]["count"],
-                        comments=post["edge_media_to_comment"]["count"],
-                        owner_link=f'{self.BASE_URL}{post["owner"]["username"]}',
-                        owner_username=post["owner"]["username"],
-                        post_content=post_content,
-                        post_content_len=len(post_content),
-                        posted_at=post["taken_at_timestamp"],
-                        shortcode=post["shortcode"],
-                        post_link=f'{self.BASE_URL}p/{post["shortcode"]}/',
-                    ),
-                )
-            if posts_data["page_info"]["has_next_page"]:
-                after = posts_data["page_info"]["end_cursor"]
-            else:
-                logging.info(
-                    msg=f"User {url} posts. Count: {len(posts)}")
-                break
+        :param url: link to a profile
+        (https://www.instagram.com/username/).
+        """
 
-        return posts
+        user_data = self.get_user_info(url=url)
 
-    def get_all_igtv(self, url: str) -> List[IGTV]:
+        nodes = self._iter_timeline_nodes(user_id=user_data.user_id, timeline="posts", since=since, until=until)
+        for node in islice(nodes, limit):
+            yield self.forming_timeline_post_data(post_data=node)
+
+    def get_all_igtv(self, url: str, since: Optional[int] = None,
+                     until: Optional[int] = None, limit: Optional[int] = None) -> List[IGTV]:
         """
         Collects all content and information about igtvs
         on the user page.
 
+        :param url: link to a profile
+        (https://www.instagram.com/username/).
+        :param since: only igtvs taken at this timestamp or later.
+        :param until: only igtvs taken at this timestamp or earlier.
+        :param limit: at most this many igtvs, the newest first.
+        """
+
+        logger.info("User %s igtvs.", url)
+        igtvs = list(self.iter_igtv(url=url, since=since, until=until, limit=limit))
+        logger.info("IGTVs count: %s", len(igtvs))
+
+        return igtvs
+
+    def iter_igtv(self, url: str, since: Optional[int] = None,
+                  until: Optional[int] = None, limit: Optional[int] = None) -> Iterator[IGTV]:
+        """
+        Same as get_all_igtv, but gives the igtvs one by one
+        as the pages arrive.
+
         :param url: link to a profile
         (https://www.instagram.com/username/).
         """
 
         user_data = self.get_user_info(url=url)
 
-        query_url = f"{self.BASE_URL}{self.GRAPHQL_QUERY}"
-        igtvs = []
-        after = ""
+        # filtered before forming_igtv_data, which makes a request
+        nodes = self._iter_timeline_nodes(user_id=user_data.user_id, timeline="igtv", since=since, until=until)
+        for node in islice(nodes, limit):
+            yield self.forming_igtv_data(igtv_data=node)
 
-        logging.info(msg=f"User {url} igtvs.")
-        while True:
+    def _iter_timeline_nodes(self, user_id: Union[int, str], timeline: str,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Gives the timeline nodes taken between since and until.
+        Timelines come newest first, so the pagination stops at the
+        first node older than since. Pinned posts are out of that
+        order and never stop it.
+        """
+        for page in self.iter_timeline_pages(user_id=user_id, timeline=timeline):
+            for edge in page["edges"]:
+                node = edge["node"]
+                taken_at = node["taken_at_timestamp"]
+                if since is not None and taken_at < since:
+                    if node.get("pinned_for_users"):
+                        continue
+                    return
+                if until is not None and taken_at > until:
+                    continue
+                yield node
+
+    def iter_timeline_pages(self, user_id: Union[int, str], timeline: str) -> Iterator[Dict]:
+        """
+        Pages through the posts or igtvs of a user without
+        requesting the profile itself.
+
+        :param user_id: id of the profile.
+        :param timeline: "posts" or "igtv".
+
+        :return: pages with "edges" and "page_info".
+        """
+
+        if timeline == "posts":
+            params = {
+                "query_hash": self.all_posts_query_hash,
+                "id": user_id,
+                "first": 50,
+            }
+            return self._paginate(params=params, edge="edge_owner_to_timeline_media", pause=True)
+        elif timeline == "igtv":
             params = {
                 "query_hash": self.user_igtvs_query_hash,
-                "id": str(user_data.user_id),
+                "id": str(user_id),
                 "first": "50",
-                "after": after if after else "",
             }
+            return self._paginate(params=params, edge="edge_felix_video_timeline")
+        else:
+            raise ValueError(f"Unknown timeline: {timeline}")
 
-            igtv_data = self._make_request(url=query_url, params=params)[
-                "data"]["user"]["edge_felix_video_timeline"]
-
-            for igtv in igtv_data["edges"]:
-                igtv = igtv["node"]
-
-                post_link = f'{self.BASE_URL}tv/{igtv["shortcode"]}'
-                post_info = self.get_single_post(url=post_link)
-
-                igtvs.append(
-                    IGTV(
-                        description=igtv["edge_media_to_caption"]["edges"][0]["node"]["text"],
-                        likes=igtv["edge_liked_by"]["count"],
-                        comments=post_info.comments,
-                        owner_link=post_info.owner_link,
-                        owner_username=post_info.owner_username,
-                        post_content=post_info.post_content,
-                        post_content_len=1,
-                        posted_at=igtv["edge_liked_by"]["count"],
-                        shortcode=igtv["shortcode"],
-                        post_link=post_link,
-                        title=igtv["title"],
-                    ),
-                )
-            if igtv_data["page_info"]["has_next_page"]:
-                after = igtv_data["page_info"]["end_cursor"]
-            else:
-                logging.info(f"IGTVs count: {len(igtvs)}")
-                break
-        return igtvs
+    def iter_feed_pages(self, feed: str, name: Union[int, str]) -> Iterator[Dict]:
+        """
+        Pages through the recent posts of a hashtag or a location.
+        The nodes only carry the owner id, get_single_post gives
+        the full post.
+
+        :param feed: "hashtag" or "location".
+        :param name: tag without "#", or location id.
+
+        :return: pages with "edges" and "page_info".
+        """
+
+        if feed == "hashtag":
+            params = {
+                "query_hash": self.hashtag_query_hash,
+                "tag_name": str(name).lstrip("#").lower(),
+                "first": 50,
+            }
+            edge = "edge_hashtag_to_media"
+        elif feed == "location":
+            params = {
+                "query_hash": self.location_query_hash,
+                "id": str(name),
+                "first": 50,
+            }
+            edge = "edge_location_to_media"
+        else:
+            raise ValueError(f"Unknown feed: {feed}")
+
+        return self._paginate(params=params, edge=edge, pause=True, root=feed)
 
     def get_stories(self, url: str = "", reel_id: str = "") -> List[Storie]:
         """
@@ -357,13 +549,45 @@ class InstaCrawler:
         """
 
         if url:
-            user_data = self.get_user_info(url=url)
+            user_data = self.get_user_info(url=url, fields=["user_id"])
+
+        reel_id = reel_id or str(user_data.user_id)
+        stories = self.get_stories_batch(reel_ids=[reel_id]).get(reel_id, [])
+        logger.info("User %s stories. Count: %s", url, len(stories))
+
+        return stories
+
+    def get_stories_batch(self, reel_ids: Iterable[Union[int, str]]) -> Dict[str, List[Storie]]:
+        """
+        Collects active stories of many users (or highlights),
+        packing up to stories_batch_size reel ids into one request.
 
+        :param reel_ids: user ids or "highlight:<id>" ids.
+
+        :return: stories by reel id. Reels without active
+        stories are missing.
+        """
+
+        reel_ids = [str(reel_id) for reel_id in reel_ids]
         query_url = f"{self.STORIES_URL}{self.STORIES_QUERY}"
-        params = {
-            "reel_ids": reel_id if reel_id else str(user_data.user_id),
-        }
-        headers = {
+        headers = self._stories_headers()
+
+        stories: Dict[str, List[Storie]] = {}
+        for start in range(0, len(reel_ids), self.stories_batch_size):
+            params = {
+                "reel_ids": reel_ids[start:start + self.stories_batch_size],
+            }
+            reels = self._make_request(
+                query_url, params=params, headers=headers)["reels_media"]
+
+            for reel in reels:
+                stories[str(reel["id"])] = self._forming_stories(reel=reel)
+
+        logger.info("Stories of %s reels. Active: %s", len(reel_ids), len(stories))
+        return stories
+
+    def _stories_headers(self) -> Dict[str, Union[str, int]]:
+        return {
             "authority": "i.instagram.com",
             "pragma": "no-cache",
             "cache-control": "no-cache",
@@ -378,123 +602,287 @@ class InstaCrawler:
             "user-agent": UserAgent().chrome,
         }
 
-        stories_data = self._make_request(
-            query_url, params=params, headers=headers)["reels_media"]
-        stories: List = []
-        if stories_data:
-            stories_data = stories_data[0]
-        else:
-            return stories
+    def _forming_stories(self, reel: Dict) -> List[Storie]:
+        username = reel["user"]["username"]
 
-        for storie in stories_data["items"]:
-            if storie["media_type"] == 1:
-                post_content = [storie["image_versions2"]
-                                ["candidates"][0]["url"]]
-            else:
-                post_content = [storie["video_versions"][0]["url"]]
+        stories = []
+        for storie in reel["items"]:
+            link = self.media_policy.pick_storie(storie)
+            if link is None:
+                logger.warning("Storie %s of %s skipped: no media to pick", storie["id"], username)
+                continue
 
-            username = stories_data["user"]["username"]
             stories.append(
                 Storie(
                     owner_link=f"{self.BASE_URL}{username}",
                     owner_username=username,
-                    post_content=post_content,
+                    post_content=[link],
                     post_content_len=1,
                     post_link=f'{self.BASE_URL}stories/{username}/{storie["id"]}',
                     posted_at=storie["taken_at"],
                     shortcode=storie["id"],
                 ),
             )
-        logging.info(msg=f"User {url} stories. Count: {len(stories)}")
 
         return stories
 
-    def get_followers(self, url: str) -> Dict:
+    def get_followers(self, url: str,
+                      fields: Optional[Iterable[str]] = None,
+                      hydrate: bool = True, limit: Optional[int] = None) -> Dict:
         """
         Collects all information about user followers.
 
         :param url: link to a profile
         (https://www.instagram.com/username/).
+        :param fields: User fields to fill in for every follower
+        (see get_user_info). All fields when omitted.
+        :param hydrate: when False only the usernames are collected
+        and "followers" stays empty.
+        :param limit: at most this many followers, in the order
+        Instagram gives them.
         """
 
         user_data = self.get_user_info(url=url, target="followers")
 
-        query_url = f"{self.BASE_URL}{self.GRAPHQL_QUERY}"
-        after = ""
-
-        user_followers = {
+        user_followers: Dict[str, Any] = {
             "count": user_data.followed_by,
             "usernames": list(),
+            "user_ids": list(),
             "followers": list(),
         }
-        while True:
-            params = {
-                "query_hash": self.followers_query_hash,
-                "id": user_data.user_id,
-                "include_reel": False,
-                "fetch_mutual": False,
-                "first": 50,
-                "after": after or "",
-            }
-            data = self._make_request(url=query_url, params=params)["data"]["user"]["edge_followed_by"]
-            self._extract_usernames(users=data["edges"], result=user_followers["usernames"])
-            after = self._has_next_page(data)
-            if after is None:
+        for data in self.iter_follow_pages(user_id=user_data.user_id, relation="followers"):
+            self._extract_usernames(users=data["edges"], result=user_followers["usernames"],
+                                    user_ids=user_followers["user_ids"], limit=limit)
+            if limit is not None and len(user_followers["usernames"]) >= limit:
                 break
 
-        self._extract_users_by_usernames(usernames=user_followers["usernames"], result=user_followers["followers"])
-        logging.info(msg=f'User {url} followers. Count: {len(user_followers["followers"])}')
+        if hydrate:
+            self._extract_users_by_usernames(usernames=user_followers["usernames"],
+                                             result=user_followers["followers"],
+                                             fields=fields)
+        logger.info("User %s followers. Count: %s", url, len(user_followers["followers"]))
 
         return user_followers
 
     # almost 17 minutes for 800 items
-    def get_followed_by_user(self, url: str) -> Dict:
+    def get_followed_by_user(self, url: str,
+                             fields: Optional[Iterable[str]] = None,
+                             hydrate: bool = True, limit: Optional[int] = None) -> Dict:
         """
         Collects all information about users followed
         by requested profile owner.
 
         :param url: link to a profile
         (https://www.instagram.com/username/).
+        :param fields: User fields to fill in for every followed
+        profile (see get_user_info). All fields when omitted.
+        :param hydrate: when False only the usernames are collected
+        and "followed" stays empty.
+        :param limit: at most this many profiles, in the order
+        Instagram gives them.
         """
 
         user_data = self.get_user_info(url=url, target="followed_by_user")
 
-        query_url = f"{self.BASE_URL}{self.GRAPHQL_QUERY}"
-        after = ""
-
-        user_follow = {
+        user_follow: Dict[str, Any] = {
             "count": user_data.follow,
             "usernames": list(),
+            "user_ids": list(),
             "followed": list(),
         }
-        while True:
+        for data in self.iter_follow_pages(user_id=user_data.user_id, relation="followed_by_user"):
+            self._extract_usernames(users=data["edges"], result=user_follow["usernames"],
+                                    user_ids=user_follow["user_ids"], limit=limit)
+            if limit is not None and len(user_follow["usernames"]) >= limit:
+                break
+
+        if hydrate:
+            self._extract_users_by_usernames(usernames=user_follow["usernames"],
+                                             result=user_follow["followed"],
+                                             fields=fields)
+        logger.info("Followed by user %s. Count: %s", url, len(user_follow["followed"]))
+
+        return user_follow
+
+    def iter_follow_pages(self, user_id: Union[int, str], relation: str) -> Iterator[Dict]:
+        """
+        Pages through the followers (or followed profiles) of a user
+        without requesting the profile itself. Every page is one
+        request, the next one is made only when it is asked for.
+
+        :param user_id: id of the profile.
+        :param relation: "followers" or "followed_by_user".
+
+        :return: pages with "edges" and "page_info".
+        """
+
+        if relation == "followers":
+            params = {
+                "query_hash": self.followers_query_hash,
+                "id": user_id,
+                "include_reel": False,
+                "fetch_mutual": False,
+                "first": 50,
+            }
+            edge = "edge_followed_by"
+        elif relation == "followed_by_user":
             params = {
                 "query_hash": self.followed_by_user_query_hash,
-                "id": user_data.user_id,
+                "id": user_id,
                 "first": 50,
-                "after": after if after else "",
             }
+            edge = "edge_follow"
+        else:
+            raise ValueError(f"Unknown relation: {relation}")
+
+        return self._paginate(params=params, edge=edge)
+
+    def _paginate(self, params: Dict[str, Any], edge: str, pause: bool = False,
+                  root: str = "user") -> Iterator[Dict]:
+        """
+        Goes through the pages of a connection (posts, followers,
+        comments, etc.) following the end cursors.
+
+        :param params: query parameters without "after".
+        :param edge: name of the connection in the root object.
+        :param pause: sleep a bit before every page.
+        :param root: object of the answer the connection belongs to,
+        "user", "shortcode_media" or "comment".
+        """
+
+        query_url = f"{self.BASE_URL}{self.GRAPHQL_QUERY}"
+        after: Optional[str] = ""
+        while True:
+            if pause:
+                sleep(randint(0, 2))
 
-            data = self._make_request(url=query_url, params=params)["data"]["user"]["edge_follow"]
-            self._extract_usernames(users=data["edges"], result=user_follow["usernames"])
+            data = self._make_request(
+                url=query_url,
+                params={**params, "after": after},
+            )["data"][root][edge]
+            yield data
 
             after = self._has_next_page(data)
             if after is None:
                 break
 
-        self._extract_users_by_usernames(usernames=user_follow["usernames"], result=user_follow["followed"])
-        logging.info(msg=f'Followed by user {url}. Count: {len(user_follow["followed"])}')
+    def iter_comments(self, shortcode: str, replies: bool = True) -> Iterator[Comment]:
+        """
+        Gives the comments of a post one by one as the pages arrive,
+        every comment followed by its replies.
 
-        return user_follow
+        :param shortcode: shortcode of the post.
+        :param replies: also give the replies to the comments.
+        """
+        params = {
+            "query_hash": self.comments_query_hash,
+            "shortcode": shortcode,
+            "first": 50,
+        }
+        for page in self._paginate(params=params, edge="edge_media_to_parent_comment", root="shortcode_media"):
+            for edge in page["edges"]:
+                comment = self.forming_comment_data(comment_data=edge["node"], shortcode=shortcode)
+                yield comment
+                if replies and comment.replies_count:
+                    yield from self._iter_replies(comment_data=edge["node"], shortcode=shortcode)
+
+    def _iter_replies(self, comment_data: Dict, shortcode: str) -> Iterator[Comment]:
+        # the first replies come with the comment itself
+        threaded = comment_data.get("edge_threaded_comments") or {"edges": [], "page_info": {}}
+        for edge in threaded["edges"]:
+            yield self.forming_comment_data(comment_data=edge["node"], shortcode=shortcode,
+                                            parent_id=int(comment_data["id"]))
+        if not threaded["page_info"].get("has_next_page"):
+            return
+
+        params = {
+            "query_hash": self.comment_replies_query_hash,
+            "comment_id": comment_data["id"],
+            "first": 50,
+        }
+        pages = self._paginate(params=params, edge="edge_threaded_comments", root="comment")
+        # pagination starts over, the replies seen above are skipped
+        seen = {edge["node"]["id"] for edge in threaded["edges"]}
+        for page in pages:
+            for edge in page["edges"]:
+                if edge["node"]["id"] not in seen:
+                    yield self.forming_comment_data(comment_data=edge["node"], shortcode=shortcode,
+                                                    parent_id=int(comment_data["id"]))
+
+    def iter_likers(self, shortcode: str) -> Iterator[Liker]:
+        """
+        Gives the users who liked a post one by one as the pages
+        arrive.
+
+        :param shortcode: shortcode of the post.
+        """
+        params = {
+            "query_hash": self.likers_query_hash,
+            "shortcode": shortcode,
+            "include_reel": False,
+            "first": 50,
+        }
+        for page in self._paginate(params=params, edge="edge_liked_by", root="shortcode_media"):
+            for edge in page["edges"]:
+                node = edge["node"]
+                yield Liker(
+                    shortcode=shortcode,
+                    user_id=node["id"],
+                    username=node["username"],
+                    full_name=node.get("full_name"),
+                    is_private=node.get("is_private", False),
+                    post_link=f"{self.BASE_URL}p/{shortcode}/",
+                )
+
+    def iter_comments_batch(self, shortcodes: Iterable[str], replies: bool = True,
+                            workers: int = 4) -> Iterator[Tuple[str, List[Comment]]]:
+        """
+        Collects the comments of many posts at the same time. All
+        the requests share the rate limiter of the crawler.
+
+        :param shortcodes: shortcodes of the posts.
+        :param workers: posts collected at the same time.
+
+        :return: shortcode and its comments, in the order the posts
+        are done. Posts that fail are logged and skipped.
+        """
+        return self._iter_batch(shortcodes, lambda shortcode: self.iter_comments(shortcode, replies), workers)
 
-    def _extract_usernames(self, users: List, result: List[str]) -> None:
+    def iter_likers_batch(self, shortcodes: Iterable[str],
+                          workers: int = 4) -> Iterator[Tuple[str, List[Liker]]]:
+        """
+        Same as iter_comments_batch, for the likers.
+        """
+        return self._iter_batch(shortcodes, self.iter_likers, workers)
+
+    def _iter_batch(self, shortcodes: Iterable[str], fetch: Callable[[str], Iterator],
+                    workers: int) -> Iterator[Tuple[str, List]]:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="engagement") as executor:
+            futures = {executor.submit(lambda code: list(fetch(code)), shortcode): shortcode
+                       for shortcode in shortcodes}
+            for future in as_completed(futures):
+                shortcode = futures[future]
+                try:
+                    yield shortcode, future.result()
+                except (BlockedByInstagramError, NotFoundError, PrivateProfileError, KeyError, TypeError) as e:
+                    # unavailable posts come back without the media
+                    logger.error("Post %s skipped: %r", shortcode, e)
+
+    def _extract_usernames(self, users: List, result: List[str],
+                           user_ids: Optional[List[int]] = None,
+                           limit: Optional[int] = None) -> None:
+        if limit is not None:
+            users = users[:max(limit - len(result), 0)]
         for user in users:
             result.append(user["node"]["username"])
+            if user_ids is not None:
+                user_ids.append(int(user["node"]["id"]))
 
-    def _extract_users_by_usernames(self, usernames: List[str], result: List[User]) -> None:
+    def _extract_users_by_usernames(self, usernames: List[str], result: List[User],
+                                    fields: Optional[Iterable[str]] = None) -> None:
         for username in usernames:
             user_url = f"{self.BASE_URL}{username}/"
-            user_info = self.get_user_info(url=user_url, target="info_extraction")
+            user_info = self.get_user_info(url=user_url, fields=fields, target="info_extraction")
 
             result.append(user_info)
 
@@ -509,18 +897,13 @@ class InstaCrawler:
     def _collect_post_content(self, post: Dict) -> List:
         if post.get("edge_sidecar_to_children"):
             post_content = [
-                (
-                    elem["node"].get("video_url")
-                    or
-                    elem["node"].get("display_url")
-                )
+                self.media_policy.pick_node(elem["node"])
                 for elem in post["edge_sidecar_to_children"]["edges"]
             ]
-        elif post.get("product_type") == "igtv":
+        elif post.get("product_type") == "igtv" and not self.media_policy.wants_images:
             post_content = [post.get("video_url")]
         else:
-            post_content = [post.get(
-                "video_url") or post.get("display_url")]
+            post_content = [self.media_policy.pick_node(post)]
 
         return post_content
 
@@ -567,3 +950,108 @@ class InstaCrawler:
             post_link=f"{self.BASE_URL}{product_type}{post_data['shortcode']}/",
 
         )
+
+    def forming_timeline_post_data(self, post_data: Dict) -> Post:
+        description = None
+        if post_data["edge_media_to_caption"]["edges"]:
+            description = post_data["edge_media_to_caption"]["edges"][0]["node"]["text"]
+
+        post_content = self._collect_post_content(post=post_data)
+
+        return Post(
+            description=description,
+            likes=post_data["edge_media_preview_like"]["count"],
+            comments=post_data["edge_media_to_comment"]["count"],
+            owner_link=f'{self.BASE_URL}{post_data["owner"]["username"]}',
+            owner_username=post_data["owner"]["username"],
+            post_content=post_content,
+            post_content_len=len(post_content),
+            posted_at=post_data["taken_at_timestamp"],
+            shortcode=post_data["shortcode"],
+            post_link=f'{self.BASE_URL}p/{post_data["shortcode"]}/',
+        )
+
+    def forming_igtv_data(self, igtv_data: Dict) -> IGTV:
+        """
+        Builds an IGTV from the igtv timeline node. Comments
+        and content come from one more request of the igtv page.
+        """
+        post_link = f'{self.BASE_URL}tv/{igtv_data["shortcode"]}'
+        post_info = self.get_single_post(url=post_link)
+
+        return IGTV(
+            description=igtv_data["edge_media_to_caption"]["edges"][0]["node"]["text"],
+            likes=igtv_data["edge_liked_by"]["count"],
+            comments=post_info.comments,
+            owner_link=post_info.owner_link,
+            owner_username=post_info.owner_username,
+            post_content=post_info.post_content,
+            post_content_len=1,
+            posted_at=igtv_data["taken_at_timestamp"],
+            shortcode=igtv_data["shortcode"],
+            post_link=post_link,
+            title=igtv_data["title"],
+        )
+
+    def forming_comment_data(self, comment_data: Dict, shortcode: str,
+                             parent_id: Optional[int] = None) -> Comment:
+        threaded = comment_data.get("edge_threaded_comments") or {}
+        return Comment(
+            comment_id=comment_data["id"],
+            parent_id=parent_id,
+            shortcode=shortcode,
+            owner_id=comment_data["owner"]["id"],
+            owner_username=comment_data["owner"]["username"],
+            text=comment_data["text"],
+            likes=(comment_data.get("edge_liked_by") or {}).get("count", 0),
+            replies_count=threaded.get("count", 0),
+            posted_at=comment_data["created_at"],
+            post_link=f"{self.BASE_URL}p/{shortcode}/",
+        )
+
+    def forming_user_data(self, user_data: Dict, url: str,
+                          fields: Optional[Iterable[str]] = None) -> User:
+        """
+        Builds a User from the profile json.
+
+        :param user_data: "user" object of the profile json.
+        :param url: link to the profile.
+        :param fields: names of the User fields to fill in; only
+        these are parsed and the model is built without validation.
+        All fields are parsed and validated when omitted.
+        """
+        timeline = user_data.get("edge_owner_to_timeline_media") or {}
+        parsers: Dict[str, Callable[[], Any]] = {
+            "bio": lambda: user_data.get("biography"),
+            "external_url": lambda: user_data.get("external_url"),
+            "followed_by": lambda: user_data["edge_followed_by"]["count"],
+            "follow": lambda: user_data["edge_follow"]["count"],
+            "full_name": lambda: user_data.get("full_name"),
+            "highlight_reel_count": lambda: user_data.get("highlight_reel_count"),
+            "user_id": lambda: int(user_data["id"]),
+            "is_busuness_account": lambda: user_data.get("is_business_account"),
+            "business_category_name": lambda: user_data.get("business_category_name"),
+            "category_name": lambda: user_data.get("category_name"),
+            "is_private": lambda: user_data.get("is_private"),
+            "username": lambda: user_data.get("username"),
+            "igtv_count": lambda: user_data["edge_felix_video_timeline"]["count"],
+            "posts_count": lambda: timeline.get("count") or 0,
+            "last_twelve_posts": lambda: [
+                self.forming_post_data(post_data=post["node"])
+                for post in timeline.get("edges", [])
+            ],
+            "profile_pic_hd": lambda: user_data.get("profile_pic_url_hd"),
+            "followed_by_viewer": lambda: user_data.get("followed_by_viewer"),
+            "user_url": lambda: url,
+        }
+
+        if fields is None:
+            return User(**{field: parse() for field, parse in parsers.items()})
+
+        # privacy fields are always needed by _can_parse_profile
+        requested = set(fields) | {"is_private", "followed_by_viewer"}
+        unknown = requested - parsers.keys()
+        if unknown:
+            raise ValueError(f"Unknown User fields: {', '.join(sorted(unknown))}")
+
+        return User.construct(**{field: parsers[field]() for field in requested})
@@ -0,0 +1,108 @@
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import threading
+from typing import Dict, Optional
+
+TEXT_FORMAT = "%(asctime)s: %(name)s: %(levelname)s: %(funcName)s: %(lineno)s: %(message)s"
+
+# attributes every record has, the others come from extra
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per line: time, level, logger, message and the
+    fields given as extra, e.g. endpoint, user, cursor and latency
+    of the requests.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one record in every 1 / rate of a category, so high-volume
+    lines can stay on. The category is given as extra, e.g.
+    extra={"category": "request"}. Warnings and errors always pass.
+
+    :param rates: share of the records kept by category,
+    e.g. {"request": 0.1}. Other categories are all kept.
+    """
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+        self._seen: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(category)
+        if rate is None:
+            return True
+        if rate <= 0:
+            return False
+
+        with self._lock:
+            seen = self._seen.get(category, 0)
+            self._seen[category] = seen + 1
+        # the first record of a category is kept
+        return seen % max(1, round(1 / rate)) == 0
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Puts the records in the queue as they are, so the messages are
+    formatted by the listener thread instead of the crawl threads.
+    The arguments of a message must not change after it is logged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(path: Optional[str] = None, level: int = logging.INFO, json_format: bool = True,
+                  sample: Optional[Dict[str, float]] = None,
+                  logger: Optional[logging.Logger] = None) -> QueueListener:
+    """
+    Sends the records of the logger through a queue to a thread
+    which writes them, so the crawl threads never wait for the
+    disk. The library does not configure logging by itself, this is
+    for the applications.
+
+    :param path: log file, stderr when None.
+    :param json_format: JsonFormatter lines, TEXT_FORMAT otherwise.
+    :param sample: rates of SamplingFilter.
+    :param logger: the root logger when None.
+
+    :return: the started listener, stop it to write the last records.
+    """
+    target = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    if sample:
+        handler.addFilter(SamplingFilter(sample))
+
+    logger = logger or logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(handler)
+
+    listener = QueueListener(records, target)
+    listener.start()
+    return listener
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# url, width, height
+Rendition = Tuple[str, int, int]
+
+
+@dataclass
+class MediaPolicy:
+    """
+    Which rendition of a photo or a video is collected.
+
+    The default policy takes the full size media, as Instagram
+    gives it.
+
+    :param max_dimension: largest allowed width or height. The
+    biggest rendition that fits is taken, or the smallest one if
+    none fits. Videos are only available in one size in the
+    GraphQL data, so this limit can not be applied to them.
+    :param prefer_image: take the cover image instead of a video.
+    :param thumbnails_only: take the smallest image, never a video.
+    """
+    max_dimension: Optional[int] = None
+    prefer_image: bool = False
+    thumbnails_only: bool = False
+
+    @property
+    def is_default(self) -> bool:
+        return self.max_dimension is None and not self.prefer_image and not self.thumbnails_only
+
+    @property
+    def wants_images(self) -> bool:
+        return self.prefer_image or self.thumbnails_only
+
+    def select(self, renditions: List[Rendition]) -> Optional[str]:
+        """
+        Picks one of the renditions of the same media.
+        """
+        if not renditions:
+            return None
+
+        by_size = sorted(renditions, key=lambda rendition: max(rendition[1], rendition[2]))
+        if self.thumbnails_only:
+            return by_size[0][0]
+        if self.max_dimension is not None:
+            fitting = [rendition for rendition in by_size if max(rendition[1], rendition[2]) <= self.max_dimension]
+            return (fitting[-1] if fitting else by_size[0])[0]
+
+        return by_size[-1][0]
+
+    def pick_node(self, node: Dict) -> Optional[str]:
+        """
+        Picks the media url of a GraphQL post node (or an element
+        of a sidecar).
+        """
+        if self.is_default:
+            return node.get("video_url") or node.get("display_url")
+
+        if node.get("video_url") and not self.wants_images:
+            return node["video_url"]
+
+        renditions = [
+            (resource["src"], resource.get("config_width", 0), resource.get("config_height", 0))
+            for resource in node.get("display_resources") or []
+        ]
+        if self.thumbnails_only:
+            renditions += [
+                (resource["src"], resource.get("config_width", 0), resource.get("config_height", 0))
+                for resource in node.get("thumbnail_resources") or []
+            ]
+
+        return self.select(renditions) or node.get("display_url") or node.get("video_url")
+
+    def pick_storie(self, item: Dict) -> Optional[str]:
+        """
+        Picks the media url of a reels_media item (a storie or
+        a highlight item).
+        """
+        images = [
+            (candidate["url"], candidate.get("width", 0), candidate.get("height", 0))
+            for candidate in (item.get("image_versions2") or {}).get("candidates", [])
+        ]
+        if item.get("media_type") == 1 or self.wants_images or not item.get("video_versions"):
+            return images[0][0] if self.is_default and images else self.select(images)
+
+        if self.is_default:
+            return item["video_versions"][0]["url"]
+
+        videos = [
+            (version["url"], version.get("width", 0), version.get("height", 0))
+            for version in item["video_versions"]
+        ]
+        return self.select(videos)
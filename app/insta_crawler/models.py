@@ -40,6 +40,28 @@ class Storie(BaseModel):
     shortcode: int
 
 
+class Comment(BaseModel):
+    comment_id: int
+    parent_id: Optional[int] = None
+    shortcode: str
+    owner_id: int
+    owner_username: str
+    text: str
+    likes: int
+    replies_count: int = 0
+    posted_at: int
+    post_link: str
+
+
+class Liker(BaseModel):
+    shortcode: str
+    user_id: int
+    username: str
+    full_name: Optional[str]
+    is_private: bool
+    post_link: str
+
+
 class User(BaseModel):
     bio: str
     external_url: Optional[str]
@@ -0,0 +1,204 @@
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .exceptions import NotFoundError, PrivateProfileError
+from .models import Post
+from .utils import load_state, save_state
+
+logger = logging.getLogger(__name__)
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# posting times kept per profile to estimate its rate
+HISTORY_SIZE = 30
+# a profile with less than two known posts is assumed to post weekly
+PRIOR_RATE = 1 / (7 * DAY)
+# shortest span the rate is measured over, so a burst of posts does
+# not look like thousands of posts a day
+MIN_SPAN = HOUR
+
+
+class PostsMonitor:
+    """
+    Watches the newest posts of a watchlist. Every poll of a profile
+    is one request for its first timeline page (last_twelve_posts).
+
+    Each profile is polled at its own interval. Its posting rate is
+    estimated from the stored posting times, and the intervals are
+    split so the whole watchlist fits into budget requests per hour:
+    the interval of a profile is proportional to 1 / sqrt(rate),
+    which gives the shortest average delay before a new post is
+    found. Accounts posting hourly are checked often, dormant ones
+    rarely.
+
+    The first poll of a profile only records its posts, they are not
+    reported as new.
+
+    :param insta: InstaCrawler instance.
+    :param usernames: watchlist.
+    :param state_path: json file with posting times and poll times.
+    :param budget: profile requests per hour for the whole watchlist.
+    :param min_interval: shortest interval of a profile, in seconds.
+    :param max_interval: longest interval of a profile, in seconds.
+    """
+
+    def __init__(self, insta: Any, usernames: Iterable[str], state_path: str,
+                 budget: float = 600, min_interval: float = 5 * 60,
+                 max_interval: float = 7 * DAY) -> None:
+        if min_interval > max_interval:
+            raise ValueError("min_interval is longer than max_interval")
+
+        self.insta = insta
+        self.usernames = list(dict.fromkeys(usernames))
+        self.state_path = state_path
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.posted_at: Dict[str, List[int]] = {}
+        self.next_poll: Dict[str, float] = {}
+        self._load_state()
+
+    def posting_rate(self, username: str, now: Optional[float] = None) -> float:
+        """
+        Posts per second, measured from the oldest stored post until
+        now. The time since the last post counts too, so the rate of
+        an account that stopped posting decays.
+        """
+        now = time.time() if now is None else now
+        history = self.posted_at.get(username, [])
+        if len(history) < 2:
+            return PRIOR_RATE
+
+        span = max(now - min(history), MIN_SPAN)
+        return (len(history) - 1) / span
+
+    def intervals(self, now: Optional[float] = None) -> Dict[str, float]:
+        """
+        Poll interval of every profile, in seconds.
+        """
+        if not self.usernames:
+            return {}
+
+        roots = {username: math.sqrt(self.posting_rate(username, now)) for username in self.usernames}
+        scale = self._fit_budget(list(roots.values()))
+        return {username: self._clamp(scale / root) for username, root in roots.items()}
+
+    def poll_due(self, now: Optional[float] = None) -> List[Post]:
+        """
+        Polls the profiles whose poll time has come.
+
+        :return: posts that were not seen before.
+        """
+        now = time.time() if now is None else now
+        due = [username for username in self.usernames if self.next_poll.get(username, 0) <= now]
+
+        new_posts: List[Post] = []
+        for username in due:
+            new_posts += self._poll(username)
+
+        # new posts change the rates, so the intervals are computed
+        # after the polls
+        intervals = self.intervals(now)
+        for username in due:
+            self.next_poll[username] = now + intervals[username]
+        self._save_state()
+
+        logger.info("Posts poll: %s of %s users, %s new posts", len(due), len(self.usernames), len(new_posts))
+        return new_posts
+
+    def watch(self, on_new: Callable[[List[Post]], None], cycles: Optional[int] = None) -> None:
+        """
+        Polls the due profiles and sleeps until the next poll time,
+        new posts are passed to on_new. A failed poll is logged and
+        followed by a sleep of min_interval, doubled with every
+        failure in a row up to max_interval.
+
+        :param cycles: number of polls, endless when omitted.
+        """
+        cycle = 0
+        failures = 0
+        while cycles is None or cycle < cycles:
+            try:
+                new_posts = self.poll_due()
+                if new_posts:
+                    on_new(new_posts)
+            except Exception as e:
+                failures += 1
+                logger.error("Posts poll failed, %s in a row: %r", failures, e)
+            else:
+                failures = 0
+
+            cycle += 1
+            if cycles is None or cycle < cycles:
+                time.sleep(self._sleep_time(failures))
+
+    def _sleep_time(self, failures: int) -> float:
+        if failures:
+            return min(self.min_interval * 2 ** (failures - 1), self.max_interval)
+        if not self.usernames:
+            return self.max_interval
+        # users of an older watchlist are not polled any more
+        next_poll = min(self.next_poll.get(username, 0) for username in self.usernames)
+        return max(0.0, next_poll - time.time())
+
+    def _poll(self, username: str) -> List[Post]:
+        # a cached profile would hide the new posts
+        self.insta.user_cache.invalidate(username)
+        try:
+            user = self.insta.get_user_info(url=f"{self.insta.BASE_URL}{username}/",
+                                            fields=["last_twelve_posts"])
+        except (PrivateProfileError, NotFoundError) as e:
+            logger.warning("Posts of %s can not be watched: %r", username, e)
+            return []
+
+        posts = user.last_twelve_posts or []
+        history = self.posted_at.get(username)
+        self.posted_at[username] = sorted({post.posted_at for post in posts} | set(history or []))[-HISTORY_SIZE:]
+        if history is None:
+            return []
+
+        # pinned posts are old, they are not taken for new ones
+        newest = max(history, default=0)
+        return [post for post in posts if post.posted_at > newest]
+
+    def _fit_budget(self, roots: List[float]) -> float:
+        """
+        Finds the scale of the intervals (interval = scale / root)
+        whose clamped intervals spend the budget.
+        """
+        budget = self.budget / HOUR
+
+        def spent(scale: float) -> float:
+            return sum(1 / self._clamp(scale / root) for root in roots)
+
+        low = self.min_interval * min(roots)
+        high = self.max_interval * max(roots)
+        if spent(high) > budget:
+            logger.warning("The watchlist needs %.0f requests per hour at the longest interval, more than the budget",
+                           spent(high) * HOUR)
+            return high
+
+        # spent() falls as the scale grows
+        for _ in range(60):
+            middle = math.sqrt(low * high)
+            if spent(middle) > budget:
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def _clamp(self, interval: float) -> float:
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _load_state(self) -> None:
+        state = load_state(self.state_path)
+        self.posted_at = state.get("posted_at", {})
+        next_poll = state.get("next_poll", {})
+        self.next_poll = {username: next_poll[username] for username in self.usernames if username in next_poll}
+
+    def _save_state(self) -> None:
+        save_state(self.state_path, {"posted_at": self.posted_at, "next_poll": self.next_poll})
@@ -0,0 +1,365 @@
+from abc import ABC, abstractmethod
+import csv
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .search import SearchIndex
+from .utils import download_all, media_key
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = ("posts", "stories", "highlights", "igtv")
+
+_DONE = object()
+
+
+class Sink(ABC):
+    """
+    Stores the collected items one by one, as they are built.
+    """
+
+    @abstractmethod
+    def write(self, content_type: str, item: BaseModel) -> None:
+        pass
+
+    def write_user(self, user: BaseModel) -> None:
+        """
+        Gets the User of the profile once, before its items.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class JSONLinesSink(Sink):
+    """
+    Appends every item as a json line to one file.
+    """
+
+    def __init__(self, path: str) -> None:
+        _make_dirs(path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, content_type: str, item: BaseModel) -> None:
+        record = {"content_type": content_type, **dict(item)}
+        self._file.write(json.dumps(record, ensure_ascii=False, default=dict) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CSVSink(Sink):
+    """
+    Writes every content type to its own csv file,
+    <directory>/<username>_<content_type>.csv, the same as
+    export_as_csv does.
+    """
+
+    def __init__(self, directory: str, username: str) -> None:
+        self.directory = directory
+        self.username = username
+        self._files: Dict[str, Tuple[Any, Any, List[str]]] = {}
+
+    def write(self, content_type: str, item: BaseModel) -> None:
+        row = dict(item)
+        if content_type not in self._files:
+            path = os.path.join(self.directory, f"{self.username}_{content_type}.csv")
+            _make_dirs(path)
+            file = open(path, "w", encoding="utf-8", newline="")
+            writer = csv.writer(file, delimiter=";")
+            headers_row = list(row.keys())
+            writer.writerow(headers_row)
+            self._files[content_type] = (file, writer, headers_row)
+
+        _, writer, headers_row = self._files[content_type]
+        writer.writerow([row[header] for header in headers_row])
+
+    def close(self) -> None:
+        for file, _, _ in self._files.values():
+            file.close()
+
+
+class SQLiteSink(Sink):
+    """
+    Stores items as json in an "items" table, one row per
+    content type and shortcode, committed every batch_size items.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100) -> None:
+        self.batch_size = batch_size
+        self._pending = 0
+        _make_dirs(path)
+        # the sink stage is one thread, but not the one that opens it
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                content_type TEXT NOT NULL,
+                shortcode TEXT NOT NULL,
+                owner_username TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (content_type, shortcode)
+            )
+            """,
+        )
+
+    def write(self, content_type: str, item: BaseModel) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+            (content_type, media_key(item, content_type), getattr(item, "owner_username", None),
+             json.dumps(dict(item), ensure_ascii=False, default=dict)),
+        )
+        self._pending += 1
+        # a crash loses at most one batch
+        if self._pending >= self.batch_size:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.close()
+
+
+class SearchSink(Sink):
+    """
+    Adds the profile user, posts and igtvs to a full-text search
+    index, batch_size items per transaction.
+    """
+
+    def __init__(self, index: SearchIndex, batch_size: int = 100) -> None:
+        self.index = index
+        self.batch_size = batch_size
+        self._batches: Dict[str, List[BaseModel]] = {}
+
+    def write(self, content_type: str, item: BaseModel) -> None:
+        batch = self._batches.setdefault(content_type, [])
+        batch.append(item)
+        if len(batch) >= self.batch_size:
+            self.index.add(content_type, batch)
+            batch.clear()
+
+    def write_user(self, user: BaseModel) -> None:
+        self.write("users", user)
+
+    def close(self) -> None:
+        for content_type, batch in self._batches.items():
+            if batch:
+                self.index.add(content_type, batch)
+        self._batches.clear()
+
+
+class Pipeline:
+    """
+    Collects the content of a profile with the stages running at
+    the same time and linked by bounded queues:
+
+    fetch (pagination) -> parse (models) -> sinks
+                                        -> downloads (N threads)
+
+    When a later stage falls behind, the queue before it fills up
+    and the earlier stage waits, so memory stays bounded.
+
+    :param insta: InstaCrawler instance.
+    :param username: profile username.
+    :param content_types: what to collect, see CONTENT_TYPES.
+    :param sinks: where the items are stored.
+    :param download: download the media.
+    :param queue_size: capacity of every queue.
+    :param download_workers: number of download threads.
+    """
+
+    def __init__(self, insta: Any, username: str,
+                 content_types: Iterable[str] = CONTENT_TYPES,
+                 sinks: Iterable[Sink] = (), download: bool = True,
+                 queue_size: int = 100, download_workers: int = 4) -> None:
+        self.insta = insta
+        self.username = username
+        self.content_types = list(content_types)
+        self.sinks = list(sinks)
+        self.download = download
+        self.download_workers = download_workers
+
+        self.stats = {"fetched": 0, "parsed": 0, "stored": 0, "downloaded": 0, "download_errors": 0}
+        self.errors: List[BaseException] = []
+
+        self._parse_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._sink_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._download_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self) -> Dict[str, int]:
+        """
+        Runs all the stages and waits for them.
+
+        :return: counters of every stage.
+        """
+        unknown = set(self.content_types) - set(CONTENT_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown content types: {', '.join(sorted(unknown))}")
+
+        threads = [
+            self._thread(self._fetch, "fetch"),
+            self._thread(self._parse, "parse"),
+            self._thread(self._store, "sink"),
+        ]
+        workers = self.download_workers if self.download else 0
+        threads += [self._thread(self._download, f"download-{number}") for number in range(workers)]
+
+        for thread in threads:
+            thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+        logger.info("Pipeline %s: %s", self.username, self.stats)
+        if self.errors:
+            raise self.errors[0]
+
+        return self.stats
+
+    def _thread(self, target: Callable[[], None], name: str) -> threading.Thread:
+        def run() -> None:
+            try:
+                target()
+            except BaseException as e:
+                logger.error("Pipeline stage %s failed: %r", name, e)
+                self.errors.append(e)
+                self._stop.set()
+
+        thread = threading.Thread(target=run, name=f"pipeline-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _put(self, target: queue.Queue, item: Any) -> None:
+        # a full queue is the backpressure, but never hang after errors
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+        return _DONE
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[counter] += amount
+
+    def _fetch(self) -> None:
+        url = f"{self.insta.BASE_URL}{self.username}/"
+        try:
+            user = self.insta.get_user_info(url=url)
+            self._put(self._parse_q, ("users", user))
+            for content_type in self.content_types:
+                if content_type in ("posts", "igtv"):
+                    self._fetch_timeline(user_id=user.user_id, content_type=content_type)
+                else:
+                    fetch = self.insta.get_stories if content_type == "stories" else self.insta.get_highlights
+                    for item in fetch(url=url):
+                        self._put(self._parse_q, (content_type, item))
+                        self._count("fetched")
+        finally:
+            self._put(self._parse_q, _DONE)
+
+    def _fetch_timeline(self, user_id: int, content_type: str) -> None:
+        for page in self.insta.iter_timeline_pages(user_id=user_id, timeline=content_type):
+            for edge in page["edges"]:
+                self._put(self._parse_q, (content_type, edge["node"]))
+                self._count("fetched")
+            if self._stop.is_set():
+                return
+
+    def _parse(self) -> None:
+        try:
+            while True:
+                message = self._get(self._parse_q)
+                if message is _DONE:
+                    return
+
+                content_type, data = message
+                if content_type == "users":
+                    # the profile goes to the sinks only, it is no item
+                    self._put(self._sink_q, message)
+                    continue
+                if content_type == "posts":
+                    item = self.insta.forming_timeline_post_data(post_data=data)
+                elif content_type == "igtv":
+                    item = self.insta.forming_igtv_data(igtv_data=data)
+                else:
+                    item = data
+                self._count("parsed")
+
+                self._put(self._sink_q, (content_type, item))
+                if self.download:
+                    self._put(self._download_q, (content_type, item))
+        finally:
+            self._put(self._sink_q, _DONE)
+            for _ in range(self.download_workers if self.download else 0):
+                self._put(self._download_q, _DONE)
+
+    def _store(self) -> None:
+        while True:
+            message = self._get(self._sink_q)
+            if message is _DONE:
+                return
+
+            content_type, item = message
+            if content_type == "users":
+                for sink in self.sinks:
+                    sink.write_user(item)
+                continue
+
+            for sink in self.sinks:
+                sink.write(content_type, item)
+            self._count("stored")
+
+    def _download(self) -> None:
+        while True:
+            message = self._get(self._download_q)
+            if message is _DONE:
+                return
+
+            content_type, item = message
+            failed = download_all(posts=[item], content_type=content_type, username=self.username,
+                                  refresh=self.insta.refresh_media_links, progress=False)
+            self._count("downloaded", len(item.post_content) - len(failed))
+            self._count("download_errors", len(failed))
+
+
+def _make_dirs(path: str) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+
+def default_sinks(username: str, json_lines: bool = False, csv_files: bool = False,
+                  sqlite_path: Optional[str] = None, search_path: Optional[str] = None) -> List[Sink]:
+    """
+    Sinks placed next to the other exports, in downloads/<username>/.
+    """
+    directory = os.path.join(os.getcwd(), "downloads", username)
+    sinks: List[Sink] = []
+    if json_lines:
+        sinks.append(JSONLinesSink(path=os.path.join(directory, f"{username}_data.jsonl")))
+    if csv_files:
+        sinks.append(CSVSink(directory=directory, username=username))
+    if sqlite_path:
+        sinks.append(SQLiteSink(path=sqlite_path))
+    if search_path:
+        sinks.append(SearchSink(index=SearchIndex(path=search_path)))
+
+    return sinks
@@ -0,0 +1,189 @@
+from dataclasses import dataclass, field
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .exceptions import NotFoundError
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 50
+CONTENT_TYPES = ("posts", "igtv", "highlights", "stories", "followers", "followed")
+
+# rough average sizes of the downloaded media, in bytes
+IMAGE_BYTES = 300 * 1024
+VIDEO_BYTES = 8 * 1024 * 1024
+IGTV_BYTES = 80 * 1024 * 1024
+# highlights are only counted on the profile, not their items
+ITEMS_PER_HIGHLIGHT = 10
+# _paginate sleeps randint(0, 2) seconds before every posts page
+POSTS_PAGE_PAUSE = 1.0
+
+PROFILE_FIELDS = ["posts_count", "igtv_count", "highlight_reel_count", "followed_by", "follow",
+                  "last_twelve_posts"]
+
+
+@dataclass
+class CrawlCost:
+    """
+    Estimated cost of a crawl.
+
+    :param profiles: profile requests, one per planned user.
+    :param pages: GraphQL pages (and other listing requests).
+    :param hydrations: requests made per item, e.g. a profile per
+    follower or a post per igtv.
+    :param pauses: seconds the crawl sleeps between requests.
+    :param seconds: wall time of the requests and the pauses.
+    """
+    username: str
+    private: bool = False
+    profiles: int = 1
+    pages: int = 0
+    hydrations: int = 0
+    media_files: int = 0
+    media_bytes: int = 0
+    pauses: float = 0.0
+    seconds: float = 0.0
+    by_content: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def requests(self) -> int:
+        return self.profiles + self.pages + self.hydrations
+
+
+class CrawlPlanner:
+    """
+    Estimates requests, media and wall time of a crawl before it is
+    started, from one profile request per target.
+
+    Without a rate the wall time is bound by the latency: workers
+    requests of latency seconds each at a time.
+
+    :param insta: InstaCrawler instance, its rate limiter is used
+    when rate is omitted.
+    :param rate: requests per second.
+    :param workers: requests sent at the same time.
+    :param latency: seconds one request takes.
+    :param hydrate: followers and followed profiles are requested
+    one by one, as get_followers does by default.
+    """
+
+    def __init__(self, insta: Any, rate: Optional[float] = None, workers: int = 1,
+                 latency: float = 1.0, hydrate: bool = True) -> None:
+        limiter = getattr(insta, "rate_limiter", None)
+        self.insta = insta
+        self.rate = rate if rate is not None else getattr(limiter, "rate", None)
+        self.workers = max(workers, 1)
+        self.latency = latency
+        self.hydrate = hydrate
+
+    def plan(self, usernames: Iterable[str], content_types: Iterable[str]) -> List[CrawlCost]:
+        """
+        :return: cost of every profile, missing profiles are skipped.
+        """
+        content_types = list(content_types)
+        costs = []
+        for username in dict.fromkeys(usernames):
+            try:
+                costs.append(self.plan_profile(username=username, content_types=content_types))
+            except NotFoundError as e:
+                logger.warning("Profile %s can not be planned: %r", username, e)
+        return costs
+
+    def plan_profile(self, username: str, content_types: Iterable[str]) -> CrawlCost:
+        user = self.insta.get_user_info(url=f"{self.insta.BASE_URL}{username}/",
+                                        fields=PROFILE_FIELDS, target="plan")
+        cost = CrawlCost(username=username)
+        if user.is_private and not user.followed_by_viewer:
+            # only the profile request goes through
+            cost.private = True
+            cost.seconds = self.wall_time(requests=cost.requests, pauses=0)
+            return cost
+
+        for content_type in content_types:
+            requests_before = cost.pages + cost.hydrations
+            self._add(cost, content_type, user)
+            cost.by_content[content_type] = cost.pages + cost.hydrations - requests_before
+
+        cost.seconds = self.wall_time(requests=cost.requests, pauses=cost.pauses)
+        return cost
+
+    def total(self, costs: List[CrawlCost]) -> CrawlCost:
+        """
+        Cost of all the profiles crawled one after another.
+        """
+        total = CrawlCost(username="total", profiles=0)
+        for cost in costs:
+            total.profiles += cost.profiles
+            total.pages += cost.pages
+            total.hydrations += cost.hydrations
+            total.media_files += cost.media_files
+            total.media_bytes += cost.media_bytes
+            total.pauses += cost.pauses
+            for content_type, requests in cost.by_content.items():
+                total.by_content[content_type] = total.by_content.get(content_type, 0) + requests
+
+        total.seconds = self.wall_time(requests=total.requests, pauses=total.pauses)
+        return total
+
+    def wall_time(self, requests: int, pauses: float) -> float:
+        throughput = self.workers / self.latency if self.latency > 0 else math.inf
+        if self.rate:
+            throughput = min(throughput, self.rate)
+        return requests / throughput + pauses / self.workers
+
+    def _add(self, cost: CrawlCost, content_type: str, user: Any) -> None:
+        if content_type == "posts":
+            pages = _pages(user.posts_count)
+            files, videos = _media_per_post(user.last_twelve_posts or [])
+            cost.pages += pages
+            cost.pauses += pages * POSTS_PAGE_PAUSE
+            cost.media_files += round(user.posts_count * files)
+            cost.media_bytes += round(user.posts_count * files * (videos * VIDEO_BYTES + (1 - videos) * IMAGE_BYTES))
+        elif content_type == "igtv":
+            # forming_igtv_data requests every igtv
+            cost.pages += _pages(user.igtv_count)
+            cost.hydrations += user.igtv_count
+            cost.media_files += user.igtv_count
+            cost.media_bytes += user.igtv_count * IGTV_BYTES
+        elif content_type == "highlights":
+            # the highlights list, then their items in batches
+            cost.pages += 1 + math.ceil(user.highlight_reel_count / self.insta.stories_batch_size)
+            cost.media_files += user.highlight_reel_count * ITEMS_PER_HIGHLIGHT
+            cost.media_bytes += user.highlight_reel_count * ITEMS_PER_HIGHLIGHT * IMAGE_BYTES
+        elif content_type == "stories":
+            cost.pages += 1
+        elif content_type in ("followers", "followed"):
+            count = user.followed_by if content_type == "followers" else user.follow
+            cost.pages += _pages(count)
+            if self.hydrate:
+                cost.hydrations += count
+                cost.pauses += _hydration_pauses(count)
+        else:
+            raise ValueError(f"Unknown content type: {content_type}")
+
+
+def _pages(count: int) -> int:
+    return math.ceil(count / PAGE_SIZE)
+
+
+def _media_per_post(posts: List[Any]) -> Tuple[float, float]:
+    """
+    Files per post and share of videos, from the latest posts.
+    """
+    links = [link for post in posts for link in post.post_content]
+    if not links:
+        return 1.0, 0.0
+    videos = sum(".mp4" in link for link in links)
+    return len(links) / len(posts), videos / len(links)
+
+
+def _hydration_pauses(count: int) -> float:
+    """
+    Seconds utils.how_sleep sleeps while count profiles are
+    requested one by one.
+    """
+    thousands = count // 1000
+    hundreds = count // 100 - thousands
+    quarters = count // 25 - count // 100
+    return thousands * 11 + hundreds * 9 + quarters * 7
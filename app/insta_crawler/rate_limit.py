@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+import heapq
+import itertools
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all the threads that use one crawler.
+
+    When several requests are waiting for a token, the one with
+    the highest priority gets it first, so urgent work is not
+    starved by bulk crawls running at the same time.
+
+    :param rate: requests per second.
+    :param burst: how many requests can be made at once after
+    the limiter has been idle.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = rate
+        self.burst = max(burst, 1)
+
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+    @contextmanager
+    def priority(self, value: int) -> Iterator[None]:
+        """
+        Sets the priority of the requests made by the current
+        thread inside the block.
+        """
+        previous = getattr(self._local, "priority", 0)
+        self._local.priority = value
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def acquire(self) -> float:
+        """
+        Blocks until a request can be made.
+
+        :return: seconds spent waiting.
+        """
+        started_at = time.monotonic()
+        ticket = (-getattr(self._local, "priority", 0), next(self._counter))
+
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == ticket:
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            heapq.heappop(self._waiters)
+                            self._cond.notify_all()
+                            break
+                        self._cond.wait((1 - self._tokens) / self.rate)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+        return time.monotonic() - started_at
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
@@ -0,0 +1,269 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import threading
+import time
+from time import sleep
+from typing import Any, Callable, Dict, FrozenSet, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from .proxies import lease, ProxyPool
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How failed requests are repeated.
+
+    :param attempts: requests sent at most, the first one included.
+    :param backoff: base of the exponential delay, in seconds.
+    :param max_backoff: longest delay between two attempts.
+    :param connect_timeout: seconds to wait for the connection.
+    :param read_timeout: seconds to wait for the server answer.
+    """
+    attempts: int = 4
+    backoff: float = 1.0
+    max_backoff: float = 60.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 30.0
+    retry_statuses: FrozenSet[int] = RETRY_STATUSES
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return self.connect_timeout, self.read_timeout
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Exponential backoff with full jitter. A Retry-After header
+        of the server is never undercut.
+
+        :param attempt: number of the failed attempt, from 0.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return max(delay, _parse_retry_after(retry_after))
+
+
+class CircuitBreaker:
+    """
+    Pauses the requests to an endpoint after repeated failures in
+    a row, so a struggling endpoint is not hammered by retries.
+
+    :param threshold: failures in a row that open the circuit.
+    :param cooldown: seconds the endpoint is paused for.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60.0) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self._failures: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, endpoint: str) -> float:
+        """
+        Sleeps while the circuit of the endpoint is open.
+
+        :return: seconds slept.
+        """
+        with self._lock:
+            remaining = self._open_until.get(endpoint, 0) - time.monotonic()
+        if remaining <= 0:
+            return 0
+        logger.warning("Circuit of %s is open, pausing for %.1fs", endpoint, remaining)
+        sleep(remaining)
+        return remaining
+
+    def record(self, endpoint: str, success: bool) -> None:
+        with self._lock:
+            if success:
+                self._failures.pop(endpoint, None)
+                self._open_until.pop(endpoint, None)
+                return
+
+            failures = self._failures.get(endpoint, 0) + 1
+            self._failures[endpoint] = failures
+            # after the pause one more failure opens the circuit again
+            if failures >= self.threshold:
+                self._open_until[endpoint] = time.monotonic() + self.cooldown
+
+    def is_open(self, endpoint: str) -> bool:
+        with self._lock:
+            return self._open_until.get(endpoint, 0) > time.monotonic()
+
+
+class ResilientClient:
+    """
+    Sends GET requests with timeouts, retries of transient failures
+    (connection errors, timeouts, 429 and 5xx answers) and
+    a circuit breaker per endpoint.
+
+    Hedged requests send a duplicate when the first answer is late
+    and take whichever comes first. They are only meant for
+    idempotent lookups.
+
+    :param policy: timeouts and retries.
+    :param breaker: circuit breaker shared by the endpoints.
+    :param hedge_after: seconds before the duplicate of a hedged
+    request is sent, None turns hedging off.
+    :param proxy_pool: proxies the requests are spread over.
+    :param proxy_session: keep one proxy for all the requests (and
+    the login) while it is healthy, instead of one per request.
+    """
+
+    def __init__(self, policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 hedge_after: Optional[float] = None,
+                 proxy_pool: Optional[ProxyPool] = None,
+                 proxy_session: Optional[str] = None) -> None:
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_after = hedge_after
+        self.proxy_pool = proxy_pool
+        self.proxy_session = proxy_session
+        self.hedges = 0
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+            before_send: Optional[Callable[[], None]] = None,
+            hedge: bool = False, **kwargs: Any) -> requests.Response:
+        """
+        :param before_send: called before every attempt, e.g. to take
+        a rate limiter token.
+        :param hedge: the request is idempotent and may be sent twice.
+        :param kwargs: passed to requests.get.
+
+        :return: the answer of the last attempt, which can still be
+        an error status when all the attempts failed.
+        """
+        endpoint = endpoint_key(url, params)
+        attempt = 0
+        while True:
+            self.breaker.wait(endpoint)
+            try:
+                response = self._send(url, params, before_send, hedge and self.hedge_after is not None, kwargs)
+            except RETRY_ERRORS as e:
+                self.breaker.record(endpoint, success=False)
+                if attempt + 1 >= self.policy.attempts:
+                    raise
+                delay = self.policy.delay(attempt)
+                logger.warning("Request to %s failed: %r, retry in %.1fs", endpoint, e, delay)
+            else:
+                if response.status_code not in self.policy.retry_statuses:
+                    self.breaker.record(endpoint, success=True)
+                    return response
+                self.breaker.record(endpoint, success=False)
+                if attempt + 1 >= self.policy.attempts:
+                    return response
+                delay = self.policy.delay(attempt, response.headers.get("Retry-After"))
+                logger.warning("Request to %s answered %s, retry in %.1fs", endpoint, response.status_code, delay)
+
+            sleep(delay)
+            attempt += 1
+
+    def _send(self, url: str, params: Optional[Dict[str, Any]],
+              before_send: Optional[Callable[[], None]], hedge: bool,
+              kwargs: Dict[str, Any]) -> requests.Response:
+        # before_send runs on the calling thread, the rate limiter
+        # keeps the priority of the request per thread
+        def send() -> requests.Response:
+            with lease(self.proxy_pool, session=self.proxy_session) as proxy_lease:
+                response = requests.get(url, params=params, timeout=self.policy.timeout,
+                                        proxies=proxy_lease.proxies, **kwargs)
+                proxy_lease.done(response.status_code)
+                return response
+
+        if before_send is not None:
+            before_send()
+        if not hedge:
+            return send()
+
+        executor = self._hedge_executor()
+        first = executor.submit(send)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        if before_send is not None:
+            before_send()
+        self.hedges += 1
+        second = executor.submit(send)
+        return _first_answer([first, second])
+
+    def session_proxy(self) -> Optional[str]:
+        """
+        Proxy of the session, None without a sticky proxy session.
+        """
+        if self.proxy_pool is None or self.proxy_session is None:
+            return None
+        return self.proxy_pool.session_proxy(self.proxy_session)
+
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+            return self._executor
+
+
+def endpoint_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    GraphQL queries share one path, so the query hash tells them
+    apart. Profile and post urls are grouped by their first path
+    segment.
+    """
+    parts = urlsplit(url)
+    path = parts.path.strip("/")
+    query_hash = (params or {}).get("query_hash")
+    if query_hash:
+        return f"{parts.netloc}/{path}/{query_hash}"
+    if path.startswith(("api/", "graphql/")):
+        return f"{parts.netloc}/{path}"
+    if "/" in path:
+        return f"{parts.netloc}/{path.split('/')[0]}"
+    return f"{parts.netloc}/profile"
+
+
+def _first_answer(futures: list) -> requests.Response:
+    """
+    Gives the first successful answer, or raises the last error
+    when every request failed.
+    """
+    pending = set(futures)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                for late in pending:
+                    late.add_done_callback(_close_response)
+                return future.result()
+
+    raise error  # type: ignore
+
+
+def _close_response(future: Future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def _parse_retry_after(value: Optional[str]) -> float:
+    if not value:
+        return 0
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
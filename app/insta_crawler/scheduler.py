@@ -0,0 +1,298 @@
+from dataclasses import dataclass, field
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .utils import download_all
+
+logger = logging.getLogger(__name__)
+
+# the larger the number, the sooner the job runs
+CONTENT_PRIORITIES: Dict[str, int] = {
+    "stories": 100,
+    "new_posts": 80,
+    "user_info": 60,
+    "highlights": 40,
+    "igtv": 30,
+    "posts": 20,
+    "followers": 10,
+    "followed_by_user": 10,
+}
+
+URGENT_PRIORITY = CONTENT_PRIORITIES["new_posts"]
+
+
+def _get_new_posts(insta: Any, url: str, **kwargs: Any) -> List:
+    # a cached profile would hide the new posts
+    insta.user_cache.invalidate(urlsplit(url).path.strip("/"))
+    return insta.get_user_info(url=url).last_twelve_posts
+
+
+CONTENT_RUNNERS: Dict[str, Callable[..., Any]] = {
+    "stories": lambda insta, url, **kwargs: insta.get_stories(url=url, **kwargs),
+    "new_posts": _get_new_posts,
+    "user_info": lambda insta, url, **kwargs: insta.get_user_info(url=url, **kwargs),
+    "highlights": lambda insta, url, **kwargs: insta.get_highlights(url=url, **kwargs),
+    "igtv": lambda insta, url, **kwargs: insta.get_all_igtv(url=url, **kwargs),
+    "posts": lambda insta, url, **kwargs: insta.get_posts(url=url, **kwargs),
+    "followers": lambda insta, url, **kwargs: insta.get_followers(url=url, **kwargs),
+    "followed_by_user": lambda insta, url, **kwargs: insta.get_followed_by_user(url=url, **kwargs),
+}
+
+# runners giving the items one by one, for jobs that stream them
+STREAMING_RUNNERS: Dict[str, Callable[..., Any]] = {
+    "igtv": lambda insta, url, **kwargs: insta.iter_igtv(url=url, **kwargs),
+    "posts": lambda insta, url, **kwargs: insta.iter_posts(url=url, **kwargs),
+}
+
+# content types with media, and the folder the media goes to
+DOWNLOADS: Dict[str, str] = {
+    "stories": "stories",
+    "new_posts": "posts",
+    "highlights": "highlights",
+    "igtv": "igtv",
+    "posts": "posts",
+}
+
+
+@dataclass
+class Job:
+    job_id: int
+    content_type: str
+    url: str
+    priority: int
+    deadline: Optional[float] = None
+    kwargs: Dict = field(default_factory=dict)
+    stream: bool = False
+    download: bool = False
+    status: str = "pending"
+    result: Any = None
+    items: List = field(default_factory=list, repr=False)
+    failed_downloads: List[Dict] = field(default_factory=list, repr=False)
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+    _changed: threading.Condition = field(default_factory=threading.Condition, repr=False)
+
+    @property
+    def urgent(self) -> bool:
+        return self.priority >= URGENT_PRIORITY
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def add_item(self, item: Any) -> None:
+        with self._changed:
+            self.items.append(item)
+            self._changed.notify_all()
+
+    def finish(self, status: str) -> None:
+        with self._changed:
+            self.status = status
+            self.finished_at = time.time()
+            self.done.set()
+            self._changed.notify_all()
+
+    def iter_items(self) -> Iterator[Any]:
+        """
+        Gives the items as the job finds them, until it is finished.
+        Lists, e.g. of stories, come at once at the end.
+        """
+        position = 0
+        while True:
+            with self._changed:
+                while position == len(self.items) and not self.done.is_set():
+                    self._changed.wait()
+                items = self.items[position:]
+                finished = self.done.is_set()
+            yield from items
+            position += len(items)
+            if finished and position == len(self.items):
+                return
+
+
+class JobScheduler:
+    """
+    Runs crawler jobs by priority and deadline.
+
+    Jobs with a higher priority run first, jobs with the same
+    priority run by earliest deadline. Jobs whose deadline has
+    passed are not run. While jobs are running, their requests
+    take tokens of the crawler rate limiter by the job priority,
+    so a stories job is not slowed down by a followers crawl.
+    Some of the workers only take urgent jobs, so a long bulk job
+    can never keep an urgent one from starting.
+
+    :param insta: InstaCrawler instance.
+    :param workers: number of worker threads.
+    :param urgent_workers: how many of them are kept for jobs with
+    priority URGENT_PRIORITY or higher.
+    """
+
+    def __init__(self, insta: Any, workers: int = 2, urgent_workers: int = 1) -> None:
+        if urgent_workers >= workers:
+            raise ValueError("At least one worker must take non-urgent jobs")
+
+        self.insta = insta
+        self.workers = workers
+        self.urgent_workers = urgent_workers
+
+        self.jobs: Dict[int, Job] = {}
+        self._queue: List[Tuple[int, float, int]] = []
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+        self._stopping = False
+
+    def submit(self, content_type: str, url: str, priority: Optional[int] = None,
+               deadline: Optional[float] = None, stream: bool = False,
+               download: bool = False, **kwargs: Any) -> Job:
+        """
+        Adds a job.
+
+        :param content_type: one of CONTENT_RUNNERS.
+        :param url: link to a profile
+        (https://www.instagram.com/username/).
+        :param priority: defaults to CONTENT_PRIORITIES of the
+        content type.
+        :param deadline: unix time after which the job is useless.
+        :param stream: give the items one by one as the pages arrive
+        (see Job.iter_items), for the content types that can.
+        :param download: download the media of the result.
+        :param kwargs: passed to the crawler method.
+        """
+        if content_type not in CONTENT_RUNNERS:
+            raise ValueError(f"Unknown content type: {content_type}")
+
+        if priority is None:
+            priority = CONTENT_PRIORITIES[content_type]
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError("priority must be an integer")
+        if deadline is not None and (not isinstance(deadline, (int, float)) or isinstance(deadline, bool)):
+            raise ValueError("deadline must be a unix time")
+
+        with self._cond:
+            job = Job(job_id=next(self._ids), content_type=content_type, url=url,
+                      priority=priority, deadline=deadline, kwargs=kwargs, stream=stream,
+                      download=download)
+            heapq.heappush(self._queue, self._sort_key(job))
+            # stored once it is queued, so a job is never left pending
+            self.jobs[job.job_id] = job
+            self._cond.notify_all()
+
+        logger.info("Job %s submitted: %s %s, priority %s", job.job_id, content_type, url, priority)
+        return job
+
+    def forget(self, job_id: int) -> bool:
+        """
+        Drops a finished job, so a long-running scheduler does not keep
+        every result.
+
+        :return: False when the job is unknown or not finished.
+        """
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is None or not job.done.is_set():
+                return False
+            del self.jobs[job_id]
+            return True
+
+    def start(self) -> None:
+        for number in range(self.workers):
+            urgent_only = number < self.urgent_workers
+            thread = threading.Thread(target=self._work, args=(urgent_only,),
+                                      name=f"scheduler-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self) -> None:
+        """
+        Blocks until all submitted jobs are finished.
+        """
+        with self._cond:
+            while self._queue or self._running:
+                self._cond.wait()
+
+    def stop(self, wait: bool = True) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _sort_key(self, job: Job) -> Tuple[int, float, int]:
+        deadline = job.deadline if job.deadline is not None else float("inf")
+        return (-job.priority, deadline, job.job_id)
+
+    def _next_job(self, urgent_only: bool) -> Optional[Job]:
+        while not self._stopping:
+            if self._queue:
+                job = self.jobs[self._queue[0][2]]
+                if not urgent_only or job.urgent:
+                    heapq.heappop(self._queue)
+                    return job
+            self._cond.wait()
+
+        return None
+
+    def _work(self, urgent_only: bool) -> None:
+        while True:
+            with self._cond:
+                job = self._next_job(urgent_only)
+                if job is None:
+                    return
+                self._running += 1
+
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def _run(self, job: Job) -> None:
+        # nothing may escape, the worker thread would die with it
+        try:
+            if job.deadline is not None and job.deadline < time.time():
+                logger.warning("Job %s missed its deadline and was skipped", job.job_id)
+                job.finish("expired")
+                return
+
+            job.status = "running"
+            limiter = getattr(self.insta, "rate_limiter", None)
+            if limiter is not None:
+                with limiter.priority(job.priority):
+                    self._collect(job)
+            else:
+                self._collect(job)
+        except Exception as e:
+            job.error = repr(e)
+            logger.error("Job %s failed: %r", job.job_id, e)
+            job.finish("failed")
+        else:
+            job.finish("done")
+
+    def _collect(self, job: Job) -> None:
+        if job.stream and job.content_type in STREAMING_RUNNERS:
+            for item in STREAMING_RUNNERS[job.content_type](self.insta, job.url, **job.kwargs):
+                job.add_item(item)
+            job.result = job.items
+        else:
+            job.result = CONTENT_RUNNERS[job.content_type](self.insta, job.url, **job.kwargs)
+            for item in job.result if isinstance(job.result, list) else [job.result]:
+                job.add_item(item)
+
+        if job.download and job.content_type in DOWNLOADS and job.items:
+            job.failed_downloads = download_all(
+                posts=job.items, content_type=DOWNLOADS[job.content_type],
+                username=job.items[0].owner_username, refresh=self.insta.refresh_media_links,
+                progress=False)
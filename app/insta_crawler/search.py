@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .storage import SQLiteStorage
+from .utils import read_export
+
+HASHTAG_RE = re.compile(r"#(\w+)")
+MENTION_RE = re.compile(r"@([\w.]+)")
+KINDS = ("posts", "igtv", "users")
+
+# weights of the text, hashtags and mentions columns in the ranking
+RANK_WEIGHTS = (1.0, 4.0, 4.0)
+
+
+@dataclass
+class SearchHit:
+    """
+    :param key: shortcode of a post or igtv, username of a user.
+    :param rank: higher is a better match.
+    """
+    kind: str
+    key: str
+    owner_username: str
+    snippet: str
+    rank: float
+
+
+class SearchIndex(SQLiteStorage):
+    """
+    Full-text index (SQLite FTS5) of post descriptions, igtv titles,
+    and bios and full names of users. Hashtags and mentions are
+    indexed in columns of their own, so they can be searched apart
+    from the text.
+
+    :param path: SQLite file of the index.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            owner_username TEXT NOT NULL,
+            text TEXT NOT NULL,
+            hashtags TEXT NOT NULL,
+            mentions TEXT NOT NULL,
+            UNIQUE (kind, key)
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            text, hashtags, mentions,
+            content = 'documents', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts (rowid, text, hashtags, mentions)
+            VALUES (new.id, new.text, new.hashtags, new.mentions);
+        END;
+        CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, text, hashtags, mentions)
+            VALUES ('delete', old.id, old.text, old.hashtags, old.mentions);
+        END;
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path=path, schema=self.schema)
+
+    def add(self, content_type: str, items: Iterable[Any]) -> int:
+        """
+        Indexes posts, igtvs or users (models or their dicts).
+        An item indexed before is replaced.
+
+        :param content_type: "posts", "igtv", "users", also
+        "followers" and "followed" for users. Stories and highlights
+        have no text and are skipped.
+
+        :return: number of indexed items.
+        """
+        rows = [row for row in (_document(content_type, dict(item)) for item in items) if row is not None]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # REPLACE would not fire the delete trigger
+            conn.executemany("DELETE FROM documents WHERE kind = ? AND key = ?",
+                             [(kind, key) for kind, key, *_ in rows])
+            conn.executemany("INSERT INTO documents (kind, key, owner_username, text, hashtags, mentions) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        return len(rows)
+
+    def import_file(self, path: str) -> int:
+        """
+        Indexes an export: a <username>_data.json file of
+        export_as_json or a json lines file of the pipeline.
+
+        :return: number of indexed items.
+        """
+        indexed = 0
+        for content_type, items in read_export(path):
+            indexed += self.add(content_type, items)
+        return indexed
+
+    def search(self, query: str = "", kind: Optional[str] = None,
+               hashtags: Iterable[str] = (), mentions: Iterable[str] = (),
+               owner_username: Optional[str] = None, limit: int = 20) -> List[SearchHit]:
+        """
+        Gives the best matches first.
+
+        :param query: FTS5 query over all the columns, e.g.
+        "sunset beach", "sun*" or "cat OR dog".
+        :param kind: "posts", "igtv" or "users".
+        :param hashtags: tags the item must have, without "#".
+        :param mentions: usernames the item must mention.
+        """
+        terms = [f"({query})"] if query.strip() else []
+        terms += [f"hashtags : {_quote(tag.lstrip('#'))}" for tag in hashtags]
+        terms += [f"mentions : {_quote(username.lstrip('@'))}" for username in mentions]
+        if not terms:
+            raise ValueError("Nothing to search for")
+
+        sql = (
+            "SELECT d.kind, d.key, d.owner_username, "
+            "snippet(documents_fts, 0, '[', ']', '...', 12), "
+            f"bm25(documents_fts, {', '.join(map(str, RANK_WEIGHTS))}) AS score "
+            "FROM documents_fts JOIN documents AS d ON d.id = documents_fts.rowid "
+            "WHERE documents_fts MATCH ?"
+        )
+        params: List[Any] = [" AND ".join(terms)]
+        if kind is not None:
+            sql += " AND d.kind = ?"
+            params.append(kind)
+        if owner_username is not None:
+            sql += " AND d.owner_username = ?"
+            params.append(owner_username)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        # bm25 is negative, lower is better
+        return [SearchHit(kind=kind, key=key, owner_username=owner, snippet=snippet, rank=-score)
+                for kind, key, owner, snippet, score in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT kind, COUNT(*) FROM documents GROUP BY kind").fetchall()
+        return dict(rows)
+
+
+def extract_tags(text: str) -> Tuple[List[str], List[str]]:
+    """
+    :return: hashtags and mentioned usernames, lowercase and
+    without "#" and "@".
+    """
+    hashtags = list(dict.fromkeys(tag.lower() for tag in HASHTAG_RE.findall(text)))
+    mentions = list(dict.fromkeys(name.lower().rstrip(".") for name in MENTION_RE.findall(text)))
+    return hashtags, mentions
+
+
+def _document(content_type: str, item: Dict) -> Optional[Tuple[str, str, str, str, str, str]]:
+    if content_type in ("users", "followers", "followed"):
+        text = "\n".join(filter(None, [item.get("full_name"), item.get("bio")]))
+        kind, key, owner = "users", item["username"], item["username"]
+    elif content_type in ("posts", "igtv"):
+        text = "\n".join(filter(None, [item.get("title"), item.get("description")]))
+        kind, key, owner = content_type, str(item["shortcode"]), item["owner_username"]
+    else:
+        return None
+
+    hashtags, mentions = extract_tags(text)
+    return kind, key, owner, text, " ".join(hashtags), " ".join(mentions)
+
+
+def _quote(value: str) -> str:
+    return '"' + value.lower().replace('"', '""') + '"'
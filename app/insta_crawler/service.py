@@ -0,0 +1,220 @@
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import json
+import logging
+import re
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .scheduler import CONTENT_RUNNERS, Job, JobScheduler
+
+logger = logging.getLogger(__name__)
+
+JOB_PATH_RE = re.compile(r"^/jobs/(\d+)(/result|/stream)?$")
+
+
+class CrawlerService:
+    """
+    Local HTTP/JSON API around one warm crawler: its login, cache,
+    connections and rate limit are shared by all the callers.
+
+    POST /jobs              submit a job, see submit_job
+    GET  /jobs              all the jobs
+    GET  /jobs/<id>         status of a job
+    GET  /jobs/<id>/result  result of a finished job
+    GET  /jobs/<id>/stream  items as they are found, as json lines,
+                            the last line is {"job": <status>}
+    DELETE /jobs/<id>       forget a finished job
+    GET  /health            status of the service
+
+    :param scheduler: scheduler with the crawler, started by serve.
+    :param host: address to listen on, local only by default.
+    :param port: 0 picks a free port.
+    :param token: when set, requests must have the header
+    "Authorization: Bearer <token>".
+    """
+
+    def __init__(self, scheduler: JobScheduler, host: str = "127.0.0.1", port: int = 8765,
+                 token: Optional[str] = None) -> None:
+        self.scheduler = scheduler
+        self.token = token
+        self.httpd = ThreadingHTTPServer((host, port), type("Handler", (_Handler,), {"service": self}))
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self.httpd.server_address[:2]
+        return str(host), port
+
+    def serve_forever(self) -> None:
+        self.scheduler.start()
+        logger.info("Service listening on %s:%s", self.address[0], self.address[1])
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.scheduler.stop(wait=False)
+
+    def start(self) -> threading.Thread:
+        """
+        Serves in a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, name="service", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+
+    def submit_job(self, body: Dict[str, Any]) -> Job:
+        """
+        :param body: {"content_type": ..., "username": ... (or
+        "url"), "priority", "deadline", "download", "stream" and
+        "kwargs" of the crawler method, all optional}.
+        """
+        content_type = body.get("content_type")
+        if content_type not in CONTENT_RUNNERS:
+            raise ValueError(f"content_type must be one of: {', '.join(CONTENT_RUNNERS)}")
+
+        url = body.get("url") or (f"https://www.instagram.com/{body['username']}/"
+                                  if body.get("username") else None)
+        if not url:
+            raise ValueError("username or url is required")
+
+        kwargs = body.get("kwargs") or {}
+        if not isinstance(kwargs, dict):
+            raise ValueError("kwargs must be an object")
+
+        return self.scheduler.submit(content_type=content_type, url=url, priority=body.get("priority"),
+                                     deadline=body.get("deadline"), stream=bool(body.get("stream", True)),
+                                     download=bool(body.get("download", False)), **kwargs)
+
+    def authorized(self, header: Optional[str]) -> bool:
+        if self.token is None:
+            return True
+        return hmac.compare_digest(header or "", f"Bearer {self.token}")
+
+    def health(self) -> Dict[str, Any]:
+        jobs = list(self.scheduler.jobs.values())
+        statuses: Dict[str, int] = {}
+        for job in jobs:
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+
+        cache = getattr(self.scheduler.insta, "user_cache", None)
+        return {
+            "status": "ok",
+            "jobs": statuses,
+            "cache": {"hits": cache.hits, "misses": cache.misses} if cache is not None else None,
+        }
+
+
+def job_info(job: Job) -> Dict[str, Any]:
+    return {
+        "job_id": job.job_id,
+        "content_type": job.content_type,
+        "url": job.url,
+        "priority": job.priority,
+        "deadline": job.deadline,
+        "status": job.status,
+        "error": job.error,
+        "items": len(job.items),
+        "failed_downloads": job.failed_downloads,
+        "submitted_at": job.submitted_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _dumps(data: Any) -> bytes:
+    # models, also nested in lists and dicts, become dicts
+    return json.dumps(data, ensure_ascii=False, default=dict).encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Requests of the API, service is set by CrawlerService.
+    """
+    server_version = "InstaCrawler"
+    service: CrawlerService
+
+    def do_GET(self) -> None:
+        if not self._check_auth():
+            return
+        path = urlsplit(self.path).path.rstrip("/")
+        if path == "/health":
+            return self._send(HTTPStatus.OK, self.service.health())
+        if path == "/jobs":
+            return self._send(HTTPStatus.OK, [job_info(job) for job in list(self.service.scheduler.jobs.values())])
+
+        job, action = self._job(path)
+        if job is None:
+            return
+        if action == "/stream":
+            return self._stream(job)
+        if action == "/result":
+            if not job.done.is_set():
+                return self._send(HTTPStatus.ACCEPTED, job_info(job))
+            return self._send(HTTPStatus.OK, {**job_info(job), "result": job.result})
+        return self._send(HTTPStatus.OK, job_info(job))
+
+    def do_POST(self) -> None:
+        if not self._check_auth():
+            return
+        if urlsplit(self.path).path.rstrip("/") != "/jobs":
+            return self._send(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("the body must be a json object")
+            job = self.service.submit_job(body)
+        except (ValueError, TypeError) as e:
+            return self._send(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        return self._send(HTTPStatus.ACCEPTED, job_info(job))
+
+    def do_DELETE(self) -> None:
+        if not self._check_auth():
+            return
+        job, action = self._job(urlsplit(self.path).path.rstrip("/"))
+        if job is None:
+            return
+        if action or not self.service.scheduler.forget(job.job_id):
+            return self._send(HTTPStatus.CONFLICT, {"error": "only finished jobs can be deleted"})
+        return self._send(HTTPStatus.OK, job_info(job))
+
+    def _job(self, path: str) -> Tuple[Optional[Job], Optional[str]]:
+        match = JOB_PATH_RE.match(path)
+        job = self.service.scheduler.jobs.get(int(match.group(1))) if match else None
+        if job is None:
+            self._send(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return None, None
+        return job, match.group(2)  # type: ignore
+
+    def _stream(self, job: Job) -> None:
+        # HTTP/1.0, the stream ends with the connection
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for item in job.iter_items():
+            self.wfile.write(_dumps(item) + b"\n")
+            self.wfile.flush()
+        self.wfile.write(_dumps({"job": job_info(job)}) + b"\n")
+
+    def _check_auth(self) -> bool:
+        if self.service.authorized(self.headers.get("Authorization")):
+            return True
+        self._send(HTTPStatus.UNAUTHORIZED, {"error": "unauthorized"})
+        return False
+
+    def _send(self, status: HTTPStatus, data: Any) -> None:
+        body = _dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info("Service: %s " + format, self.address_string(), *args)
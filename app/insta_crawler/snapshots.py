@@ -0,0 +1,182 @@
+from array import array
+from dataclasses import dataclass, field
+import os
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MAGIC = b"IGSN"
+VERSION = 1
+# magic, version, taken_at, ids count, has usernames,
+# owner length, relation length
+HEADER = struct.Struct("<4sHdQ?HH")
+
+RELATIONS = ("followers", "followed_by_user")
+
+
+@dataclass
+class Snapshot:
+    """
+    Followers (or followed profiles) of one account at one moment,
+    stored as a sorted array of unique user ids.
+
+    :param usernames: optional usernames, aligned with user_ids.
+    """
+    owner: str
+    relation: str
+    taken_at: float
+    user_ids: array
+    usernames: Optional[List[str]] = field(default=None, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def username_by_id(self) -> Dict[int, str]:
+        if self.usernames is None:
+            return {}
+        return dict(zip(self.user_ids, self.usernames))
+
+
+def make_snapshot(result: Dict, owner: str, relation: str = "followers",
+                  taken_at: Optional[float] = None) -> Snapshot:
+    """
+    Builds a snapshot from the result of get_followers or
+    get_followed_by_user.
+
+    :param result: dictionary with "user_ids" and "usernames".
+    :param owner: username of the account.
+    :param relation: one of RELATIONS.
+    """
+    if relation not in RELATIONS:
+        raise ValueError(f"Unknown relation: {relation}")
+
+    pairs = sorted(dict(zip(result["user_ids"], result["usernames"])).items())
+    return Snapshot(
+        owner=owner,
+        relation=relation,
+        taken_at=taken_at if taken_at is not None else time.time(),
+        user_ids=array("q", (user_id for user_id, _ in pairs)),
+        usernames=[username for _, username in pairs],
+    )
+
+
+def save_snapshot(snapshot: Snapshot, path: str) -> str:
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    owner = snapshot.owner.encode("utf-8")
+    relation = snapshot.relation.encode("utf-8")
+    ids = _to_little_endian(snapshot.user_ids)
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, snapshot.taken_at, len(ids),
+                               snapshot.usernames is not None, len(owner), len(relation)))
+        file.write(owner)
+        file.write(relation)
+        ids.tofile(file)
+        if snapshot.usernames is not None:
+            file.write("\n".join(snapshot.usernames).encode("utf-8"))
+
+    return path
+
+
+def load_snapshot(path: str, with_usernames: bool = True) -> Snapshot:
+    with open(path, "rb") as file:
+        magic, version, taken_at, count, has_usernames, owner_len, relation_len = HEADER.unpack(
+            file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a snapshot file")
+
+        owner = file.read(owner_len).decode("utf-8")
+        relation = file.read(relation_len).decode("utf-8")
+
+        user_ids = array("q")
+        user_ids.fromfile(file, count)
+        user_ids = _to_little_endian(user_ids)
+
+        usernames = None
+        if has_usernames and with_usernames:
+            usernames = file.read().decode("utf-8").split("\n") if count else []
+
+    return Snapshot(owner=owner, relation=relation, taken_at=taken_at,
+                    user_ids=user_ids, usernames=usernames)
+
+
+def snapshot_path(snapshot: Snapshot) -> str:
+    """
+    Default place of a snapshot: downloads/<owner>/snapshots/.
+    """
+    name = f"{snapshot.relation}_{int(snapshot.taken_at)}.igsn"
+    return os.path.join(os.getcwd(), "downloads", snapshot.owner, "snapshots", name)
+
+
+def diff(old: Snapshot, new: Snapshot) -> Tuple[array, array]:
+    """
+    Compares two snapshots in one pass over both.
+
+    :return: ids that appeared in the new snapshot and ids that
+    are missing from it.
+    """
+    added = array("q")
+    lost = array("q")
+    a, b = old.user_ids, new.user_ids
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            lost.append(a[i])
+            i += 1
+        else:
+            added.append(b[j])
+            j += 1
+    lost.extend(a[i:])
+    added.extend(b[j:])
+
+    return added, lost
+
+
+def overlap(snapshots: Sequence[Snapshot]) -> array:
+    """
+    Ids present in all the snapshots. Starts from the smallest one,
+    so the cost is linear in the total size.
+    """
+    if not snapshots:
+        return array("q")
+
+    ordered = sorted(snapshots, key=len)
+    common = ordered[0].user_ids
+    for snapshot in ordered[1:]:
+        common = _intersect(common, snapshot.user_ids)
+        if not common:
+            break
+
+    return array("q", common)
+
+
+def _intersect(a: array, b: array) -> array:
+    result = array("q")
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            result.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+
+    return result
+
+
+def _to_little_endian(ids: array) -> array:
+    if sys.byteorder == "little":
+        return ids
+
+    swapped = array("q", ids)
+    swapped.byteswap()
+    return swapped
@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+import os
+import sqlite3
+from typing import Iterator
+
+
+class SQLiteStorage:
+    """
+    Base of the SQLite files of the crawler. Opens a short-lived
+    connection per operation, so the same object can be used from
+    worker threads and forked processes.
+
+    :param path: SQLite file, created with its directory.
+    :param schema: script run when the storage is opened.
+    """
+
+    def __init__(self, path: str, schema: str) -> None:
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self._connect() as conn:
+            conn.executescript(schema)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # autocommit and no WAL, WAL does not work on network drives
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
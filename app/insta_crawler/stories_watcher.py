@@ -0,0 +1,142 @@
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .exceptions import NotFoundError, PrivateProfileError
+from .models import Storie
+from .utils import load_state, save_state
+
+logger = logging.getLogger(__name__)
+
+# stories live for 24 hours, seen ids are kept a bit longer
+SEEN_TTL = 2 * 24 * 60 * 60
+# private and missing profiles are looked up again after a day
+UNAVAILABLE_RETRY = 24 * 60 * 60
+# longest sleep after failed polls
+MAX_BACKOFF = 6 * 60 * 60
+
+
+class StoriesWatcher:
+    """
+    Polls active stories of a watchlist and gives back only the
+    stories that have not been seen yet.
+
+    User ids are resolved once and kept in the state file together
+    with the seen story ids, so a poll cycle costs one request per
+    InstaCrawler.stories_batch_size users. Private and missing
+    profiles are kept there too and looked up again only after
+    UNAVAILABLE_RETRY seconds.
+
+    :param insta: InstaCrawler instance.
+    :param usernames: watchlist.
+    :param state_path: json file with user ids and seen stories.
+    """
+
+    def __init__(self, insta: Any, usernames: Iterable[str], state_path: str) -> None:
+        self.insta = insta
+        self.usernames = list(dict.fromkeys(usernames))
+        self.state_path = state_path
+
+        self.user_ids: Dict[str, int] = {}
+        self.seen: Dict[str, int] = {}
+        # username: time of the next lookup
+        self.unavailable: Dict[str, float] = {}
+        self._load_state()
+
+    def resolve_user_ids(self) -> None:
+        """
+        Requests user ids of the watchlist users that are not
+        in the state yet. Private and missing profiles are skipped
+        until their retry time.
+        """
+        now = time.time()
+        for username in self.usernames:
+            if username in self.user_ids or self.unavailable.get(username, 0) > now:
+                continue
+
+            try:
+                user = self.insta.get_user_info(url=f"{self.insta.BASE_URL}{username}/",
+                                                fields=["user_id"])
+            except (PrivateProfileError, NotFoundError) as e:
+                logger.warning("Stories of %s can not be watched: %r", username, e)
+                self.unavailable[username] = now + UNAVAILABLE_RETRY
+                continue
+
+            self.user_ids[username] = int(user.user_id)
+            self.unavailable.pop(username, None)
+
+        self._save_state()
+
+    def poll_once(self, on_new: Optional[Callable[[List[Storie]], None]] = None) -> List[Storie]:
+        """
+        Requests active stories of the whole watchlist.
+
+        :param on_new: called with the new stories before they are
+        saved as seen, so they come again if it fails.
+        :return: stories that were not seen before.
+        """
+        self.resolve_user_ids()
+
+        user_ids = [self.user_ids[username] for username in self.usernames if username in self.user_ids]
+        reels = self.insta.get_stories_batch(reel_ids=user_ids)
+
+        new_stories = []
+        for stories in reels.values():
+            for storie in stories:
+                if str(storie.shortcode) not in self.seen:
+                    new_stories.append(storie)
+
+        if new_stories and on_new is not None:
+            on_new(new_stories)
+
+        for storie in new_stories:
+            self.seen[str(storie.shortcode)] = storie.posted_at
+        self._forget_expired()
+        self._save_state()
+
+        logger.info("Stories poll: %s users, %s new stories", len(user_ids), len(new_stories))
+        return new_stories
+
+    def watch(self, on_new: Callable[[List[Storie]], None], interval: float = 600,
+              cycles: Optional[int] = None) -> None:
+        """
+        Polls the watchlist every interval seconds and passes new
+        stories to on_new. A failed poll is logged and the interval
+        doubles with every failure in a row, up to MAX_BACKOFF.
+
+        :param cycles: number of polls, endless when omitted.
+        """
+        cycle = 0
+        failures = 0
+        while cycles is None or cycle < cycles:
+            started_at = time.monotonic()
+
+            try:
+                self.poll_once(on_new=on_new)
+            except Exception as e:
+                failures += 1
+                logger.error("Stories poll failed, %s in a row: %r", failures, e)
+            else:
+                failures = 0
+
+            cycle += 1
+            if cycles is None or cycle < cycles:
+                delay = max(interval, min(interval * 2 ** failures, MAX_BACKOFF))
+                time.sleep(max(0, delay - (time.monotonic() - started_at)))
+
+    def _forget_expired(self) -> None:
+        border = time.time() - SEEN_TTL
+        self.seen = {
+            storie_id: posted_at
+            for storie_id, posted_at in self.seen.items()
+            if posted_at >= border
+        }
+
+    def _load_state(self) -> None:
+        state = load_state(self.state_path)
+        self.user_ids = state.get("user_ids", {})
+        self.seen = state.get("seen", {})
+        self.unavailable = state.get("unavailable", {})
+
+    def _save_state(self) -> None:
+        save_state(self.state_path, {"user_ids": self.user_ids, "seen": self.seen, "unavailable": self.unavailable})
@@ -0,0 +1,220 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+import hashlib
+from io import BytesIO
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageOps
+
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+VIDEO_EXTENSIONS = (".mp4",)
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class Thumbnail:
+    """
+    :param source: downloaded media file.
+    :param source_hash: sha256 of the source the thumbnail was made
+    from.
+    :param thumbnail: the jpeg, None when it could not be made.
+    """
+    source: str
+    source_hash: str
+    thumbnail: Optional[str]
+    width: int = 0
+    height: int = 0
+    error: Optional[str] = None
+
+
+class ThumbnailIndex(SQLiteStorage):
+    """
+    Thumbnails made so far, by source file.
+
+    :param path: SQLite file of the index.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS thumbnails (
+            source TEXT PRIMARY KEY,
+            source_hash TEXT NOT NULL,
+            thumbnail TEXT,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            error TEXT,
+            made_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path=path, schema=self.schema)
+
+    def get(self, source: str) -> Optional[Thumbnail]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT source, source_hash, thumbnail, width, height, error "
+                               "FROM thumbnails WHERE source = ?", (source,)).fetchone()
+        return Thumbnail(*row) if row else None
+
+    def put(self, thumbnail: Thumbnail) -> None:
+        with self._connect() as conn:
+            conn.execute("REPLACE INTO thumbnails (source, source_hash, thumbnail, width, height, error, made_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (thumbnail.source, thumbnail.source_hash, thumbnail.thumbnail,
+                          thumbnail.width, thumbnail.height, thumbnail.error, time.time()))
+
+    def all(self) -> List[Thumbnail]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT source, source_hash, thumbnail, width, height, error "
+                                "FROM thumbnails ORDER BY source").fetchall()
+        return [Thumbnail(*row) for row in rows]
+
+
+class Thumbnailer:
+    """
+    Makes square jpeg thumbnails of downloaded images and videos in a
+    pool of processes, so they are made on all the cores while the
+    downloads go on. A file whose content did not change since its
+    thumbnail was made is skipped.
+
+    Thumbnails mirror the downloads folder: downloads/<username>/posts/
+    x.mp4 gives <output_dir>/<username>/posts/x.jpg. Video frames are
+    taken with ffmpeg, when it is installed.
+
+    :param index_path: SQLite file of the ThumbnailIndex.
+    :param size: side of the thumbnails, in pixels.
+    :param workers: processes, the number of cores when None.
+    """
+
+    def __init__(self, index_path: str, root: str = "downloads", output_dir: str = "thumbnails",
+                 size: int = 320, quality: int = 85, workers: Optional[int] = None) -> None:
+        self.index = ThumbnailIndex(path=index_path)
+        self.root = os.path.abspath(root)
+        self.output_dir = os.path.abspath(output_dir)
+        self.size = size
+        self.quality = quality
+        self.counts: Dict[str, int] = {"made": 0, "skipped": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def __enter__(self) -> "Thumbnailer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def submit(self, path: str) -> Optional[Future]:
+        """
+        Queues a media file, returns at once. Can be given to
+        download_all as on_file.
+        """
+        source = os.path.abspath(path)
+        if not source.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+            return None
+
+        known = self.index.get(source)
+        future = self._executor.submit(_make_thumbnail, source, self._target(source), self.size,
+                                       self.quality, known.source_hash if known else None)
+        future.add_done_callback(self._record)
+        return future
+
+    def scan(self, directory: Optional[str] = None) -> int:
+        """
+        Queues all the media under the directory, the downloads
+        folder by default.
+
+        :return: number of queued files.
+        """
+        queued = 0
+        for folder, _, names in os.walk(directory or self.root):
+            for name in sorted(names):
+                if self.submit(os.path.join(folder, name)) is not None:
+                    queued += 1
+        return queued
+
+    def close(self, wait: bool = True) -> Dict[str, int]:
+        """
+        :return: numbers of made, skipped and failed thumbnails.
+        """
+        self._executor.shutdown(wait=wait)
+        return dict(self.counts)
+
+    def _target(self, source: str) -> str:
+        relative = os.path.relpath(source, self.root)
+        if relative.startswith(os.pardir):
+            relative = os.path.basename(source)
+        return os.path.join(self.output_dir, f"{os.path.splitext(relative)[0]}.jpg")
+
+    def _record(self, future: Future) -> None:
+        # runs in a thread of the executor, in this process
+        try:
+            thumbnail = future.result()
+        except Exception as e:
+            logger.error("Thumbnail not made: %r", e)
+            thumbnail = None
+            outcome = "failed"
+        else:
+            outcome = "skipped" if thumbnail is None else ("failed" if thumbnail.error else "made")
+
+        if thumbnail is not None:
+            self.index.put(thumbnail)
+            if thumbnail.error:
+                logger.warning("Thumbnail of %s not made: %s", thumbnail.source, thumbnail.error)
+        with self._lock:
+            self.counts[outcome] += 1
+
+
+def _make_thumbnail(source: str, target: str, size: int, quality: int,
+                    known_hash: Optional[str]) -> Optional[Thumbnail]:
+    """
+    Runs in a worker process.
+
+    :return: None when the source did not change and the thumbnail
+    is there.
+    """
+    source_hash = _file_hash(source)
+    if source_hash == known_hash and os.path.exists(target):
+        return None
+
+    try:
+        is_video = source.lower().endswith(VIDEO_EXTENSIONS)
+        with Image.open(BytesIO(_video_frame(source)) if is_video else source) as image:
+            frame = ImageOps.fit(ImageOps.exif_transpose(image).convert("RGB"), (size, size))
+    except (OSError, ValueError, RuntimeError) as e:
+        return Thumbnail(source=source, source_hash=source_hash, thumbnail=None, error=str(e) or repr(e))
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # a half written thumbnail never takes the place of the old one
+    frame.save(f"{target}.part", format="JPEG", quality=quality)
+    os.replace(f"{target}.part", target)
+    return Thumbnail(source=source, source_hash=source_hash, thumbnail=target,
+                     width=frame.width, height=frame.height)
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _video_frame(source: str) -> bytes:
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is not installed")
+    # the thumbnail filter picks a telling frame of the first ones
+    result = subprocess.run([ffmpeg, "-v", "error", "-i", source, "-vf", "thumbnail", "-frames:v", "1",
+                             "-f", "image2pipe", "-vcodec", "png", "-"], capture_output=True, timeout=120)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"ffmpeg: {result.stderr.decode(errors='replace').strip() or 'no frame'}")
+    return result.stdout
@@ -1,13 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
 import csv
+from dataclasses import dataclass
 import json
+import logging
 import os
+import time
 from time import sleep
-from typing import Dict, List
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 
 from prettytable import PrettyTable
 import requests
 from tqdm import tqdm
 
+from .exceptions import IncompleteDownloadError
+from .planner import CrawlCost
+from .proxies import lease, ProxyPool
+from .resilience import RETRY_STATUSES
+
+logger = logging.getLogger(__name__)
+
 
 def export_as_json(data: Dict, username: str, prepocessed: bool = False):
     file_dir = os.path.join(os.getcwd(), "downloads", username)
@@ -37,6 +49,55 @@ def export_as_json(data: Dict, username: str, prepocessed: bool = False):
             )
 
 
+def read_export(path: str) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    Reads the items of a <username>_data.json file of export_as_json
+    or of a json lines file of the pipeline.
+
+    :return: content type and items, in the order of the file.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.pop("content_type", "posts"), [record]
+            return
+        data = json.load(file)
+
+    for content_type, items in data.items():
+        # followers exports also keep the counts and usernames
+        if isinstance(items, list) and all(isinstance(item, dict) for item in items):
+            yield content_type, items
+
+
+def load_state(path: str) -> Dict:
+    """
+    :return: the json state written by save_state, empty when
+    there is no file yet.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: Dict) -> None:
+    """
+    Writes the json state through a temporary file, so a crash
+    never leaves half of it.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, path)
+
+
 def export_as_csv(data: List, headers_row: List,
                   username: str, content_type: str):
     file_dir = os.path.join(os.getcwd(), "downloads", username)
@@ -55,6 +116,28 @@ def export_as_csv(data: List, headers_row: List,
             writer.writerow(row)
 
 
+# files from this size are downloaded in parallel byte ranges
+SEGMENTED_THRESHOLD = 32 * 1024 * 1024
+SEGMENT_SIZE = 8 * 1024 * 1024
+SEGMENT_WORKERS = 4
+CHUNK_SIZE = 1024 * 1024
+
+# answers of the CDN to a signed link that expired
+EXPIRED_STATUSES = frozenset({403, 410})
+
+# proxies of the media downloads, separate from the api ones
+cdn_proxy_pool: Optional[ProxyPool] = None
+
+
+def use_cdn_proxies(pool: Optional[ProxyPool]) -> None:
+    """
+    Sends all the media downloads through the pool, None goes back
+    to direct connections.
+    """
+    global cdn_proxy_pool
+    cdn_proxy_pool = pool
+
+
 def download_file(url: str, content_type: str,
                   username: str, name: str) -> str:
 
@@ -65,57 +148,245 @@ def download_file(url: str, content_type: str,
     path_to_file = os.path.join(file_dir, name)
     if os.path.exists(path_to_file):
         return path_to_file
-    else:
-        chunk_size = 1024
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(path_to_file, "wb") as f:
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        f.write(chunk)
-        return path_to_file
 
+    # a broken download never takes the place of the file
+    part_path = f"{path_to_file}.part"
+    try:
+        size = _download_stream(url=url, path=part_path)
+        written = os.path.getsize(part_path)
+        if written != size:
+            raise IncompleteDownloadError(f"{url}: got {written} of {size} bytes.")
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    os.replace(part_path, path_to_file)
+    return path_to_file
+
+
+def _download_stream(url: str, path: str) -> int:
+    """
+    Downloads the file with one GET. When the headers tell a large
+    file and a server giving parts of it, only the first segment is
+    read from that GET and the rest comes in parallel ranges.
+
+    :return: size the server sent in Content-Length, or the number
+    of written bytes if there is no usable one.
+    """
+    with lease(cdn_proxy_pool) as proxy_lease, \
+            requests.get(url, stream=True, timeout=30, proxies=proxy_lease.proxies) as r:
+        proxy_lease.done(r.status_code)
+        r.raise_for_status()
+        length = r.headers.get("Content-Length")
+        if r.headers.get("Content-Encoding"):
+            # the length is of the encoded body
+            length = None
+        size = int(length) if length and length.isdigit() else None
+        segmented = (size is not None and size >= SEGMENTED_THRESHOLD
+                     and r.headers.get("Accept-Ranges", "").lower() == "bytes")
+
+        with open(path, "wb", buffering=CHUNK_SIZE) as f:
+            if segmented:
+                # preallocated, so every range is written in place
+                f.truncate(size)
+            written = _write_body(r, f, limit=SEGMENT_SIZE if segmented else None)
+
+    if size is not None and segmented:
+        # ranges check their own length
+        _download_segmented(url=url, path=path, start=written, size=size)
+    return size if size is not None else os.path.getsize(path)
+
+
+def _write_body(r: requests.Response, f: BinaryIO, limit: Optional[int] = None) -> int:
+    """
+    :return: number of written bytes, at most limit.
+    """
+    written = 0
+    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+        if limit is not None and written + len(chunk) >= limit:
+            f.write(chunk[:limit - written])
+            return limit
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def _download_segmented(url: str, path: str, start: int, size: int) -> None:
+    ranges = [(offset, min(offset + SEGMENT_SIZE, size) - 1) for offset in range(start, size, SEGMENT_SIZE)]
+    with ThreadPoolExecutor(max_workers=SEGMENT_WORKERS) as executor:
+        for _ in executor.map(lambda byte_range: _download_range(url, path, *byte_range), ranges):
+            pass
+
+
+def _download_range(url: str, path: str, start: int, end: int) -> None:
+    headers = {"Range": f"bytes={start}-{end}"}
+    with lease(cdn_proxy_pool) as proxy_lease, \
+            requests.get(url, headers=headers, stream=True, timeout=30, proxies=proxy_lease.proxies) as r:
+        proxy_lease.done(r.status_code)
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IncompleteDownloadError(f"{url}: the range {start}-{end} was not given.")
+
+        written = 0
+        with open(path, "r+b", buffering=CHUNK_SIZE) as f:
+            f.seek(start)
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+
+    if written != end - start + 1:
+        raise IncompleteDownloadError(f"{url}: got {written} of {end - start + 1} bytes at {start}.")
+
+
+def media_file_name(post: Any, link: str, index: int,
+                    content_type: str, username: str) -> str:
+    shortcode = media_key(post, content_type)
+    return (
+        f"{username}_{content_type}_{shortcode}_0{index+1}"
+        f"{'.mp4' if 'mp4' in link else '.png'}"
+    )
+
+
+@dataclass
+class _Media:
+    post: Any
+    index: int
+    link: str
+    name: str
+    error: Optional[str] = None
+    expired: bool = False
+    retry: bool = False
+
+
+def media_key(post: Any, content_type: str) -> str:
+    """
+    Id the media links of a collected item are refreshed by.
+    """
+    return str(post.highlight_id if content_type == "highlights" else post.shortcode)
+
+
+def link_expired(url: str, now: Optional[float] = None) -> bool:
+    """
+    Instagram CDN links are signed, "oe" is their expiry as a hex
+    timestamp.
+    """
+    value = parse_qs(urlsplit(url).query).get("oe")
+    try:
+        expires_at = int(value[0], 16)  # type: ignore
+    except (TypeError, ValueError):
+        return False
+    return expires_at <= (time.time() if now is None else now)
+
+
+def download_all(posts: List[Any],
+                 content_type: str, username: str,
+                 refresh: Optional[Callable[[List, str], Dict[str, List[str]]]] = None,
+                 progress: bool = True,
+                 on_file: Optional[Callable[[str], Any]] = None) -> List[Dict]:
+    """
+    Downloads the media of the posts. Failed downloads are tried once
+    more. Expired links (and links the CDN refuses) are requested
+    again with refresh for all the posts at once, then downloaded.
+
+    :param refresh: gives fresh links by media_key, e.g.
+    InstaCrawler.refresh_media_links.
+    :param progress: show a progress bar.
+    :param on_file: called with the path of every downloaded file,
+    e.g. Thumbnailer.submit.
+
+    :return: media that could not be downloaded.
+    """
+    media = [
+        _Media(post=post, index=index, link=link,
+               name=media_file_name(post=post, link=link, index=index,
+                                    content_type=content_type, username=username))
+        for post in posts
+        for index, link in enumerate(post.post_content)
+    ]
+
+    with tqdm(total=len(media), disable=not progress) as pbar:
+        failed = _download_media(media, content_type, username, pbar, on_file)
+        # connection errors, broken downloads and busy servers
+        retried = [item for item in failed if item.retry]
+        failed = [item for item in failed if not item.retry]
+        failed += _download_media(retried, content_type, username, pbar, on_file)
+
+        expired = [item for item in failed if item.expired]
+        if expired and refresh is not None:
+            failed = [item for item in failed if not item.expired]
+            failed += _download_media(_refresh_links(expired, content_type, refresh),
+                                      content_type, username, pbar, on_file)
+
+    for item in failed:
+        logger.warning("Media %s not downloaded: %s", item.name, item.error)
+
+    return [
+        {
+            "username": username,
+            "content_type": content_type,
+            "link": item.link,
+            "name": item.name,
+            "error": item.error,
+        }
+        for item in failed
+    ]
+
+
+def _download_media(media: List[_Media], content_type: str, username: str, pbar: tqdm,
+                    on_file: Optional[Callable[[str], Any]] = None) -> List[_Media]:
+    """
+    :return: media that failed, with the error.
+    """
+    failed = []
+    for item in media:
+        path = _fetch_media(item, content_type, username)
+        if item.error is not None:
+            failed.append(item)
+            continue
+        pbar.update(1)
+        if on_file is not None and path is not None:
+            on_file(path)
+    return failed
+
+
+def _fetch_media(item: _Media, content_type: str, username: str) -> Optional[str]:
+    """
+    :return: path of the file. When the download fails, item gets
+    the error.
+    """
+    item.error, item.expired, item.retry = None, False, False
+    if not item.link:
+        item.error = "the media is gone"
+    elif link_expired(item.link):
+        item.error, item.expired = "the link expired", True
+    else:
+        try:
+            return download_file(url=item.link, content_type=content_type, username=username, name=item.name)
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            item.error, item.expired = f"HTTP {status}", status in EXPIRED_STATUSES
+            # 429 and 5xx are tried again like the connection errors
+            item.retry = status in RETRY_STATUSES
+        except Exception as e:
+            item.error, item.retry = repr(e), True
+    return None
+
+
+def _refresh_links(media: List[_Media], content_type: str,
+                   refresh: Callable[[List, str], Dict[str, List[str]]]) -> List[_Media]:
+    posts = {media_key(item.post, content_type): item.post for item in media}
+    try:
+        links = refresh(list(posts.values()), content_type)
+    except Exception as e:
+        logger.error("Links of %s %s not refreshed: %r", len(posts), content_type, e)
+        links = {}
 
-def download_all(posts: List[Dict],
-                 content_type: str, username: str) -> None:
-    undone = []
-    total_links = sum([len(post.post_content) for post in posts])
-    with tqdm(total=total_links) as pbar:
-        for post in posts:
-            shortcode = post.highlight_id if content_type == "highlights" else post.shortcode
-            links = post.post_content
-            for index, link in enumerate(links):
-                name = (
-                    f"{username}_{content_type}_{shortcode}_0{index+1}"
-                    f"{'.mp4' if 'mp4' in link else '.png'}"
-                )
-                try:
-                    download_file(
-                        url=link,
-                        content_type=content_type,
-                        username=username,
-                        name=name,
-                    )
-                    pbar.update(1)
-                except requests.exceptions.HTTPError:
-                    continue
-                except Exception:
-                    undone.append(
-                        {
-                            "username": username,
-                            "content_type": content_type,
-                            "link": link,
-                            "name": name,
-                        },
-                    )
-        for item in undone:
-            download_file(
-                username=item["username"],
-                content_type=item["content_type"],
-                url=item["link"],
-                name=item["name"],
-            )
-            pbar.update(1)
+    for item in media:
+        fresh = links.get(media_key(item.post, content_type), [])
+        # an empty link is reported as gone
+        item.link = fresh[item.index] if item.index < len(fresh) else ""
+    return media
 
 
 def print_user_info_table(user_info: Dict) -> None:
@@ -168,6 +439,53 @@ def print_single_post_info_table(post_info: Dict) -> None:
         title=f"{post_info['owner_username']}`s instagram post"))
 
 
+def print_crawl_plan_table(costs: List[CrawlCost], total: CrawlCost) -> None:
+    table = PrettyTable(padding_width=2)
+    table.field_names = ["PROFILE", "REQUESTS", "PAGES", "HYDRATIONS", "FILES", "MEDIA", "TIME"]
+    table.align = "r"
+
+    for cost in costs + [total]:
+        username = f"{cost.username} (private)" if cost.private else cost.username
+        table.add_row([username, cost.requests, cost.pages, cost.hydrations, cost.media_files,
+                       _human_bytes(cost.media_bytes), _human_duration(cost.seconds)])
+
+    print(table.get_string(title="Crawl plan"))
+
+
+def print_insights_table(summary: List[Dict]) -> None:
+    table = PrettyTable(padding_width=2)
+    table.field_names = ["PROFILE", "FOLLOWERS", "POSTS", "ENGAGEMENT", "LIKES", "COMMENTS",
+                         "POSTS/WEEK", "GAP (H)", "OUTLIERS"]
+    table.align = "r"
+
+    for profile in summary:
+        rate = profile["engagement_rate"]
+        table.add_row([profile["username"], _or_dash(profile["followers"], "{:.0f}"), profile["posts"],
+                       "-" if rate is None else f"{rate * 100:.2f}%",
+                       _or_dash(profile["likes_mean"], "{:.0f}"), _or_dash(profile["comments_mean"], "{:.0f}"),
+                       _or_dash(profile["posts_per_week"], "{:.2f}"), _or_dash(profile["median_gap_hours"], "{:.1f}"),
+                       len(profile["outliers"])])
+
+    print(table.get_string(title="Engagement insights"))
+
+
+def _or_dash(value: Optional[float], template: str) -> str:
+    return "-" if value is None else template.format(value)
+
+
+def _human_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _human_duration(seconds: float) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h {rest // 60:02d}m {rest % 60:02d}s"
+
+
 def how_sleep(data_len: int) -> None:
     if data_len % 1000 == 0:
         sleep(11)
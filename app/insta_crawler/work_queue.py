@@ -0,0 +1,403 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, cast
+
+from .storage import SQLiteStorage
+from .utils import download_all, get_data_by_content_type
+
+logger = logging.getLogger(__name__)
+
+TASK_KINDS = ("user_info", "posts", "stories", "highlights", "igtv")
+
+
+@dataclass
+class Task:
+    task_id: int
+    kind: str
+    payload: Dict
+    attempts: int
+    worker: str
+
+
+class QueueBackend(ABC):
+    """
+    Shared queue of crawl tasks. Tasks are leased by workers and
+    either acknowledged or retried once their lease expires.
+    """
+
+    @abstractmethod
+    def put(self, kind: str, payload: Dict) -> int:
+        pass
+
+    @abstractmethod
+    def lease(self, worker: str, lease_seconds: float) -> Optional[Task]:
+        pass
+
+    @abstractmethod
+    def renew(self, task: Task, lease_seconds: float) -> bool:
+        pass
+
+    @abstractmethod
+    def ack(self, task: Task) -> None:
+        pass
+
+    @abstractmethod
+    def fail(self, task: Task, error: str) -> None:
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        pass
+
+    def put_many(self, kind: str, payloads: Iterable[Dict]) -> int:
+        count = 0
+        for payload in payloads:
+            self.put(kind=kind, payload=payload)
+            count += 1
+
+        return count
+
+
+class ResultSink(ABC):
+    """
+    Place where workers store the results of acknowledged tasks.
+    """
+
+    @abstractmethod
+    def write(self, task: Task, result: Any) -> None:
+        pass
+
+
+class SQLiteQueue(SQLiteStorage, QueueBackend):
+    """
+    Queue stored in a single SQLite file, which can be placed on
+    storage shared by several machines.
+
+    :param path: path to the queue file.
+    :param max_attempts: how many times a task is leased before
+    it is marked as failed.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_expires REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3) -> None:
+        super().__init__(path=path, schema=self.schema)
+        self.max_attempts = max_attempts
+
+    def put(self, kind: str, payload: Dict) -> int:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO tasks (kind, payload) VALUES (?, ?)",
+                (kind, json.dumps(payload)),
+            )
+            return cast(int, cursor.lastrowid)
+
+    def put_many(self, kind: str, payloads: Iterable[Dict]) -> int:
+        rows = [(kind, json.dumps(payload)) for payload in payloads]
+        with self._connect() as conn:
+            try:
+                # one transaction, not a commit per task
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT INTO tasks (kind, payload) VALUES (?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return len(rows)
+
+    def lease(self, worker: str, lease_seconds: float) -> Optional[Task]:
+        now = time.time()
+        with self._connect() as conn:
+            try:
+                # takes the write lock before the select, so two workers
+                # can never lease the same task
+                conn.execute("BEGIN IMMEDIATE")
+                while True:
+                    row = conn.execute(
+                        """
+                        SELECT id, kind, payload, attempts FROM tasks
+                        WHERE status = 'pending'
+                        AND (lease_expires IS NULL OR lease_expires < ?)
+                        ORDER BY id LIMIT 1
+                        """,
+                        (now,),
+                    ).fetchone()
+                    if row is None:
+                        conn.execute("COMMIT")
+                        return None
+
+                    task_id, kind, payload, attempts = row
+                    if attempts < self.max_attempts:
+                        break
+
+                    conn.execute(
+                        "UPDATE tasks SET status = 'failed', worker = NULL WHERE id = ?",
+                        (task_id,),
+                    )
+                    logger.error("Task %s lease expired %s times. Marked as failed", task_id, attempts)
+
+                conn.execute(
+                    "UPDATE tasks SET worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker, now + lease_seconds, task_id),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return Task(task_id=task_id, kind=kind, payload=json.loads(payload),
+                    attempts=attempts + 1, worker=worker)
+
+    def renew(self, task: Task, lease_seconds: float) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE tasks SET lease_expires = ?
+                WHERE id = ? AND worker = ? AND status = 'pending'
+                """,
+                (time.time() + lease_seconds, task.task_id, task.worker),
+            )
+            return cursor.rowcount == 1
+
+    def ack(self, task: Task) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = NULL WHERE id = ? AND worker = ?",
+                (task.task_id, task.worker),
+            )
+
+    def fail(self, task: Task, error: str) -> None:
+        status = "failed" if task.attempts >= self.max_attempts else "pending"
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE tasks SET status = ?, worker = NULL, lease_expires = NULL, error = ?
+                WHERE id = ? AND worker = ?
+                """,
+                (status, error, task.task_id, task.worker),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+
+        stats = {"pending": 0, "done": 0, "failed": 0}
+        stats.update(dict(rows))
+        return stats
+
+
+class SQLiteResultSink(SQLiteStorage, ResultSink):
+    """
+    Stores task results as json in a SQLite file.
+
+    :param path: path to the results file.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS results (
+            task_id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            data TEXT NOT NULL,
+            finished_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path=path, schema=self.schema)
+
+    def write(self, task: Task, result: Any) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (
+                    task.task_id,
+                    task.kind,
+                    json.dumps(task.payload),
+                    json.dumps(result, ensure_ascii=False, default=dict),
+                    time.time(),
+                ),
+            )
+
+    def read(self, kind: Optional[str] = None) -> Iterator[Dict]:
+        query = "SELECT task_id, kind, payload, data FROM results"
+        params: tuple = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            params = (kind,)
+
+        with self._connect() as conn:
+            for task_id, task_kind, payload, data in conn.execute(query, params):
+                yield {
+                    "task_id": task_id,
+                    "kind": task_kind,
+                    "payload": json.loads(payload),
+                    "data": json.loads(data),
+                }
+
+
+def enqueue_profiles(queue: QueueBackend, usernames: Iterable[str],
+                     kinds: Iterable[str] = ("user_info",),
+                     download: bool = False) -> int:
+    """
+    Splits a batch of profiles into tasks, one task per
+    profile and kind. The tasks of a kind are put at once.
+
+    :param queue: queue to put the tasks in.
+    :param usernames: profiles usernames.
+    :param kinds: what to collect, see TASK_KINDS.
+    :param download: download the collected content as well.
+    """
+    kinds = list(kinds)
+    unknown = set(kinds) - set(TASK_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown task kinds: {', '.join(sorted(unknown))}")
+
+    payloads = [{"username": username, "download": download} for username in usernames]
+    count = 0
+    for kind in kinds:
+        count += queue.put_many(kind=kind, payloads=payloads)
+
+    logger.info("Enqueued %s tasks", count)
+    return count
+
+
+def enqueue_followers(insta: Any, queue: QueueBackend, url: str,
+                      kinds: Iterable[str] = ("user_info",),
+                      download: bool = False) -> int:
+    """
+    Collects usernames of the profile followers and splits them
+    into tasks. The followers are not hydrated here, it is left
+    to the workers.
+
+    :param insta: InstaCrawler instance.
+    :param queue: queue to put the tasks in.
+    :param url: link to a profile
+    (https://www.instagram.com/username/).
+    """
+    followers = insta.get_followers(url=url, hydrate=False)
+
+    return enqueue_profiles(queue=queue, usernames=followers["usernames"],
+                            kinds=kinds, download=download)
+
+
+class Worker:
+    """
+    Leases tasks from the queue, runs them with the crawler and
+    stores the results in the sink. The lease is renewed in the
+    background while a task is running.
+
+    :param insta: InstaCrawler instance.
+    :param queue: queue to take the tasks from.
+    :param sink: where the results go.
+    :param worker_id: unique name of the worker.
+    :param lease_seconds: how long a task stays leased without
+    renewal.
+    """
+
+    def __init__(self, insta: Any, queue: QueueBackend, sink: ResultSink,
+                 worker_id: Optional[str] = None, lease_seconds: float = 300) -> None:
+        self.insta = insta
+        self.queue = queue
+        self.sink = sink
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.lease_seconds = lease_seconds
+
+        self.handlers: Dict[str, Callable[[Task], Any]] = {
+            "user_info": self._run_user_info,
+            "posts": self._run_content,
+            "stories": self._run_content,
+            "highlights": self._run_content,
+            "igtv": self._run_content,
+        }
+
+    def run(self, max_tasks: Optional[int] = None, idle_timeout: float = 0,
+            poll_interval: float = 5) -> int:
+        """
+        Processes tasks until the queue is empty for longer than
+        idle_timeout seconds or max_tasks tasks are done.
+
+        :return: number of processed tasks.
+        """
+        processed = 0
+        idle_since = time.monotonic()
+        while max_tasks is None or processed < max_tasks:
+            task = self.queue.lease(worker=self.worker_id, lease_seconds=self.lease_seconds)
+            if task is None:
+                if time.monotonic() - idle_since >= idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            self.process(task)
+            processed += 1
+            idle_since = time.monotonic()
+
+        logger.info("Worker %s finished. Tasks: %s", self.worker_id, processed)
+        return processed
+
+    def process(self, task: Task) -> None:
+        handler = self.handlers.get(task.kind)
+        if handler is None:
+            self.queue.fail(task, error=f"Unknown task kind: {task.kind}")
+            return
+
+        stop = threading.Event()
+        keeper = threading.Thread(target=self._keep_lease, args=(task, stop), daemon=True)
+        keeper.start()
+        try:
+            result = handler(task)
+        except Exception as e:
+            logger.error("Task %s (%s) failed: %r", task.task_id, task.kind, e)
+            self.queue.fail(task, error=repr(e))
+        else:
+            self.sink.write(task, result)
+            self.queue.ack(task)
+        finally:
+            stop.set()
+            keeper.join()
+
+    def _keep_lease(self, task: Task, stop: threading.Event) -> None:
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.queue.renew(task, lease_seconds=self.lease_seconds):
+                logger.warning("Lost the lease of task %s", task.task_id)
+                return
+
+    def _user_url(self, payload: Dict) -> str:
+        return f"{self.insta.BASE_URL}{payload['username']}/"
+
+    def _run_user_info(self, task: Task) -> Dict:
+        user = self.insta.get_user_info(url=self._user_url(task.payload),
+                                        fields=task.payload.get("fields"))
+        return dict(user)
+
+    def _run_content(self, task: Task) -> List:
+        data = get_data_by_content_type(self.insta, content_type=task.kind,
+                                        user_url=self._user_url(task.payload))
+        content = data.get(task.kind, [])
+
+        if task.payload.get("download") and content:
+            download_all(posts=content, content_type=task.kind,
+                         username=task.payload["username"],
+                         refresh=self.insta.refresh_media_links)
+
+        return [dict(item) for item in content]
@@ -0,0 +1,81 @@
+from typing import Dict, List, Optional
+
+from app.insta_crawler.authentication import Auth
+
+
+class FakeAuth(Auth):
+    """
+    Auth that does not go to Instagram, used by the offline tests.
+    """
+
+    def __init__(self, login: str, password: str, proxy: Optional[str] = None) -> None:
+        self.login = login
+        self.password = password
+        self.proxy = proxy
+
+    def _configure_cookies(self, cookies: List) -> Dict:
+        return {cookie["name"]: cookie["value"] for cookie in cookies}
+
+    def _process_auth(self) -> List:
+        return [{"name": "sessionid", "value": "fake"}]
+
+
+def make_post_node(shortcode: str, taken_at: int = 1600000000,
+                   owner: str = "someone") -> Dict:
+    return {
+        "shortcode": shortcode,
+        "display_url": f"https://cdn.example.com/{shortcode}.jpg",
+        "taken_at_timestamp": taken_at,
+        "owner": {"username": owner},
+        "edge_media_to_caption": {"edges": [{"node": {"text": f"caption {shortcode}"}}]},
+        "edge_media_preview_like": {"count": 10},
+        "edge_media_to_comment": {"count": 2},
+    }
+
+
+def make_user_payload(username: str = "someone", user_id: int = 42,
+                      posts: int = 12, is_private: bool = False) -> Dict:
+    return {
+        "graphql": {
+            "user": {
+                "biography": "bio",
+                "external_url": None,
+                "edge_followed_by": {"count": 100},
+                "edge_follow": {"count": 50},
+                "full_name": "Some One",
+                "highlight_reel_count": 1,
+                "id": str(user_id),
+                "is_business_account": False,
+                "business_category_name": None,
+                "category_name": None,
+                "is_private": is_private,
+                "username": username,
+                "edge_felix_video_timeline": {"count": 0},
+                "edge_owner_to_timeline_media": {
+                    "count": posts,
+                    "edges": [
+                        {"node": make_post_node(f"sc{i}", owner=username)}
+                        for i in range(min(posts, 12))
+                    ],
+                },
+                "profile_pic_url_hd": "https://cdn.example.com/pic.jpg",
+                "followed_by_viewer": False,
+            },
+        },
+    }
+
+
+def make_reel(user_id: int, username: str, storie_ids: List[int], taken_at: int) -> Dict:
+    return {
+        "id": user_id,
+        "user": {"username": username},
+        "items": [
+            {
+                "id": f"{storie_id}_{user_id}",
+                "media_type": 1,
+                "image_versions2": {"candidates": [{"url": f"https://cdn.example.com/{storie_id}.jpg"}]},
+                "taken_at": taken_at,
+            }
+            for storie_id in storie_ids
+        ],
+    }
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import List
+
+from app.insta_crawler import insta as i
+from app.insta_crawler.exceptions import AuthExpiredError
+import pytest
+from tests.fakes import FakeAuth
+
+
+class CountingAuth(FakeAuth):
+    logins = 0
+
+    def _process_auth(self) -> List:
+        CountingAuth.logins += 1
+        # a slow login, so concurrent threads would overlap
+        time.sleep(0.05)
+        return [{"name": "sessionid", "value": f"session{CountingAuth.logins}"}]
+
+
+class FakeResponse:
+    def __init__(self, url: str, data: dict, status_code: int = 200) -> None:
+        self.url = url
+        self.status_code = status_code
+        self.headers = {}
+        self._data = data
+
+    def json(self) -> dict:
+        return self._data
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    CountingAuth.logins = 0
+    return i.InstaCrawler(login="", password="", authenticator=CountingAuth)
+
+
+@pytest.mark.success
+def test_request_is_repeated_with_new_session(insta, monkeypatch):
+    sent = []
+
+    def get(url, params=None, cookies=None, **kwargs):
+        sent.append((params["after"], cookies["sessionid"]))
+        if cookies["sessionid"] == "session1":
+            return FakeResponse(url=f"{insta.BASE_URL}accounts/login/?next=/", data={})
+        return FakeResponse(url=url, data={"data": {"after": params["after"]}})
+
+    monkeypatch.setattr(i.requests, "get", get)
+
+    data = insta._make_request(url=insta.BASE_URL, params={"after": "cursor5"})
+
+    assert data == {"data": {"after": "cursor5"}}
+    assert sent == [("cursor5", "session1"), ("cursor5", "session2")]
+    assert insta.auth_generation == 1
+
+
+@pytest.mark.success
+def test_concurrent_requests_log_in_once(insta, monkeypatch):
+    barrier = threading.Barrier(4)
+
+    def get(url, params=None, cookies=None, **kwargs):
+        if cookies["sessionid"] == "session1":
+            barrier.wait(timeout=5)
+            return FakeResponse(url=url, data={"message": "login_required", "status": "fail"})
+        return FakeResponse(url=url, data={"ok": params["n"]})
+
+    monkeypatch.setattr(i.requests, "get", get)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda n: insta._make_request(url=insta.BASE_URL, params={"n": n}),
+                                    range(4)))
+
+    assert results == [{"ok": n} for n in range(4)]
+    assert CountingAuth.logins == 2
+
+
+@pytest.mark.failed
+def test_gives_up_when_login_does_not_help(insta, monkeypatch):
+    monkeypatch.setattr(i.requests, "get",
+                        lambda url, **kwargs:
+                        FakeResponse(url=url, data={}, status_code=401))
+
+    with pytest.raises(AuthExpiredError):
+        insta._make_request(url=insta.BASE_URL, params={})
+
+    assert CountingAuth.logins == 1 + insta.reauth_attempts
@@ -0,0 +1,72 @@
+from app.insta_crawler import insta as i
+import pytest
+from tests.fakes import FakeAuth, make_post_node, make_user_payload
+
+DAY = 24 * 60 * 60
+NOW = 1700000000
+
+
+def timeline_page(days: list, after: str = None) -> dict:
+    return {
+        "edges": [{"node": make_post_node(f"d{day}", taken_at=NOW - day * DAY)} for day in days],
+        "page_info": {"has_next_page": after is not None, "end_cursor": after},
+    }
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    pinned = make_post_node("pinned", taken_at=NOW - 900 * DAY)
+    pinned["pinned_for_users"] = [{"id": "42"}]
+    first = timeline_page([1, 2, 3], after="c1")
+    first["edges"].insert(0, {"node": pinned})
+    pages = {
+        "": first,
+        "c1": timeline_page([10, 20, 40], after="c2"),
+        "c2": timeline_page([50, 60], after="c3"),
+        "c3": timeline_page([70]),
+    }
+    followers = {
+        "": {"edges": [{"node": {"id": str(n), "username": f"f{n}"}} for n in range(50)],
+             "page_info": {"has_next_page": True, "end_cursor": "c1"}},
+        "c1": {"edges": [{"node": {"id": str(n), "username": f"f{n}"}} for n in range(50, 100)],
+               "page_info": {"has_next_page": True, "end_cursor": "c2"}},
+    }
+    insta.pages_requested = []
+
+    def make_request(url, params, headers=None):
+        if "query_hash" not in params:
+            return make_user_payload(posts=9)
+        insta.pages_requested.append(params["after"])
+        if params["query_hash"] == insta.followers_query_hash:
+            return {"data": {"user": {"edge_followed_by": followers[params["after"]]}}}
+        return {"data": {"user": {"edge_owner_to_timeline_media": pages[params["after"]]}}}
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    monkeypatch.setattr(i, "sleep", lambda seconds: None)
+    return insta
+
+
+@pytest.mark.success
+def test_since_stops_pagination(insta):
+    posts = insta.get_posts(url="https://www.instagram.com/someone/", since=NOW - 30 * DAY)
+
+    assert [post.shortcode for post in posts] == ["d1", "d2", "d3", "d10", "d20"]
+    assert insta.pages_requested == ["", "c1"]
+
+
+@pytest.mark.success
+def test_until_and_limit(insta):
+    posts = insta.get_posts(url="https://www.instagram.com/someone/", until=NOW - 5 * DAY, limit=3)
+
+    assert [post.shortcode for post in posts] == ["pinned", "d10", "d20"]
+    assert insta.pages_requested == ["", "c1"]
+
+
+@pytest.mark.success
+def test_followers_limit(insta):
+    followers = insta.get_followers(url="https://www.instagram.com/someone/", hydrate=False, limit=60)
+
+    assert followers["usernames"] == [f"f{n}" for n in range(60)]
+    assert len(followers["user_ids"]) == 60
+    assert insta.pages_requested == ["", "c1"]
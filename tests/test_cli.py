@@ -0,0 +1,80 @@
+import logging
+
+from app.cli import instagram as cli
+from app.insta_crawler import insta as i
+from click.testing import CliRunner
+import pytest
+from tests.fakes import FakeAuth, make_post_node, make_user_payload
+
+
+@pytest.fixture
+def requests_sent(monkeypatch, tmp_path):
+    """
+    A profile with 100 followers and 20 posts, 10 per page.
+    """
+    sent = []
+
+    def make_request(self, url, params, headers=None):
+        sent.append(params.get("after"))
+        if "query_hash" not in params:
+            return make_user_payload(username=url.rstrip("/").split("/")[-1], posts=20)
+
+        page = int(params["after"] or 0)
+        after = str(page + 1) if page < 9 else None
+        if params["query_hash"] == self.followers_query_hash:
+            edges = [{"node": {"id": str(n), "username": f"f{n}"}} for n in range(page * 10, page * 10 + 10)]
+            return {"data": {"user": {"edge_followed_by": {
+                "edges": edges, "page_info": {"has_next_page": after is not None, "end_cursor": after}}}}}
+        edges = [{"node": make_post_node(f"p{n}")} for n in range(page * 10, page * 10 + 10)]
+        return {"data": {"user": {"edge_owner_to_timeline_media": {
+            "edges": edges, "page_info": {"has_next_page": after is not None, "end_cursor": after}}}}}
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cli, "InstaAuth", FakeAuth)
+    monkeypatch.setattr(cli.config, "auth_method", "browser")
+    monkeypatch.setattr(cli.config, "login", "someone")
+    monkeypatch.setattr(cli.config, "password", "secret")
+    monkeypatch.setattr(i.InstaCrawler, "_make_request", make_request)
+    monkeypatch.setattr(i, "sleep", lambda seconds: None)
+    handlers = list(logging.getLogger().handlers)
+    yield sent
+    logging.getLogger().handlers = handlers
+
+
+@pytest.mark.success
+def test_followers_limit_from_the_cli(requests_sent):
+    result = CliRunner().invoke(cli.get_insta, ["followers", "--username=someone", "--limit=15"],
+                                input="n\nn\n")
+
+    assert result.exit_code == 0, result.output
+    assert "All done!" in result.output
+    # two pages of followers, not ten
+    assert [after for after in requests_sent if after is not None] == ["", "1"]
+
+
+@pytest.mark.success
+def test_category_limit_from_the_cli(requests_sent):
+    result = CliRunner().invoke(cli.get_insta, ["category", "--content-type=posts", "--username=someone",
+                                                "--limit=5"], input="n\nn\nn\n")
+
+    assert "All data has been collected" in result.output
+    # the first page is enough
+    assert [after for after in requests_sent if after is not None] == [""]
+
+
+@pytest.mark.success
+def test_user_info_logs_in_from_the_config(requests_sent):
+    result = CliRunner().invoke(cli.get_insta, ["user-info", "--username=someone"])
+
+    assert result.exit_code == 0, result.output
+    assert "There it is:" in result.output
+    assert "Some One" in result.output
+
+
+@pytest.mark.success
+def test_hedging_is_set_from_the_config(monkeypatch):
+    monkeypatch.setattr(cli.config, "proxies_file", None)
+    monkeypatch.setattr(cli.config, "cdn_proxies_file", None)
+    monkeypatch.setattr(cli.config, "hedge_after", 2.5)
+
+    assert cli._make_http_client().hedge_after == 2.5
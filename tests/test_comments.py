@@ -0,0 +1,76 @@
+from app.insta_crawler import insta as i
+import pytest
+from tests.fakes import FakeAuth
+
+
+def make_comment(comment_id: int, replies: int = 0, inline: int = 0, more: bool = False) -> dict:
+    node = {
+        "id": str(comment_id),
+        "text": f"text {comment_id}",
+        "created_at": 1600000000 + comment_id,
+        "owner": {"id": "7", "username": "fan"},
+        "edge_liked_by": {"count": 3},
+    }
+    if replies:
+        node["edge_threaded_comments"] = {
+            "count": replies,
+            "edges": [{"node": make_comment(comment_id * 100 + n)} for n in range(inline)],
+            "page_info": {"has_next_page": more, "end_cursor": "r1"},
+        }
+    return node
+
+
+def page(edges: list, after: str = None) -> dict:
+    return {"edges": edges, "page_info": {"has_next_page": after is not None, "end_cursor": after}}
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    comments = {
+        "": page([{"node": make_comment(1, replies=3, inline=1, more=True)}], after="c1"),
+        "c1": page([{"node": make_comment(2)}]),
+    }
+    replies = page([{"node": make_comment(n)} for n in (100, 101, 102)])
+    likers = page([{"node": {"id": str(n), "username": f"user{n}", "full_name": None, "is_private": False}}
+                   for n in range(3)])
+
+    def make_request(url, params, headers=None):
+        if params["query_hash"] == insta.comments_query_hash:
+            if params["shortcode"] == "broken":
+                return {"data": {"shortcode_media": None}}
+            return {"data": {"shortcode_media": {"edge_media_to_parent_comment": comments[params["after"]]}}}
+        if params["query_hash"] == insta.comment_replies_query_hash:
+            return {"data": {"comment": {"edge_threaded_comments": replies}}}
+        return {"data": {"shortcode_media": {"edge_liked_by": likers}}}
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    return insta
+
+
+@pytest.mark.success
+def test_comments_come_with_their_replies(insta):
+    comments = list(insta.iter_comments("abc"))
+
+    assert [(comment.comment_id, comment.parent_id) for comment in comments] == [
+        (1, None), (100, 1), (101, 1), (102, 1), (2, None)]
+    assert comments[0].replies_count == 3
+    assert comments[0].post_link == "https://www.instagram.com/p/abc/"
+
+
+@pytest.mark.success
+def test_replies_can_be_skipped(insta):
+    assert [comment.comment_id for comment in insta.iter_comments("abc", replies=False)] == [1, 2]
+
+
+@pytest.mark.success
+def test_likers(insta):
+    assert [liker.username for liker in insta.iter_likers("abc")] == ["user0", "user1", "user2"]
+
+
+@pytest.mark.success
+def test_comments_batch_skips_failed_posts(insta):
+    result = dict(insta.iter_comments_batch(["a", "broken", "b"], replies=False, workers=3))
+
+    assert sorted(result) == ["a", "b"]
+    assert len(result["a"]) == 2
@@ -0,0 +1,163 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+
+from app.insta_crawler import utils
+from app.insta_crawler.exceptions import IncompleteDownloadError
+from app.insta_crawler.models import Post
+import pytest
+
+BODY = bytes(range(256)) * 400
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    ranges = True
+    truncate = False
+    requested = []
+    busy = set()
+
+    def do_HEAD(self):
+        self.requested.append("HEAD")
+        self.send_error(405)
+
+    def do_GET(self):
+        header = self.headers.get("Range")
+        self.requested.append(header)
+        if self.path.startswith("/expired"):
+            self.send_error(403)
+            return
+        if self.path.startswith("/busy") and self.path not in self.busy:
+            self.busy.add(self.path)
+            self.send_error(503)
+            return
+        if header and self.ranges:
+            start, end = (int(value) for value in header.split("=")[1].split("-"))
+            body = BODY[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(BODY)}")
+        else:
+            body = BODY
+            self.send_response(200)
+            if self.ranges:
+                self.send_header("Accept-Ranges", "bytes")
+        if self.truncate:
+            body = body[:len(body) // 2]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "SEGMENTED_THRESHOLD", 10_000)
+    monkeypatch.setattr(utils, "SEGMENT_SIZE", 7_000)
+    RangeHandler.ranges, RangeHandler.truncate, RangeHandler.requested = True, False, []
+    RangeHandler.busy = set()
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/video.mp4"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.success
+def test_large_file_is_downloaded_in_ranges(server):
+    path = utils.download_file(url=server, content_type="igtv", username="someone", name="v.mp4")
+
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    # the first segment comes with the GET that gave the size
+    assert RangeHandler.requested[0] is None
+    assert len(RangeHandler.requested) == len(range(0, len(BODY), 7_000))
+    assert all(header.startswith("bytes=") for header in RangeHandler.requested[1:])
+    assert not os.path.exists(f"{path}.part")
+
+
+@pytest.mark.success
+def test_no_range_support_falls_back_to_one_stream(server):
+    RangeHandler.ranges = False
+
+    path = utils.download_file(url=server, content_type="igtv", username="someone", name="v.mp4")
+
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert RangeHandler.requested == [None]
+
+
+@pytest.mark.success
+def test_small_file_is_one_get(server, monkeypatch):
+    monkeypatch.setattr(utils, "SEGMENTED_THRESHOLD", len(BODY) + 1)
+    base = server.rsplit("/", 1)[0]
+
+    path = utils.download_file(url=f"{base}/a.jpg", content_type="posts", username="someone", name="a.png")
+
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert RangeHandler.requested == [None]
+
+
+@pytest.mark.failed
+def test_short_range_is_not_kept(server):
+    RangeHandler.truncate = True
+
+    with pytest.raises(IncompleteDownloadError):
+        utils.download_file(url=server, content_type="igtv", username="someone", name="v.mp4")
+
+    assert os.listdir(os.path.join("downloads", "someone", "igtv")) == []
+
+
+def make_post(shortcode: str, links: list) -> Post:
+    return Post(likes=0, comments=0, owner_link="", owner_username="someone", post_content=links,
+                post_content_len=len(links), posted_at=0, shortcode=shortcode, post_link=f"/p/{shortcode}/")
+
+
+@pytest.mark.success
+def test_expired_links_are_refreshed_at_once(server):
+    base = server.rsplit("/", 1)[0]
+    posts = [
+        make_post("a", [f"{base}/expired/a.jpg", f"{base}/a2.jpg"]),
+        # past its "oe" expiry, not even requested
+        make_post("b", [f"{base}/b.jpg?oe=5F000000"]),
+        make_post("c", [f"{base}/expired/c.jpg"]),
+    ]
+    refreshed = []
+
+    def refresh(items, content_type):
+        refreshed.append([item.shortcode for item in items])
+        # the post c was deleted meanwhile
+        return {"a": [f"{base}/a.jpg", f"{base}/a2.jpg"], "b": [f"{base}/b.jpg"]}
+
+    failed = utils.download_all(posts=posts, content_type="posts", username="someone",
+                                refresh=refresh, progress=False)
+
+    assert refreshed == [["a", "b", "c"]]
+    assert sorted(os.listdir(os.path.join("downloads", "someone", "posts"))) == [
+        "someone_posts_a_01.png", "someone_posts_a_02.png", "someone_posts_b_01.png"]
+    assert [(item["name"], item["error"]) for item in failed] == [("someone_posts_c_01.png", "the media is gone")]
+
+
+@pytest.mark.failed
+def test_expired_links_are_reported_without_refresh(server):
+    base = server.rsplit("/", 1)[0]
+
+    failed = utils.download_all(posts=[make_post("a", [f"{base}/expired/a.jpg"])], content_type="posts",
+                                username="someone", progress=False)
+
+    assert [item["error"] for item in failed] == ["HTTP 403"]
+
+
+@pytest.mark.success
+def test_busy_server_is_tried_again(server):
+    base = server.rsplit("/", 1)[0]
+
+    failed = utils.download_all(posts=[make_post("a", [f"{base}/busy/a.jpg"])], content_type="posts",
+                                username="someone", progress=False)
+
+    assert failed == []
+    assert os.listdir(os.path.join("downloads", "someone", "posts")) == ["someone_posts_a_01.png"]
@@ -0,0 +1,116 @@
+from app.insta_crawler import feeds as f
+from app.insta_crawler import insta as i
+from app.insta_crawler.exceptions import BlockedByInstagramError, NotFoundError
+import pytest
+from tests.fakes import FakeAuth, make_post_node
+
+
+def feed_page(shortcodes: list, after: str = None) -> dict:
+    return {
+        "edges": [{"node": {"shortcode": shortcode, "owner": {"id": "1"}}} for shortcode in shortcodes],
+        "page_info": {"has_next_page": after is not None, "end_cursor": after},
+    }
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    feeds = {
+        ("cats", ""): feed_page(["a", "b"], after="c1"),
+        ("cats", "c1"): feed_page(["c"]),
+        ("pets", ""): feed_page(["b", "c", "d", "gone"]),
+        ("123", ""): feed_page(["a", "e"]),
+    }
+    insta.requested = []
+
+    def make_request(url, params, headers=None):
+        if "query_hash" in params:
+            name = params.get("tag_name") or params.get("id")
+            root, edge = (("hashtag", "edge_hashtag_to_media") if "tag_name" in params
+                          else ("location", "edge_location_to_media"))
+            return {"data": {root: {edge: feeds[(name, params["after"])]}}}
+
+        shortcode = url.rstrip("/").split("/")[-1]
+        insta.requested.append(shortcode)
+        if shortcode == "gone":
+            raise NotFoundError()
+        node = make_post_node(shortcode, owner="someone")
+        node["is_video"] = False
+        node["edge_media_preview_comment"] = {"count": 1}
+        return {"graphql": {"shortcode_media": node}}
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    monkeypatch.setattr(i, "sleep", lambda seconds: None)
+    return insta
+
+
+@pytest.mark.success
+def test_posts_of_overlapping_feeds_are_hydrated_once(insta, tmp_path, monkeypatch):
+    downloaded = []
+    monkeypatch.setattr(f, "download_all",
+                        lambda posts, content_type, username, **kwargs:
+                        downloaded.extend(post.shortcode for post in posts) or [])
+    index = f.ShortcodeIndex(path=str(tmp_path / "index.sqlite"))
+    crawler = f.FeedCrawler(insta=insta, index=index)
+
+    posts = list(crawler.crawl(hashtags=["#Cats", "pets"], locations=["123"]))
+
+    assert [post.shortcode for post in posts] == ["a", "b", "c", "d", "e"]
+    assert insta.requested == ["a", "b", "c", "d", "gone", "e"]
+    assert downloaded == ["a", "b", "c", "d", "e"]
+    assert index.sources("a") == ["hashtag:cats", "location:123"]
+    assert crawler.stats["hashtag:pets"].failed == 1
+    assert index.stats() == {"posts": 5, "downloaded": 5, "feed_links": 9}
+
+
+@pytest.mark.success
+def test_index_is_shared_between_crawls(insta, tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    first = f.FeedCrawler(insta=insta, index=f.ShortcodeIndex(path=path), download=False, max_pages=1)
+    second = f.FeedCrawler(insta=insta, index=f.ShortcodeIndex(path=path), download=False)
+
+    assert [post.shortcode for post in first.crawl(hashtags=["cats"])] == ["a", "b"]
+    assert [post.shortcode for post in second.crawl(hashtags=["cats"])] == ["c"]
+
+
+@pytest.mark.success
+def test_stopped_crawl_leaves_the_rest_of_the_page(insta, tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    first = f.FeedCrawler(insta=insta, index=f.ShortcodeIndex(path=path), download=False)
+    posts = first.crawl(hashtags=["cats"])
+    assert next(posts).shortcode == "a"
+    posts.close()
+
+    second = f.FeedCrawler(insta=insta, index=f.ShortcodeIndex(path=path), download=False)
+    assert [post.shortcode for post in second.crawl(hashtags=["cats"])] == ["b", "c"]
+
+
+@pytest.mark.failed
+def test_blocked_hydration_releases_the_claim(insta, tmp_path, monkeypatch):
+    index = f.ShortcodeIndex(path=str(tmp_path / "index.sqlite"))
+    monkeypatch.setattr(insta, "get_single_post", lambda url: (_ for _ in ()).throw(BlockedByInstagramError()))
+
+    with pytest.raises(BlockedByInstagramError):
+        list(f.FeedCrawler(insta=insta, index=index, download=False).crawl(hashtags=["cats"]))
+    assert index.stats()["posts"] == 0
+
+
+@pytest.mark.failed
+def test_posts_not_downloaded_are_claimed_again(insta, tmp_path, monkeypatch):
+    failing = {"b"}
+    monkeypatch.setattr(f, "download_all",
+                        lambda posts, content_type, username, **kwargs:
+                        [post for post in posts if post.shortcode in failing])
+    index = f.ShortcodeIndex(path=str(tmp_path / "index.sqlite"))
+
+    first = list(f.FeedCrawler(insta=insta, index=index).crawl(hashtags=["cats"]))
+    assert index.stats() == {"posts": 3, "downloaded": 2, "feed_links": 3}
+
+    failing.clear()
+    # a recent claim may still be worked on by another crawl
+    assert list(f.FeedCrawler(insta=insta, index=index).crawl(hashtags=["cats"])) == []
+    retried = list(f.FeedCrawler(insta=insta, index=index, reclaim_after=0).crawl(hashtags=["cats"]))
+
+    assert [post.shortcode for post in first] == ["a", "b", "c"]
+    assert [post.shortcode for post in retried] == ["b"]
+    assert index.stats()["downloaded"] == 3
@@ -0,0 +1,137 @@
+from app.insta_crawler.graph import BloomFilter, GraphCrawler, load_csr, VisitedSet
+import pytest
+
+FOLLOWERS = {
+    1: [2, 3],
+    2: [1, 4],
+    3: [5],
+    4: [],
+    5: [6],
+}
+
+
+class FakeCrawler:
+    BASE_URL = "https://www.instagram.com/"
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.expanded = []
+
+    def get_user_info(self, url, fields=None):
+        class User:
+            user_id = 1
+            username = "u1"
+        return User()
+
+    def iter_follow_pages(self, user_id, relation):
+        self.expanded.append(user_id)
+        followers = FOLLOWERS.get(user_id, [])
+        # one page per follower to check the budget
+        for number, follower in enumerate(followers or [None], start=1):
+            self.requests += 1
+            edges = [] if follower is None else [{"node": {"id": str(follower), "username": f"u{follower}"}}]
+            yield {"edges": edges, "page_info": {"has_next_page": number < len(followers)}}
+
+
+@pytest.mark.success
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for item in range(0, 2000, 2):
+        bloom.add(item)
+
+    assert all(item in bloom for item in range(0, 2000, 2))
+    false_positives = sum(item in bloom for item in range(1, 20001, 2))
+    assert false_positives < 1000
+
+
+@pytest.mark.success
+def test_visited_set(tmp_path):
+    visited = VisitedSet(path=str(tmp_path / "visited.sqlite"), capacity=100)
+    assert visited.add_many([1, 2, 2, 3]) == [1, 2, 3]
+    assert visited.add_many([3, 4]) == [4]
+    assert 4 in visited and 5 not in visited
+    visited.close()
+
+    reopened = VisitedSet(path=str(tmp_path / "visited.sqlite"), capacity=100)
+    assert reopened.count == 4
+    assert 2 in reopened
+
+
+@pytest.mark.success
+def test_graph_crawl_writes_csr(tmp_path):
+    crawler = GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path),
+                           relations=["followers"], max_depth=2)
+    stats = crawler.crawl(seeds=["u1"])
+
+    graph = load_csr(stats["files"]["followers"])
+    assert list(graph.rows) == [1, 2, 3]
+    assert sorted(graph.edges()) == [(1, 2), (1, 3), (2, 1), (2, 4), (3, 5)]
+    assert stats["nodes"] == 5
+    assert (tmp_path / "nodes.tsv").read_text().splitlines()[0] == "1\tu1"
+
+
+@pytest.mark.success
+def test_graph_crawl_budget(tmp_path):
+    insta = FakeCrawler()
+    crawler = GraphCrawler(insta=insta, output_dir=str(tmp_path), relations=["followers"],
+                           max_depth=5, max_requests=3)
+    stats = crawler.crawl(seeds=["u1"])
+
+    assert stats["requests"] == 3
+    assert insta.requests == 2
+
+
+@pytest.mark.success
+def test_graph_crawl_budget_keeps_a_cut_node(tmp_path):
+    stats = GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path), relations=["followers"],
+                         max_depth=5, max_requests=2).crawl(seeds=["u1"])
+
+    assert stats["budget_exhausted"]
+    assert stats["expanded"] == 0
+    assert list(load_csr(stats["files"]["followers"]).rows) == []
+
+    insta = FakeCrawler()
+    resumed = GraphCrawler(insta=insta, output_dir=str(tmp_path), relations=["followers"],
+                           max_depth=1, resume=True).crawl(seeds=["u1"])
+    assert insta.expanded == [1]
+    assert sorted(load_csr(resumed["files"]["followers"]).edges()) == [(1, 2), (1, 3)]
+
+
+@pytest.mark.failed
+def test_graph_crawl_rerun_needs_resume_or_overwrite(tmp_path):
+    GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path), relations=["followers"]).crawl(seeds=["u1"])
+    before = (tmp_path / "followers.csr").read_bytes()
+
+    with pytest.raises(FileExistsError):
+        GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path), relations=["followers"]).crawl(seeds=["u1"])
+    assert (tmp_path / "followers.csr").read_bytes() == before
+
+
+@pytest.mark.success
+def test_graph_crawl_resume(tmp_path):
+    full = GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path / "full"), relations=["followers"],
+                        max_depth=2).crawl(seeds=["u1"])
+
+    first = GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path / "cut"), relations=["followers"],
+                         max_depth=2, max_requests=3).crawl(seeds=["u1"])
+    assert first["budget_exhausted"]
+    resumed = GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path / "cut"), relations=["followers"],
+                           max_depth=2, resume=True).crawl(seeds=["u1"])
+
+    graph = load_csr(resumed["files"]["followers"])
+    assert list(graph.rows) == list(load_csr(full["files"]["followers"]).rows)
+    assert sorted(graph.edges()) == [(1, 2), (1, 3), (2, 1), (2, 4), (3, 5)]
+    assert resumed["nodes"] == full["nodes"]
+    nodes = (tmp_path / "cut" / "nodes.tsv").read_text().splitlines()
+    assert len(nodes) == len(set(nodes)) == full["nodes"]
+
+
+@pytest.mark.success
+def test_graph_crawl_overwrite(tmp_path):
+    GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path), relations=["followers"],
+                 max_depth=2).crawl(seeds=["u1"])
+    stats = GraphCrawler(insta=FakeCrawler(), output_dir=str(tmp_path), relations=["followers"],
+                         max_depth=1, overwrite=True).crawl(seeds=["u1"])
+
+    assert list(load_csr(stats["files"]["followers"]).rows) == [1]
+    assert len((tmp_path / "nodes.tsv").read_text().splitlines()) == stats["nodes"] == 3
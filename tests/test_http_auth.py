@@ -0,0 +1,91 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from urllib.parse import parse_qs
+
+from app.insta_crawler.authentication import HttpAuth
+from app.insta_crawler.exceptions import LoginError
+import pytest
+
+
+class FakeInstagram(BaseHTTPRequestHandler):
+    """
+    Stand-in for the login page and the login endpoint.
+    """
+    password = "secret"
+    posted = []
+
+    def do_GET(self):
+        body = b'<script>window._sharedData = {"config": {"csrf_token": "token123"}};</script>'
+        self.send_response(200)
+        self.send_header("Set-Cookie", "mid=mid1; Path=/")
+        self.send_header("Set-Cookie", "ig_did=did1; Path=/")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        form = {key: values[0] for key, values in
+                parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode()).items()}
+        FakeInstagram.posted.append((self.headers["X-CSRFToken"], form))
+
+        if form["username"] != "someone":
+            data = {"authenticated": False, "user": False}
+        elif form["enc_password"].endswith(":checkpoint"):
+            data = {"message": "checkpoint_required", "checkpoint_url": "/challenge/1/"}
+        elif not form["enc_password"].endswith(f":{self.password}"):
+            data = {"authenticated": False, "user": True}
+        else:
+            data = {"authenticated": True, "user": True, "userId": "42"}
+
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        if data.get("authenticated"):
+            self.send_header("Set-Cookie", "sessionid=session1; Path=/")
+            self.send_header("Set-Cookie", "ds_user_id=42; Path=/")
+            self.send_header("Set-Cookie", "csrftoken=token456; Path=/")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    FakeInstagram.posted = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeInstagram)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def make_auth(base_url: str, login: str = "someone", password: str = "secret") -> HttpAuth:
+    auth = HttpAuth(login=login, password=password)
+    auth.base_url = base_url
+    auth.user_agent = "test-agent"
+    return auth
+
+
+@pytest.mark.success
+def test_login_gives_the_session_cookies(base_url):
+    cookies = make_auth(base_url).get_cookies()
+
+    assert cookies == {"mid": "mid1", "ig_did": "did1", "sessionid": "session1", "ds_user_id": "42"}
+    csrf_token, form = FakeInstagram.posted[0]
+    # the token comes from the page when there is no csrftoken cookie
+    assert csrf_token == "token123"
+    assert form["enc_password"].startswith("#PWD_INSTAGRAM_BROWSER:0:")
+
+
+@pytest.mark.failed
+@pytest.mark.parametrize("login, password, message", [
+    ("someone", "wrong", "Wrong password"),
+    ("nobody", "secret", "no account"),
+    ("someone", "checkpoint", "/challenge/1/"),
+])
+def test_refused_login_raises(base_url, login, password, message):
+    with pytest.raises(LoginError, match=message):
+        make_auth(base_url, login=login, password=password).get_cookies()
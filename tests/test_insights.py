@@ -0,0 +1,75 @@
+import json
+import statistics
+
+from app.insta_crawler.insights import compute_insights, PostsTable
+import numpy as np
+import pytest
+
+HOUR = 60 * 60
+
+
+def make_record(owner: str, number: int, likes: int, comments: int, posted_at: int) -> dict:
+    return {"owner_username": owner, "shortcode": f"{owner}{number}", "likes": likes, "comments": comments,
+            "posted_at": posted_at, "post_content_len": 1 + number % 3}
+
+
+@pytest.fixture
+def records() -> list:
+    rng = np.random.default_rng(7)
+    records = []
+    for owner, gap in (("daily", 24 * HOUR), ("hourly", HOUR), ("weekly", 7 * 24 * HOUR)):
+        for number in range(40):
+            likes = int(rng.integers(90, 110))
+            records.append(make_record(owner, number, likes=likes, comments=10, posted_at=number * gap))
+    # a viral post, and the order of the records does not matter
+    records[5]["likes"] = 5000
+    return records[::-1]
+
+
+@pytest.mark.success
+def test_metrics_match_a_loop_over_profiles(records):
+    followers = {"daily": 1000, "hourly": 2000}
+    insights = compute_insights(PostsTable.from_records(records, followers=followers), window=5)
+    summary = {profile["username"]: profile for profile in insights.summary()}
+
+    for owner in ("daily", "hourly"):
+        posts = sorted((record for record in records if record["owner_username"] == owner),
+                       key=lambda record: record["posted_at"])
+        rates = [(post["likes"] + post["comments"]) / followers[owner] for post in posts]
+        gaps = [second["posted_at"] - first["posted_at"] for first, second in zip(posts, posts[1:])]
+
+        assert summary[owner]["engagement_rate"] == pytest.approx(statistics.mean(rates), abs=1e-6)
+        assert summary[owner]["median_gap_hours"] == pytest.approx(statistics.median(gaps) / HOUR)
+        assert summary[owner]["rolling"][-1] == pytest.approx(statistics.mean(rates[-5:]), abs=1e-6)
+        assert summary[owner]["rolling"][1] == pytest.approx(statistics.mean(rates[:2]), abs=1e-6)
+
+    assert summary["daily"]["posts_per_week"] == pytest.approx(7)
+    assert summary["daily"]["outliers"] == ["daily5"]
+    assert summary["hourly"]["outliers"] == []
+
+
+@pytest.mark.success
+def test_unknown_followers_and_exports(records, tmp_path):
+    export = tmp_path / "weekly_data.json"
+    export.write_text(json.dumps({
+        "posts": [record for record in records if record["owner_username"] == "weekly"],
+        "followers": [{"username": "someone", "followed_by": 10}],
+    }))
+
+    summary = compute_insights(PostsTable.from_exports([str(export)])).summary()
+
+    assert [profile["username"] for profile in summary] == ["weekly"]
+    assert summary[0]["engagement_rate"] is None
+    assert summary[0]["posts"] == 40
+    assert summary[0]["posts_per_week"] == pytest.approx(1)
+    # the rolling mean falls back to likes and comments
+    assert 100 <= summary[0]["rolling"][-1] <= 120
+
+
+@pytest.mark.success
+def test_no_posts(tmp_path):
+    assert compute_insights(PostsTable.from_records([])).summary() == []
+
+    export = tmp_path / "stories_data.json"
+    export.write_text(json.dumps({"stories": []}))
+    assert compute_insights(PostsTable.from_exports([str(export)])).summary() == []
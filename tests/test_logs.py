@@ -0,0 +1,91 @@
+import json
+import logging
+import threading
+
+from app.insta_crawler import insta as i
+from app.insta_crawler.logs import JsonFormatter, SamplingFilter, setup_logging
+import pytest
+from tests.fakes import FakeAuth
+
+
+class ThreadName:
+    """
+    Remembers the thread it was formatted in.
+    """
+    formatted_in = None
+
+    def __str__(self) -> str:
+        ThreadName.formatted_in = threading.current_thread().name
+        return "value"
+
+
+def make_record(level: int = logging.DEBUG, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("test", level, __file__, 1, "Request to %s", ("url",), None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.mark.success
+def test_json_lines_have_the_extra_fields():
+    line = JsonFormatter().format(make_record(endpoint="www.instagram.com/profile", latency=0.25))
+    data = json.loads(line)
+
+    assert data["message"] == "Request to url"
+    assert data["endpoint"] == "www.instagram.com/profile"
+    assert data["latency"] == 0.25
+    assert "args" not in data
+
+
+@pytest.mark.success
+def test_categories_are_sampled():
+    sampling = SamplingFilter({"request": 0.25, "muted": 0})
+    kept = [sampling.filter(make_record(category="request")) for _ in range(8)]
+
+    assert kept == [True, False, False, False] * 2
+    assert not sampling.filter(make_record(category="muted"))
+    assert sampling.filter(make_record(logging.WARNING, category="muted"))
+    assert sampling.filter(make_record(category="other"))
+
+
+@pytest.mark.success
+def test_records_are_written_by_the_listener(tmp_path):
+    path = tmp_path / "crawl.log"
+    logger = logging.getLogger("tests.logs")
+    listener = setup_logging(path=str(path), level=logging.DEBUG, sample={"request": 0.5}, logger=logger)
+    try:
+        for number in range(4):
+            logger.debug("Page %s of %s", number, ThreadName(), extra={"category": "request", "cursor": number})
+        logger.info("Done")
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line.get("cursor") for line in lines] == [0, 2, None]
+    assert lines[0]["message"] == "Page 0 of value"
+    # the message was formatted by the listener, not the caller
+    assert ThreadName.formatted_in != threading.current_thread().name
+
+
+@pytest.mark.success
+def test_crawler_leaves_logging_alone(caplog):
+    handlers = list(logging.getLogger().handlers)
+    with caplog.at_level(logging.DEBUG):
+        i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+
+    assert logging.getLogger().handlers == handlers
+    # the names of the cookies are logged, not the session
+    assert "sessionid" in caplog.text
+    assert "fake" not in caplog.text
+
+
+@pytest.mark.success
+def test_requests_are_logged_with_fields(caplog, monkeypatch):
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    monkeypatch.setattr(insta, "_request_json", lambda url, params, headers: {})
+    with caplog.at_level(logging.DEBUG, logger="app.insta_crawler.insta"):
+        insta._make_request(url="https://www.instagram.com/someone/", params={"after": "cursor5"})
+
+    record = [record for record in caplog.records if getattr(record, "category", None) == "request"][0]
+    assert (record.endpoint, record.user, record.cursor) == ("www.instagram.com/profile", "someone", "cursor5")
+    assert record.latency >= 0
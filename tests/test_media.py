@@ -0,0 +1,90 @@
+from app.insta_crawler import insta as i
+from app.insta_crawler.media import MediaPolicy
+import pytest
+from tests.fakes import FakeAuth, make_post_node, make_reel
+
+
+def make_resources(shortcode: str) -> list:
+    return [
+        {"src": f"https://cdn.example.com/{shortcode}_{size}.jpg",
+         "config_width": size, "config_height": size}
+        for size in (640, 750, 1080)
+    ]
+
+
+def make_video_node(shortcode: str) -> dict:
+    node = make_post_node(shortcode)
+    node["video_url"] = f"https://cdn.example.com/{shortcode}.mp4"
+    node["display_resources"] = make_resources(shortcode)
+    node["thumbnail_resources"] = [
+        {"src": f"https://cdn.example.com/{shortcode}_150.jpg", "config_width": 150, "config_height": 150},
+    ]
+    return node
+
+
+def make_storie_item(media_type: int = 2) -> dict:
+    return {
+        "media_type": media_type,
+        "image_versions2": {"candidates": [
+            {"url": "https://cdn.example.com/s_1080.jpg", "width": 1080, "height": 1920},
+            {"url": "https://cdn.example.com/s_480.jpg", "width": 480, "height": 853},
+        ]},
+        "video_versions": [
+            {"url": "https://cdn.example.com/s_720.mp4", "width": 720, "height": 1280},
+            {"url": "https://cdn.example.com/s_480.mp4", "width": 480, "height": 853},
+        ],
+    }
+
+
+@pytest.mark.success
+def test_default_policy_keeps_full_size_media():
+    policy = MediaPolicy()
+
+    assert policy.pick_node(make_video_node("v")) == "https://cdn.example.com/v.mp4"
+    assert policy.pick_node(make_post_node("p")) == "https://cdn.example.com/p.jpg"
+    assert policy.pick_storie(make_storie_item()) == "https://cdn.example.com/s_720.mp4"
+    assert policy.pick_storie(make_storie_item(media_type=1)) == "https://cdn.example.com/s_1080.jpg"
+
+
+@pytest.mark.success
+def test_max_dimension_takes_biggest_fitting_rendition():
+    node = make_post_node("p")
+    node["display_resources"] = make_resources("p")
+
+    assert MediaPolicy(max_dimension=800).pick_node(node) == "https://cdn.example.com/p_750.jpg"
+    assert MediaPolicy(max_dimension=100).pick_node(node) == "https://cdn.example.com/p_640.jpg"
+    assert MediaPolicy(max_dimension=1000).pick_storie(make_storie_item()) == "https://cdn.example.com/s_480.mp4"
+
+
+@pytest.mark.success
+def test_image_policies_skip_videos():
+    node = make_video_node("v")
+
+    assert MediaPolicy(prefer_image=True).pick_node(node) == "https://cdn.example.com/v_1080.jpg"
+    assert MediaPolicy(thumbnails_only=True).pick_node(node) == "https://cdn.example.com/v_150.jpg"
+    assert MediaPolicy(prefer_image=True).pick_storie(make_storie_item()) == "https://cdn.example.com/s_1080.jpg"
+    # nodes without renditions fall back to the display url
+    assert MediaPolicy(thumbnails_only=True).pick_node(make_post_node("p")) == "https://cdn.example.com/p.jpg"
+
+
+@pytest.mark.success
+def test_crawler_applies_policy_to_posts():
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth,
+                           media_policy=MediaPolicy(prefer_image=True))
+    node = make_video_node("v")
+    node["product_type"] = "igtv"
+
+    assert insta.forming_timeline_post_data(post_data=make_video_node("v")).post_content == [
+        "https://cdn.example.com/v_1080.jpg"]
+    assert insta._collect_post_content(post=node) == ["https://cdn.example.com/v_1080.jpg"]
+
+
+@pytest.mark.failed
+def test_stories_without_media_are_skipped():
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    reel = make_reel(1, "someone", [10, 11], taken_at=0)
+    reel["items"][0]["image_versions2"] = {"candidates": []}
+
+    stories = insta._forming_stories(reel)
+
+    assert [storie.post_link for storie in stories] == ["https://www.instagram.com/stories/someone/11_1"]
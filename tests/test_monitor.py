@@ -0,0 +1,103 @@
+from app.insta_crawler import insta as i
+from app.insta_crawler import monitor as m
+from app.insta_crawler.exceptions import BlockedByInstagramError
+from app.insta_crawler.monitor import DAY, HOUR, PostsMonitor
+import pytest
+from tests.fakes import FakeAuth, make_post_node, make_user_payload
+
+NOW = 1700000000
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    insta.requests = []
+    insta.timelines = {}
+
+    def make_request(url, params, headers=None):
+        username = url.rstrip("/").split("/")[-1]
+        insta.requests.append(username)
+        payload = make_user_payload(username=username)
+        payload["graphql"]["user"]["edge_owner_to_timeline_media"]["edges"] = [
+            {"node": make_post_node(f"{username}_{taken_at}", taken_at=taken_at, owner=username)}
+            for taken_at in insta.timelines[username]
+        ]
+        return payload
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    return insta
+
+
+@pytest.mark.success
+def test_active_profiles_are_polled_more_often(insta, tmp_path):
+    insta.timelines = {
+        "hourly": [NOW - hour * HOUR for hour in range(12)],
+        "dormant": [NOW - 200 * DAY - month * 30 * DAY for month in range(12)],
+    }
+    monitor = PostsMonitor(insta=insta, usernames=["hourly", "dormant"],
+                           state_path=str(tmp_path / "monitor.json"), budget=10)
+
+    assert monitor.poll_due(now=NOW) == []
+    intervals = monitor.intervals(now=NOW)
+
+    assert intervals["hourly"] < intervals["dormant"]
+    # the watchlist spends the budget of 10 requests per hour
+    assert sum(HOUR / interval for interval in intervals.values()) == pytest.approx(10, rel=0.01)
+    assert monitor.next_poll["hourly"] == pytest.approx(NOW + intervals["hourly"])
+
+
+@pytest.mark.success
+def test_only_new_posts_are_reported(insta, tmp_path):
+    state_path = str(tmp_path / "monitor.json")
+    insta.timelines = {"someone": [NOW - day * DAY for day in range(1, 13)]}
+    PostsMonitor(insta=insta, usernames=["someone"], state_path=state_path).poll_due(now=NOW)
+
+    # a new post and an old post pinned to the top
+    insta.timelines["someone"] = [NOW - 50 * DAY, NOW + HOUR] + insta.timelines["someone"][:10]
+    monitor = PostsMonitor(insta=insta, usernames=["someone"], state_path=state_path)
+    later = monitor.next_poll["someone"]
+
+    assert monitor.poll_due(now=later - 1) == []
+    assert [post.shortcode for post in monitor.poll_due(now=later)] == [f"someone_{NOW + HOUR}"]
+    assert insta.requests == ["someone", "someone"]
+
+
+@pytest.mark.success
+def test_intervals_are_clamped(insta, tmp_path):
+    monitor = PostsMonitor(insta=insta, usernames=[f"u{n}" for n in range(3)],
+                           state_path=str(tmp_path / "monitor.json"),
+                           budget=1000, min_interval=600, max_interval=DAY)
+
+    # with a budget larger than needed, all are polled at the shortest
+    # interval
+    assert set(monitor.intervals(now=NOW).values()) == {600}
+
+    monitor.budget = 0.01
+    assert set(monitor.intervals(now=NOW).values()) == {DAY}
+
+
+@pytest.mark.failed
+def test_watch_backs_off_after_failed_polls(insta, tmp_path, monkeypatch):
+    monitor = PostsMonitor(insta=insta, usernames=["someone"], state_path=str(tmp_path / "monitor.json"),
+                           min_interval=60, max_interval=100)
+    sleeps = []
+    monkeypatch.setattr(monitor, "poll_due", lambda: (_ for _ in ()).throw(BlockedByInstagramError()))
+    monkeypatch.setattr(m.time, "sleep", sleeps.append)
+
+    monitor.watch(on_new=print, cycles=4)
+
+    assert sleeps == [60, 100, 100]
+
+
+@pytest.mark.success
+def test_users_off_the_watchlist_are_forgotten(insta, tmp_path, monkeypatch):
+    state_path = str(tmp_path / "monitor.json")
+    insta.timelines = {"someone": [NOW - HOUR], "gone": [NOW - HOUR]}
+    monkeypatch.setattr(m.time, "time", lambda: NOW)
+    PostsMonitor(insta=insta, usernames=["someone", "gone"], state_path=state_path).poll_due()
+
+    monitor = PostsMonitor(insta=insta, usernames=["someone"], state_path=state_path, min_interval=60)
+    monitor.next_poll["someone"] = NOW + 600
+
+    assert set(monitor.next_poll) == {"someone"}
+    assert monitor._sleep_time(failures=0) == 600
@@ -0,0 +1,86 @@
+import json
+import sqlite3
+
+from app.insta_crawler import insta as i
+from app.insta_crawler import pipeline as pl
+from app.insta_crawler.search import SearchIndex
+from app.insta_crawler import utils
+import pytest
+from tests.fakes import FakeAuth, make_post_node, make_user_payload
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    pages = [
+        {"edges": [{"node": make_post_node(f"a{n}")} for n in range(3)],
+         "page_info": {"has_next_page": True, "end_cursor": "c1"}},
+        {"edges": [{"node": make_post_node(f"b{n}")} for n in range(2)],
+         "page_info": {"has_next_page": False}},
+    ]
+
+    def make_request(url, params, headers=None):
+        if "query_hash" in params:
+            page = pages[1] if params["after"] else pages[0]
+            return {"data": {"user": {"edge_owner_to_timeline_media": page}}}
+        return make_user_payload()
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    monkeypatch.setattr(i, "sleep", lambda seconds: None)
+    return insta
+
+
+@pytest.mark.success
+def test_pipeline_stores_and_downloads(insta, tmp_path, monkeypatch):
+    downloaded = []
+    monkeypatch.setattr(utils, "download_file",
+                        lambda url, content_type, username, name: downloaded.append(name))
+    sink = pl.JSONLinesSink(path=str(tmp_path / "data.jsonl"))
+
+    stats = pl.Pipeline(insta=insta, username="someone", content_types=["posts"], sinks=[sink],
+                        queue_size=1, download_workers=2).run()
+
+    records = [json.loads(line) for line in (tmp_path / "data.jsonl").read_text().splitlines()]
+    assert [record["shortcode"] for record in records] == ["a0", "a1", "a2", "b0", "b1"]
+    assert stats["parsed"] == stats["stored"] == stats["downloaded"] == 5
+    assert sorted(downloaded)[0] == "someone_posts_a0_01.png"
+
+
+@pytest.mark.success
+def test_pipeline_indexes_the_profile(insta, tmp_path):
+    index = SearchIndex(path=str(tmp_path / "search.sqlite"))
+
+    stats = pl.Pipeline(insta=insta, username="someone", content_types=["posts"],
+                        sinks=[pl.SearchSink(index=index)], download=False).run()
+
+    assert stats["stored"] == 5
+    assert index.stats() == {"posts": 5, "users": 1}
+    assert [hit.key for hit in index.search("some", kind="users")] == ["someone"]
+
+
+@pytest.mark.success
+def test_sqlite_sink_commits_in_batches(insta, tmp_path):
+    path = str(tmp_path / "items.sqlite")
+    sink = pl.SQLiteSink(path=path, batch_size=2)
+    posts = [insta.forming_timeline_post_data(post_data=make_post_node(f"a{n}")) for n in range(3)]
+
+    for post in posts:
+        sink.write("posts", post)
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone() == (2,)
+
+    sink.close()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone() == (3,)
+
+
+@pytest.mark.failed
+def test_pipeline_stops_on_error(insta, monkeypatch):
+    def broken(post_data):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(insta, "forming_timeline_post_data", broken)
+
+    with pytest.raises(RuntimeError):
+        pl.Pipeline(insta=insta, username="someone", content_types=["posts"],
+                    download=False, queue_size=1).run()
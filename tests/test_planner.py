@@ -0,0 +1,55 @@
+from app.insta_crawler import insta as i
+from app.insta_crawler.planner import CrawlPlanner
+from app.insta_crawler.rate_limit import RateLimiter
+import pytest
+from tests.fakes import FakeAuth, make_user_payload
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth, rate_limiter=RateLimiter(rate=2))
+    insta.requests = []
+
+    def make_request(url, params, headers=None):
+        username = url.rstrip("/").split("/")[-1]
+        insta.requests.append(username)
+        payload = make_user_payload(username=username, posts=120, is_private=username == "hidden")
+        user = payload["graphql"]["user"]
+        user["edge_followed_by"]["count"] = 1000
+        user["edge_felix_video_timeline"]["count"] = 3
+        return payload
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    return insta
+
+
+@pytest.mark.success
+def test_profile_cost(insta):
+    planner = CrawlPlanner(insta=insta, workers=4)
+
+    cost = planner.plan_profile("someone", content_types=["posts", "igtv", "followers"])
+
+    # 3 pages of posts, 1 page of igtvs, 20 pages of followers
+    assert cost.pages == 3 + 1 + 20
+    # every igtv and every follower is requested
+    assert cost.hydrations == 3 + 1000
+    assert cost.requests == 1 + 24 + 1003
+    assert cost.by_content == {"posts": 3, "igtv": 4, "followers": 1020}
+    assert cost.media_files == 120 + 3
+    # the rate limiter of the crawler sets the pace
+    assert cost.seconds == pytest.approx(cost.requests / 2 + cost.pauses / 4)
+    assert insta.requests == ["someone"]
+
+
+@pytest.mark.success
+def test_total_and_private_profiles(insta):
+    planner = CrawlPlanner(insta=insta, rate=10, workers=4, latency=1, hydrate=False)
+
+    costs = planner.plan(["someone", "hidden"], content_types=["followers"])
+    total = planner.total(costs)
+
+    assert [cost.private for cost in costs] == [False, True]
+    assert costs[1].requests == 1
+    assert total.requests == 2 + 20
+    # 4 requests of a second each at a time, below the rate
+    assert total.seconds == pytest.approx(22 / 4)
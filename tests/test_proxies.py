@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from app.insta_crawler import proxies as p
+from app.insta_crawler import resilience as r
+import pytest
+import requests
+
+
+@pytest.mark.success
+def test_concurrency_is_capped_per_proxy():
+    pool = p.ProxyPool(["http://a:1", "http://b:1"], max_concurrency=2)
+    lock = threading.Lock()
+    in_flight = {}
+    peaks = {}
+
+    def use(_):
+        with pool.lease() as proxy_lease:
+            url = proxy_lease.proxy.url
+            with lock:
+                in_flight[url] = in_flight.get(url, 0) + 1
+                peaks[url] = max(peaks.get(url, 0), in_flight[url])
+            time.sleep(0.02)
+            with lock:
+                in_flight[url] -= 1
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(use, range(24)))
+
+    assert max(peaks.values()) <= 2
+    assert all(proxy.in_flight == 0 for proxy in pool.proxies)
+
+
+@pytest.mark.success
+def test_faster_and_healthier_proxy_is_preferred():
+    pool = p.ProxyPool(["http://slow:1", "http://fast:1"])
+    slow, fast = pool.proxies
+    pool.record(slow, ok=True, latency=2.0)
+    pool.record(fast, ok=True, latency=0.1)
+
+    with pool.lease() as proxy_lease:
+        assert proxy_lease.proxy is fast
+
+    pool.record(fast, ok=False, latency=5.0)
+    pool.record(fast, ok=False, latency=5.0)
+    with pool.lease() as proxy_lease:
+        assert proxy_lease.proxy is slow
+
+
+@pytest.mark.failed
+def test_blocked_proxy_is_quarantined(monkeypatch):
+    pool = p.ProxyPool(["http://a:1", "http://b:1"], quarantine=60)
+    first = pool.proxies[0]
+
+    with pool.lease(session="crawler") as proxy_lease:
+        assert proxy_lease.proxy is first
+        proxy_lease.done(429)
+
+    assert pool.stats()[0]["quarantined"]
+    # the session moves to the healthy proxy
+    with pool.lease(session="crawler") as proxy_lease:
+        assert proxy_lease.proxy is pool.proxies[1]
+    assert pool.session_proxy("crawler") == "http://b:1"
+
+    with pytest.raises(RuntimeError):
+        with pool.lease() as proxy_lease:
+            raise RuntimeError("connection reset")
+    assert pool.proxies[1].failures_in_row == 1
+
+
+@pytest.mark.success
+def test_client_sends_requests_through_pool(monkeypatch):
+    used = []
+
+    def get(url, params=None, timeout=None, proxies=None, **kwargs):
+        used.append(proxies["https"])
+        if proxies["https"] == "http://a:1":
+            raise requests.exceptions.ConnectionError("refused")
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(r.requests, "get", get)
+    monkeypatch.setattr(r, "sleep", lambda seconds: None)
+    pool = p.ProxyPool(["http://a:1", "http://b:1"], max_failures=1)
+    client = r.ResilientClient(proxy_pool=pool)
+
+    assert client.get("https://www.instagram.com/someone/").status_code == 200
+    assert used == ["http://a:1", "http://b:1"]
+
+
+@pytest.mark.success
+def test_pool_from_file(tmp_path):
+    path = tmp_path / "proxies.txt"
+    path.write_text("http://a:1\n# spare\n\nhttp://user:secret@b:1  # paid\nhttp://a:1\n")
+
+    pool = p.ProxyPool.from_file(str(path), max_concurrency=4)
+
+    assert [proxy.url for proxy in pool.proxies] == ["http://a:1", "http://user:secret@b:1"]
+    assert pool.stats()[1]["proxy"] == "http://***@b:1"
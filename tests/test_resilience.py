@@ -0,0 +1,127 @@
+import threading
+import time
+
+from app.insta_crawler import resilience as r
+import pytest
+import requests
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200, headers: dict = None, name: str = "") -> None:
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.name = name
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def slept(monkeypatch) -> list:
+    slept = []
+    monkeypatch.setattr(r, "sleep", slept.append)
+    return slept
+
+
+def make_get(answers: list, sent: list):
+    def get(url, params=None, timeout=None, **kwargs):
+        sent.append(timeout)
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    return get
+
+
+@pytest.mark.success
+def test_transient_failures_are_retried(monkeypatch, slept):
+    sent = []
+    answers = [requests.exceptions.ConnectionError("reset"),
+               FakeResponse(503, {"Retry-After": "7"}),
+               FakeResponse(200)]
+    monkeypatch.setattr(r.requests, "get", make_get(answers, sent))
+    client = r.ResilientClient(policy=r.RetryPolicy(connect_timeout=3, read_timeout=9, backoff=0.5))
+
+    response = client.get("https://www.instagram.com/graphql/query/", params={"query_hash": "abc"})
+
+    assert response.status_code == 200
+    assert sent == [(3, 9)] * 3
+    assert slept[0] <= 0.5
+    assert slept[1] == 7
+
+
+@pytest.mark.failed
+def test_gives_up_after_attempts(monkeypatch, slept):
+    sent = []
+    monkeypatch.setattr(r.requests, "get", make_get([requests.exceptions.Timeout()] * 3, sent))
+    client = r.ResilientClient(policy=r.RetryPolicy(attempts=3))
+
+    with pytest.raises(requests.exceptions.Timeout):
+        client.get("https://www.instagram.com/someone/")
+
+    assert len(sent) == 3 and len(slept) == 2
+
+
+@pytest.mark.success
+def test_breaker_pauses_failing_endpoint(monkeypatch, slept):
+    sent = []
+    answers = [FakeResponse(500), FakeResponse(500), FakeResponse(200)]
+    monkeypatch.setattr(r.requests, "get", make_get(answers, sent))
+    breaker = r.CircuitBreaker(threshold=2, cooldown=30)
+    client = r.ResilientClient(policy=r.RetryPolicy(backoff=0.01), breaker=breaker)
+
+    client.get("https://i.instagram.com/api/v1/feed/reels_media/")
+
+    # the pause of the open circuit comes after the second failure
+    assert slept[-1] == pytest.approx(30, abs=1)
+    assert not breaker.is_open("i.instagram.com/api/v1/feed/reels_media")
+
+
+@pytest.mark.success
+def test_hedged_request_takes_the_faster_answer(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def get(url, params=None, timeout=None, **kwargs):
+        with lock:
+            calls.append(url)
+            number = len(calls)
+        if number == 1:
+            time.sleep(0.5)
+            return FakeResponse(name="slow")
+        return FakeResponse(name="fast")
+
+    monkeypatch.setattr(r.requests, "get", get)
+    client = r.ResilientClient(hedge_after=0.05)
+
+    response = client.get("https://www.instagram.com/someone/", hedge=True)
+
+    assert response.name == "fast"
+    assert client.hedges == 1
+
+
+@pytest.mark.success
+def test_hedged_request_takes_tokens_on_the_calling_thread(monkeypatch):
+    def get(url, params=None, timeout=None, **kwargs):
+        time.sleep(0.2)
+        return FakeResponse()
+
+    monkeypatch.setattr(r.requests, "get", get)
+    client = r.ResilientClient(hedge_after=0.05)
+    threads = []
+
+    client.get("https://www.instagram.com/someone/", hedge=True,
+               before_send=lambda: threads.append(threading.current_thread()))
+
+    # the rate limiter priority is kept per thread
+    assert threads == [threading.current_thread()] * 2
+
+
+@pytest.mark.success
+def test_endpoint_keys():
+    assert r.endpoint_key("https://www.instagram.com/graphql/query/", {"query_hash": "abc"}) \
+        == "www.instagram.com/graphql/query/abc"
+    assert r.endpoint_key("https://www.instagram.com/someone/") == "www.instagram.com/profile"
+    assert r.endpoint_key("https://www.instagram.com/p/shortcode/") == "www.instagram.com/p"
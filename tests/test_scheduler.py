@@ -0,0 +1,135 @@
+import threading
+import time
+
+from app.insta_crawler import insta as i
+from app.insta_crawler.rate_limit import RateLimiter
+from app.insta_crawler.scheduler import JobScheduler
+import pytest
+from tests.fakes import FakeAuth, make_user_payload
+
+
+class FakeCrawler:
+    def __init__(self) -> None:
+        self.rate_limiter = None
+        self.calls = []
+        self.release_followers = threading.Event()
+
+    def get_stories(self, url):
+        self.calls.append(("stories", url))
+        return ["storie"]
+
+    def get_posts(self, url):
+        self.calls.append(("posts", url))
+        return ["post"]
+
+    def get_followers(self, url):
+        self.calls.append(("followers", url))
+        self.release_followers.wait(5)
+        return {"count": 0}
+
+
+@pytest.mark.success
+def test_jobs_run_by_priority():
+    crawler = FakeCrawler()
+    crawler.release_followers.set()
+    scheduler = JobScheduler(insta=crawler, workers=2)
+    scheduler.submit("followers", "f")
+    scheduler.submit("posts", "p")
+    scheduler.submit("stories", "s")
+
+    scheduler.start()
+    scheduler.join()
+    scheduler.stop()
+
+    # the urgent worker only takes the stories job,
+    # the other one runs the rest by priority
+    assert crawler.calls.index(("posts", "p")) < crawler.calls.index(("followers", "f"))
+    assert all(job.status == "done" for job in scheduler.jobs.values())
+
+
+@pytest.mark.success
+def test_urgent_job_is_not_blocked_by_bulk_job():
+    crawler = FakeCrawler()
+    scheduler = JobScheduler(insta=crawler, workers=2)
+    scheduler.start()
+
+    followers = scheduler.submit("followers", "f")
+    time.sleep(0.05)
+    stories = scheduler.submit("stories", "s")
+
+    assert stories.wait(timeout=2)
+    assert stories.result == ["storie"]
+    assert not followers.done.is_set()
+
+    crawler.release_followers.set()
+    scheduler.join()
+    scheduler.stop()
+
+
+@pytest.mark.success
+def test_expired_job_is_skipped():
+    crawler = FakeCrawler()
+    scheduler = JobScheduler(insta=crawler, workers=2)
+    job = scheduler.submit("stories", "s", deadline=time.time() - 1)
+
+    scheduler.start()
+    scheduler.join()
+    scheduler.stop()
+
+    assert job.status == "expired"
+    assert crawler.calls == []
+
+
+@pytest.mark.failed
+def test_bad_jobs_are_not_stored():
+    scheduler = JobScheduler(insta=FakeCrawler(), workers=2)
+
+    with pytest.raises(ValueError):
+        scheduler.submit("posts", "p", priority="high")
+    with pytest.raises(ValueError):
+        scheduler.submit("posts", "p", deadline="tomorrow")
+    assert scheduler.jobs == {}
+
+
+@pytest.mark.success
+def test_rate_limiter_serves_higher_priority_first():
+    limiter = RateLimiter(rate=20, burst=1)
+    limiter.acquire()  # empty the bucket
+    order = []
+
+    def take(name: str, priority: int) -> None:
+        with limiter.priority(priority):
+            limiter.acquire()
+        order.append(name)
+
+    low = threading.Thread(target=take, args=("low", 0))
+    low.start()
+    time.sleep(0.01)
+    high = threading.Thread(target=take, args=("high", 100))
+    high.start()
+    low.join()
+    high.join()
+
+    assert order == ["high", "low"]
+
+
+@pytest.mark.success
+def test_new_posts_jobs_are_not_served_from_the_cache(monkeypatch):
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    profiles = []
+
+    def make_request(url, params, headers=None):
+        profiles.append(url)
+        return make_user_payload(posts=len(profiles))
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    scheduler = JobScheduler(insta=insta, workers=2)
+    scheduler.start()
+    first = scheduler.submit("new_posts", "https://www.instagram.com/someone/")
+    assert first.wait(timeout=2)
+    second = scheduler.submit("new_posts", "https://www.instagram.com/someone/")
+    assert second.wait(timeout=2)
+    scheduler.stop()
+
+    assert len(profiles) == 2
+    assert (len(first.result), len(second.result)) == (1, 2)
@@ -0,0 +1,70 @@
+import json
+
+from app.insta_crawler import pipeline as pl
+from app.insta_crawler.models import IGTV, Post
+from app.insta_crawler.search import extract_tags, SearchIndex
+import pytest
+
+
+def make_post(shortcode: str, description: str, owner: str = "someone") -> Post:
+    return Post(description=description, likes=0, comments=0, owner_link="", owner_username=owner,
+                post_content=[], post_content_len=0, posted_at=0, shortcode=shortcode, post_link="")
+
+
+@pytest.fixture
+def index(tmp_path) -> SearchIndex:
+    index = SearchIndex(path=str(tmp_path / "search.sqlite"))
+    index.add("posts", [
+        make_post("a", "Sunset at the beach #Travel #sea with @Friend."),
+        make_post("b", "Coffee and code #work"),
+        make_post("c", "Beach volleyball #travel", owner="other"),
+    ])
+    index.add("igtv", [IGTV(title="Beach vlog", **dict(make_post("d", "day one #travel")))])
+    index.add("users", [{"username": "traveller", "full_name": "Sea Lover", "bio": "Beaches and sunsets"}])
+    return index
+
+
+@pytest.mark.success
+def test_tags_are_extracted():
+    assert extract_tags("#Sun and #sun, @some.one. #café") == (["sun", "café"], ["some.one"])
+
+
+@pytest.mark.success
+def test_search_ranks_and_filters(index):
+    hits = index.search("beach")
+    assert {hit.key for hit in hits} == {"a", "c", "d"}
+    assert hits[0].rank >= hits[-1].rank
+
+    assert [hit.key for hit in index.search(hashtags=["travel"], mentions=["friend"])] == ["a"]
+    assert [hit.key for hit in index.search("beach", kind="posts", owner_username="other")] == ["c"]
+    # no stemming, but prefix queries work
+    assert [hit.key for hit in index.search("sunset*", kind="users")] == ["traveller"]
+    assert "[Sunset]" in index.search("sunset", kind="posts")[0].snippet
+
+
+@pytest.mark.success
+def test_items_are_replaced_and_exports_imported(index, tmp_path):
+    index.add("posts", [make_post("b", "Tea now #rest")])
+    assert index.search("coffee") == []
+    assert index.stats() == {"igtv": 1, "posts": 3, "users": 1}
+
+    export = tmp_path / "someone_data.json"
+    export.write_text(json.dumps({
+        "posts": [dict(make_post("e", "Mountains #hike"))],
+        "count": 1,
+        "followers": [{"username": "hiker", "full_name": None, "bio": "I #hike"}],
+    }))
+    assert index.import_file(str(export)) == 2
+    assert sorted(hit.key for hit in index.search(hashtags=["hike"])) == ["e", "hiker"]
+
+
+@pytest.mark.success
+def test_pipeline_sink_fills_the_index(tmp_path):
+    path = str(tmp_path / "search.sqlite")
+    sink = pl.SearchSink(index=SearchIndex(path=path), batch_size=2)
+    for number in range(5):
+        sink.write("posts", make_post(f"p{number}", f"post number {number} #batch"))
+    sink.write("stories", make_post("s", "stories have no text"))
+    sink.close()
+
+    assert SearchIndex(path=path).stats() == {"posts": 5}
@@ -0,0 +1,98 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from app.insta_crawler.scheduler import JobScheduler
+from app.insta_crawler.service import CrawlerService
+import pytest
+
+
+class FakeCrawler:
+    def __init__(self) -> None:
+        self.rate_limiter = None
+        self.release = threading.Event()
+
+    def iter_posts(self, url):
+        yield {"shortcode": "first", "url": url}
+        self.release.wait(5)
+        yield {"shortcode": "second", "url": url}
+
+    def get_stories(self, url):
+        return [{"id": 1}]
+
+
+@pytest.fixture
+def crawler():
+    return FakeCrawler()
+
+
+@pytest.fixture
+def make_service(crawler):
+    services = []
+
+    def make(token=None) -> CrawlerService:
+        service = CrawlerService(scheduler=JobScheduler(insta=crawler, workers=2), port=0, token=token)
+        service.start()
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        service.shutdown()
+
+
+def call(service, method, path, body=None, token=None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    data = json.dumps(body).encode() if body is not None else None
+    request = Request(f"http://{service.address[0]}:{service.address[1]}{path}", data=data,
+                      headers=headers, method=method)
+    try:
+        with urlopen(request, timeout=5) as response:
+            return response.status, response.read().decode()
+    except HTTPError as e:
+        return e.code, e.read().decode()
+
+
+@pytest.mark.success
+def test_job_is_streamed_and_finished(make_service, crawler):
+    service = make_service()
+    status, body = call(service, "POST", "/jobs", {"content_type": "posts", "username": "someone"})
+    assert status == 202
+    job_id = json.loads(body)["job_id"]
+
+    # the first post comes before the job is finished
+    request = Request(f"http://{service.address[0]}:{service.address[1]}/jobs/{job_id}/stream")
+    with urlopen(request, timeout=5) as response:
+        assert json.loads(response.readline())["shortcode"] == "first"
+        assert json.loads(call(service, "GET", f"/jobs/{job_id}")[1])["status"] == "running"
+        crawler.release.set()
+        lines = [json.loads(line) for line in response.read().splitlines()]
+
+    assert lines[0]["shortcode"] == "second"
+    assert lines[-1]["job"]["status"] == "done"
+
+    status, body = call(service, "GET", f"/jobs/{job_id}/result")
+    assert status == 200
+    assert [post["shortcode"] for post in json.loads(body)["result"]] == ["first", "second"]
+    assert call(service, "DELETE", f"/jobs/{job_id}")[0] == 200
+    assert call(service, "GET", f"/jobs/{job_id}")[0] == 404
+
+
+@pytest.mark.failed
+def test_bad_jobs_are_refused(make_service):
+    service = make_service()
+    assert call(service, "POST", "/jobs", {"content_type": "nothing", "username": "someone"})[0] == 400
+    assert call(service, "POST", "/jobs", {"content_type": "stories"})[0] == 400
+    assert call(service, "POST", "/jobs", {"content_type": "posts", "username": "x", "deadline": "tomorrow"})[0] == 400
+    assert call(service, "POST", "/jobs", {"content_type": "posts", "username": "x", "priority": "high"})[0] == 400
+    assert call(service, "GET", "/jobs/12")[0] == 404
+    assert json.loads(call(service, "GET", "/health")[1])["jobs"] == {}
+
+
+@pytest.mark.failed
+def test_token_is_required(make_service):
+    service = make_service(token="secret")
+    assert call(service, "GET", "/jobs")[0] == 401
+    assert call(service, "GET", "/jobs", token="wrong")[0] == 401
+    assert call(service, "GET", "/jobs", token="secret") == (200, "[]")
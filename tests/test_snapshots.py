@@ -0,0 +1,53 @@
+from app.insta_crawler import snapshots as sn
+import pytest
+
+
+def make(ids, owner="owner"):
+    result = {"user_ids": ids, "usernames": [f"user{user_id}" for user_id in ids]}
+    return sn.make_snapshot(result=result, owner=owner, taken_at=1600000000.5)
+
+
+@pytest.mark.success
+def test_save_and_load(tmp_path):
+    snapshot = make([5, 3, 9, 3])
+    path = sn.save_snapshot(snapshot, path=str(tmp_path / "a.igsn"))
+
+    loaded = sn.load_snapshot(path)
+    assert list(loaded.user_ids) == [3, 5, 9]
+    assert loaded.usernames == ["user3", "user5", "user9"]
+    assert loaded.owner == "owner"
+    assert loaded.relation == "followers"
+    assert loaded.taken_at == 1600000000.5
+
+
+@pytest.mark.success
+def test_load_empty(tmp_path):
+    path = sn.save_snapshot(make([]), path=str(tmp_path / "empty.igsn"))
+    loaded = sn.load_snapshot(path)
+
+    assert len(loaded) == 0
+    assert loaded.usernames == []
+
+
+@pytest.mark.success
+def test_diff():
+    added, lost = sn.diff(make([1, 2, 3, 7]), make([2, 3, 4, 8, 9]))
+
+    assert list(added) == [4, 8, 9]
+    assert list(lost) == [1, 7]
+
+
+@pytest.mark.success
+def test_overlap():
+    common = sn.overlap([make([1, 2, 3, 4, 5]), make([2, 4, 6]), make([0, 2, 4, 5])])
+
+    assert list(common) == [2, 4]
+
+
+@pytest.mark.failed
+def test_bad_file(tmp_path):
+    path = tmp_path / "bad.igsn"
+    path.write_bytes(b"x" * 64)
+
+    with pytest.raises(ValueError):
+        sn.load_snapshot(str(path))
@@ -0,0 +1,114 @@
+import time
+
+from app.insta_crawler import insta as i
+from app.insta_crawler import stories_watcher as sw
+from app.insta_crawler.exceptions import BlockedByInstagramError, NotFoundError
+from app.insta_crawler.stories_watcher import StoriesWatcher
+import pytest
+from tests.fakes import FakeAuth, make_reel, make_user_payload
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    insta.stories_batch_size = 2
+    insta.requests = []
+    insta.active = {}
+
+    def make_request(url, params, headers=None):
+        insta.requests.append(params)
+        if "reel_ids" in params:
+            return {"reels_media": [insta.active[reel_id] for reel_id in params["reel_ids"]
+                                    if reel_id in insta.active]}
+        username = url.rstrip("/").split("/")[-1]
+        return make_user_payload(username=username, user_id=int(username[1:]))
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    monkeypatch.setattr(insta, "_stories_headers", lambda: {})
+    return insta
+
+
+@pytest.mark.success
+def test_stories_are_batched_and_diffed(insta, tmp_path):
+    now = int(time.time())
+    insta.active = {
+        "1": make_reel(1, "u1", [10, 11], now),
+        "3": make_reel(3, "u3", [30], now),
+    }
+    state_path = str(tmp_path / "state.json")
+    watcher = StoriesWatcher(insta=insta, usernames=["u1", "u2", "u3"], state_path=state_path)
+
+    first = watcher.poll_once()
+    assert sorted(storie.shortcode for storie in first) == [101, 111, 303]
+    # 3 user lookups and 2 stories requests for 3 users
+    assert len(insta.requests) == 5
+
+    insta.requests.clear()
+    insta.active["2"] = make_reel(2, "u2", [20], now)
+    second = StoriesWatcher(insta=insta, usernames=["u1", "u2", "u3"], state_path=state_path).poll_once()
+    assert [storie.shortcode for storie in second] == [202]
+    # user ids come from the state file
+    assert len(insta.requests) == 2
+
+
+@pytest.mark.failed
+def test_unavailable_users_are_not_looked_up_every_poll(insta, tmp_path, monkeypatch):
+    lookup = insta._make_request
+
+    def make_request(url, params, headers=None):
+        if url.rstrip("/").endswith("u2"):
+            insta.requests.append(params)
+            raise NotFoundError()
+        return lookup(url, params, headers)
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    state_path = str(tmp_path / "state.json")
+    StoriesWatcher(insta=insta, usernames=["u1", "u2"], state_path=state_path).poll_once()
+    insta.requests.clear()
+
+    watcher = StoriesWatcher(insta=insta, usernames=["u1", "u2"], state_path=state_path)
+    watcher.poll_once()
+    # only the stories request
+    assert len(insta.requests) == 1
+
+    watcher.unavailable["u2"] = time.time() - 1
+    watcher.poll_once()
+    assert len(insta.requests) == 3
+
+
+@pytest.mark.failed
+def test_watch_backs_off_after_failed_polls(insta, tmp_path, monkeypatch):
+    polls = iter([BlockedByInstagramError(), BlockedByInstagramError(), []])
+    sleeps = []
+    found = []
+
+    def poll_once(on_new=None):
+        result = next(polls)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    watcher = StoriesWatcher(insta=insta, usernames=["u1"], state_path=str(tmp_path / "state.json"))
+    monkeypatch.setattr(watcher, "poll_once", poll_once)
+    monkeypatch.setattr(sw.time, "sleep", sleeps.append)
+
+    watcher.watch(on_new=found.extend, interval=100, cycles=3)
+
+    assert found == []
+    assert [round(seconds, -1) for seconds in sleeps] == [200, 400]
+
+
+@pytest.mark.failed
+def test_stories_are_seen_only_after_on_new(insta, tmp_path):
+    insta.active = {"1": make_reel(1, "u1", [10], int(time.time()))}
+    state_path = str(tmp_path / "state.json")
+
+    def on_new(stories):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        StoriesWatcher(insta=insta, usernames=["u1"], state_path=state_path).poll_once(on_new=on_new)
+
+    found = []
+    StoriesWatcher(insta=insta, usernames=["u1"], state_path=state_path).poll_once(on_new=found.extend)
+    assert [storie.shortcode for storie in found] == [101]
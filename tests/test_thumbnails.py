@@ -0,0 +1,79 @@
+import os
+
+from app.insta_crawler import utils
+from app.insta_crawler.models import Post
+from app.insta_crawler.thumbnails import Thumbnailer
+from PIL import Image
+import pytest
+
+
+def make_image(path, size=(200, 100), color=(255, 0, 0)) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, color).save(path)
+    return str(path)
+
+
+@pytest.fixture
+def downloads(tmp_path):
+    root = tmp_path / "downloads"
+    make_image(root / "someone" / "posts" / "a.jpg")
+    make_image(root / "someone" / "posts" / "b.png", size=(50, 80))
+    make_image(root / "other" / "stories" / "c.jpg")
+    (root / "someone" / "posts" / "notes.txt").write_text("not media")
+    return root
+
+
+def make_thumbnailer(tmp_path, root) -> Thumbnailer:
+    return Thumbnailer(index_path=str(tmp_path / "thumbnails.sqlite"), root=str(root),
+                       output_dir=str(tmp_path / "thumbnails"), size=64, workers=2)
+
+
+@pytest.mark.success
+def test_thumbnails_are_made_once(tmp_path, downloads):
+    with make_thumbnailer(tmp_path, downloads) as thumbnailer:
+        assert thumbnailer.scan() == 3
+    assert thumbnailer.counts == {"made": 3, "skipped": 0, "failed": 0}
+
+    thumbnail = tmp_path / "thumbnails" / "someone" / "posts" / "b.jpg"
+    with Image.open(thumbnail) as image:
+        assert image.size == (64, 64)
+    assert str(thumbnail) in [item.thumbnail for item in thumbnailer.index.all()]
+
+    # only the changed file is made again
+    make_image(downloads / "someone" / "posts" / "a.jpg", color=(0, 0, 255))
+    with make_thumbnailer(tmp_path, downloads) as thumbnailer:
+        thumbnailer.scan()
+    assert thumbnailer.counts == {"made": 1, "skipped": 2, "failed": 0}
+
+
+@pytest.mark.failed
+def test_broken_media_is_recorded(tmp_path, downloads):
+    (downloads / "someone" / "posts" / "broken.jpg").write_bytes(b"not an image")
+    with make_thumbnailer(tmp_path, downloads) as thumbnailer:
+        thumbnailer.scan()
+
+    assert thumbnailer.counts["failed"] == 1
+    broken = [item for item in thumbnailer.index.all() if item.error]
+    assert [os.path.basename(item.source) for item in broken] == ["broken.jpg"]
+    assert broken[0].thumbnail is None
+
+
+@pytest.mark.success
+def test_downloads_are_thumbnailed_as_they_finish(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def download_file(url, content_type, username, name):
+        return make_image(tmp_path / "downloads" / username / content_type / name)
+
+    monkeypatch.setattr(utils, "download_file", download_file)
+    post = Post(likes=0, comments=0, owner_link="", owner_username="someone", post_link="/p/x/",
+                post_content=["https://cdn.example.com/1.jpg", "https://cdn.example.com/2.jpg"],
+                post_content_len=2, posted_at=0, shortcode="x")
+
+    with make_thumbnailer(tmp_path, tmp_path / "downloads") as thumbnailer:
+        failed = utils.download_all(posts=[post], content_type="posts", username="someone",
+                                    progress=False, on_file=thumbnailer.submit)
+
+    assert failed == []
+    assert thumbnailer.counts["made"] == 2
+    assert len(os.listdir(tmp_path / "thumbnails" / "someone" / "posts")) == 2
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from app.insta_crawler import insta as i
+from app.insta_crawler.cache import UserCache
+import pytest
+from tests.fakes import FakeAuth, make_user_payload
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    insta.requests = []
+
+    def make_request(url, params, headers=None):
+        insta.requests.append(url)
+        time.sleep(0.05)
+        return make_user_payload(username=url.rstrip("/").split("/")[-1])
+
+    monkeypatch.setattr(insta, "_make_request", make_request)
+    return insta
+
+
+@pytest.mark.success
+def test_same_profile_is_requested_once(insta):
+    url = "https://www.instagram.com/someone/"
+    first = insta.get_user_info(url=url)
+    second = insta.get_user_info(url="https://www.instagram.com/SomeOne")
+
+    assert first is second
+    assert len(insta.requests) == 1
+    assert insta.user_cache.get(user_id=42) is first
+
+
+@pytest.mark.success
+def test_full_user_serves_projections_but_not_back(insta):
+    insta.get_user_info(url="https://www.instagram.com/a/", fields=["username"])
+    insta.get_user_info(url="https://www.instagram.com/a/", fields=["username"])
+    assert len(insta.requests) == 1
+
+    full = insta.get_user_info(url="https://www.instagram.com/a/")
+    assert len(insta.requests) == 2
+    assert len(full.last_twelve_posts) == 12
+
+    insta.get_user_info(url="https://www.instagram.com/a/", fields=["user_id"])
+    assert len(insta.requests) == 2
+
+
+@pytest.mark.success
+def test_concurrent_requests_are_coalesced(insta):
+    url = "https://www.instagram.com/someone/"
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        users = list(pool.map(lambda _: insta.get_user_info(url=url), range(8)))
+
+    assert len(insta.requests) == 1
+    assert all(user is users[0] for user in users)
+
+
+@pytest.mark.success
+def test_errors_are_shared_and_not_cached():
+    cache = UserCache()
+    calls = []
+    started = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        raise RuntimeError("boom")
+
+    def load():
+        with pytest.raises(RuntimeError):
+            cache.get_or_load("x", loader)
+
+    follower = threading.Thread(target=lambda: (started.wait(), load()))
+    follower.start()
+    load()
+    follower.join()
+
+    assert len(calls) == 1
+    assert cache.get(username="x") is None
+
+
+@pytest.mark.success
+def test_expired_users_are_reloaded(insta):
+    insta.user_cache.ttl = 0.01
+    insta.get_user_info(url="https://www.instagram.com/a/")
+    time.sleep(0.02)
+    insta.get_user_info(url="https://www.instagram.com/a/")
+
+    assert len(insta.requests) == 2
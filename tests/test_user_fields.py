@@ -0,0 +1,42 @@
+from app.insta_crawler import insta as i
+from app.insta_crawler.models import User
+import pytest
+from tests.fakes import FakeAuth, make_user_payload
+
+
+@pytest.fixture
+def insta(monkeypatch) -> i.InstaCrawler:
+    insta = i.InstaCrawler(login="", password="", authenticator=FakeAuth)
+    monkeypatch.setattr(insta, "_make_request", lambda url, params, headers=None: make_user_payload())
+    return insta
+
+
+@pytest.mark.success
+def test_get_user_info_all_fields(insta):
+    user = insta.get_user_info(url="https://www.instagram.com/someone/")
+
+    assert isinstance(user, User)
+    assert len(user.last_twelve_posts) == 12
+    assert user.posts_count == 12
+
+
+@pytest.mark.success
+def test_get_user_info_projection_skips_posts(insta, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("posts should not be parsed")
+
+    monkeypatch.setattr(insta, "forming_post_data", fail)
+    user = insta.get_user_info(url="https://www.instagram.com/someone/",
+                               fields=["username", "user_id", "followed_by"])
+
+    assert user.username == "someone"
+    assert user.user_id == 42
+    assert user.followed_by == 100
+    assert user.is_private is False
+    assert "last_twelve_posts" not in dict(user)
+
+
+@pytest.mark.failed
+def test_get_user_info_unknown_field(insta):
+    with pytest.raises(ValueError):
+        insta.get_user_info(url="https://www.instagram.com/someone/", fields=["nope"])
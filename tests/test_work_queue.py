@@ -0,0 +1,81 @@
+import time
+
+from app.insta_crawler import work_queue as wq
+import pytest
+
+
+class FakeCrawler:
+    BASE_URL = "https://www.instagram.com/"
+
+    def __init__(self) -> None:
+        self.requested = []
+
+    def get_user_info(self, url, fields=None):
+        self.requested.append(url)
+        if "broken" in url:
+            raise RuntimeError("boom")
+        return {"user_url": url}
+
+
+@pytest.fixture
+def queue(tmp_path) -> wq.SQLiteQueue:
+    return wq.SQLiteQueue(path=str(tmp_path / "queue.sqlite"), max_attempts=2)
+
+
+@pytest.mark.success
+def test_lease_and_ack(queue):
+    wq.enqueue_profiles(queue=queue, usernames=["a", "b"])
+
+    first = queue.lease(worker="w1", lease_seconds=60)
+    second = queue.lease(worker="w2", lease_seconds=60)
+    assert first.payload["username"] == "a"
+    assert second.payload["username"] == "b"
+    assert queue.lease(worker="w3", lease_seconds=60) is None
+
+    queue.ack(first)
+    assert queue.stats() == {"pending": 1, "done": 1, "failed": 0}
+
+
+@pytest.mark.success
+def test_expired_lease_is_retried(queue):
+    wq.enqueue_profiles(queue=queue, usernames=["a"])
+
+    task = queue.lease(worker="w1", lease_seconds=0.01)
+    time.sleep(0.05)
+    retried = queue.lease(worker="w2", lease_seconds=60)
+    assert retried.task_id == task.task_id
+    assert retried.attempts == 2
+
+    # the first worker lost the lease, its ack is ignored
+    queue.ack(task)
+    assert queue.stats()["done"] == 0
+
+
+@pytest.mark.success
+def test_tasks_are_put_per_kind(queue):
+    assert wq.enqueue_profiles(queue=queue, usernames=iter(["a", "b"]), kinds=["user_info", "posts"]) == 4
+
+    tasks = [queue.lease(worker="w1", lease_seconds=60) for _ in range(4)]
+    assert [(task.kind, task.payload["username"]) for task in tasks] == [
+        ("user_info", "a"), ("user_info", "b"), ("posts", "a"), ("posts", "b")]
+    assert queue.stats()["pending"] == 4
+
+
+@pytest.mark.success
+def test_worker_stores_results(queue, tmp_path):
+    sink = wq.SQLiteResultSink(path=str(tmp_path / "results.sqlite"))
+    crawler = FakeCrawler()
+    wq.enqueue_profiles(queue=queue, usernames=["a", "broken"])
+
+    processed = wq.Worker(insta=crawler, queue=queue, sink=sink).run()
+
+    assert processed == 3  # the broken task is retried once
+    assert queue.stats() == {"pending": 0, "done": 1, "failed": 1}
+    results = list(sink.read())
+    assert [result["data"]["user_url"] for result in results] == ["https://www.instagram.com/a/"]
+
+
+@pytest.mark.failed
+def test_unknown_kind(queue):
+    with pytest.raises(ValueError):
+        wq.enqueue_profiles(queue=queue, usernames=["a"], kinds=["nope"])